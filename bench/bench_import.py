@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 25.10.26 14:05
+
+@author: pavel
+
+Import of a large ssh client configuration: Host blocks spread over
+Include files with a few wildcard blocks. Measures the first import,
+an unchanged re-import and a re-import after one host has changed.
+Prints JSON results.
+
+usage: bench_import.py [hosts] [include_files]
+"""
+import os
+import sys
+import json
+import tempfile
+
+from time import monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import autossh_log
+import autossh_preferences
+
+from autossh_import import SshConfigImporter
+
+HEADER = """# generated by bench_import.py
+Host *.internal
+    ProxyJump bastion
+    ServerAliveInterval 30
+
+Host *
+    ForwardAgent no
+    IdentityFile ~/.ssh/id_%r
+"""
+
+HOST = """
+Host host{0} host{0}.internal
+    HostName 10.{1}.{2}.{3}
+    Port {4}
+    User user{5}
+    ProxyCommand "ssh -W %h:%p gw{5}"
+"""
+
+
+def write_configs(directory, hosts, include_files):
+    include_dir = os.path.join(directory, "config.d")
+    os.makedirs(include_dir)
+    files = [open(os.path.join(include_dir, "part{0:03d}".format(i)), "w")
+             for i in range(include_files)]
+    for i in range(hosts):
+        files[i % include_files].write(HOST.format(i, i // 65536, i // 256 % 256, i % 256,
+                                                   22 + i % 3, i % 10))
+    for f in files:
+        f.close()
+
+    path = os.path.join(directory, "config")
+    with open(path, "w") as f:
+        f.write("Include {0}/*\n".format(include_dir))
+        f.write(HEADER)
+    return path, os.path.join(include_dir, "part000")
+
+
+def timed(importer, path):
+    started = monotonic()
+    report = importer.run(path)
+    return (monotonic() - started) * 1000, {key: len(ids) for key, ids in report.items()}
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) >= 2 else 5000
+    include_files = int(sys.argv[2]) if len(sys.argv) >= 3 else 50
+
+    autossh_log.dispatcher.remove_handler(autossh_log.stdout_hadler)
+    autossh_log.dispatcher.remove_handler(autossh_log.stderr_handler)
+
+    directory = tempfile.mkdtemp()
+    path, first_part = write_configs(directory, hosts, include_files)
+
+    conf_file = os.path.join(directory, "autossh-gui.json")
+    preferences = autossh_preferences.Preferences(conf_file)
+    importer = SshConfigImporter.from_preferences(preferences)
+
+    first_ms, first = timed(importer, path)
+    started = monotonic()
+    preferences.flush()
+    save_ms = (monotonic() - started) * 1000
+
+    again_ms, again = timed(importer, path)
+
+    with open(first_part, "a") as f:
+        f.write("\nHost host0\n    Port 2222\n")  # first value wins, the block before it is kept
+    with open(first_part) as f:
+        content = f.read().replace("HostName 10.0.0.0\n", "HostName 10.99.0.0\n", 1)
+    with open(first_part, "w") as f:
+        f.write(content)
+    changed_ms, changed = timed(importer, path)
+
+    profile = preferences.get("ssh_profiles", first["added"] and 1)
+    print(json.dumps({"hosts": hosts,
+                      "aliases": first["added"],
+                      "import_ms": first_ms,
+                      "save_ms": save_ms,
+                      "reimport_unchanged_ms": again_ms,
+                      "reimport_unchanged": again,
+                      "reimport_one_changed_ms": changed_ms,
+                      "reimport_one_changed": changed,
+                      "sample_profile": profile}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 22.10.26 15:40
+
+@author: pavel
+
+CPU cost of the log pipeline for noisy tunnels: lines logged the way the
+supervisor does, through the dispatcher to LimLogHandler with one observer
+attached and a console handler writing to /dev/null.
+Prints JSON results, compare "plain" and "coalesced" entries.
+
+usage: bench_log.py [lines] [profiles]
+"""
+import os
+import sys
+import json
+import logging
+
+from time import process_time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import autossh_log
+
+from autossh_log import LimLogHandler, LogCoalescer, profile_extra, dispatcher
+
+# typical AUTOSSH_DEBUG=1 and ssh -v chatter, mostly repeated
+LINES = ["debug1: client_input_global_request: rtype keepalive@openssh.com want_reply 1"] * 8 + \
+        ["autossh[1234]: check on child 1235", "autossh[1234]: set alarm for 600 secs"]
+
+
+def run(lines, profiles, coalescer):
+    dispatcher.coalescer = coalescer
+    handler = LimLogHandler(1000)
+    console = logging.StreamHandler(open(os.devnull, "w"))
+    dispatcher.add_handler(console)
+    delivered = [0]
+
+    def on_entry(msg):
+        delivered[0] += 1
+    handler.add_observer("bench", on_entry)
+
+    logger = logging.getLogger("bench")
+    extras = [profile_extra(id_) for id_ in range(profiles)]
+
+    started = process_time()
+    for i in range(lines):
+        profile_id = i % profiles
+        args = ("bench", LINES[(i // profiles) % len(LINES)])
+        if not dispatcher.absorbed(profile_id, logging.INFO, "%s: %s", args):
+            logger.info("%s: %s", *args, extra=extras[profile_id])
+    cpu = process_time() - started
+
+    dispatcher.remove_handler(handler)
+    dispatcher.remove_handler(console)
+    console.stream.close()
+    return {"lines": lines,
+            "cpu_s": cpu,
+            "us_per_line": cpu / lines * 1e6,
+            "delivered": delivered[0]}
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) >= 2 else 200000
+    profiles = int(sys.argv[2]) if len(sys.argv) >= 3 else 10
+
+    autossh_log.dispatcher.remove_handler(autossh_log.stdout_hadler)
+    autossh_log.dispatcher.remove_handler(autossh_log.stderr_handler)
+
+    results = {"plain": run(lines, profiles, None),
+               "coalesced": run(lines, profiles, LogCoalescer())}
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 27.10.26 10:30
+
+@author: pavel
+
+Log tab search over a large retained history: cost of keeping the index
+up to date while lines arrive, and latency of the filter bar queries
+with the index against a scan formatting every record.
+Prints JSON results.
+
+usage: bench_log_search.py [lines] [profiles]
+"""
+import os
+import gc
+import sys
+import json
+import logging
+
+from time import perf_counter, process_time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import autossh_log
+
+from autossh_log import LimLogHandler, profile_extra
+from autossh_log_index import LogIndex, LogQuery
+
+QUERIES = {"text": {"text": "port 31999"},
+           "text_partial": {"text": "ort 3199"},
+           "text_common": {"text": "dynamic-tcpip"},
+           "profile_text": {"profile_id": 3, "text": "port 31993"},
+           "warnings": {"min_level": logging.WARNING},
+           "regex": {"text": r"channel 4\d:"},
+           "window_text": {"window": 3600, "text": "port 3000"}}
+
+
+def fill(lines, profiles):
+    logger = logging.getLogger("bench")
+    extras = [profile_extra(id_) for id_ in range(profiles)]
+    started = process_time()
+    for i in range(lines):
+        logger.log(logging.WARNING if i % 97 == 0 else logging.INFO, "%s: %s", "host{0}".format(i % profiles),
+                   "debug1: channel {0}: new [dynamic-tcpip] from 127.0.0.1 port {1}".format(
+                       i % 50, 30000 + i % 2000),
+                   extra=extras[i % profiles])
+    return (process_time() - started) / lines * 1e6
+
+
+def scan(handler, query):
+    """Search without the index"""
+    matches = []
+    for profile_id, entries in handler.select(query.profile_id, query.min_level):
+        for seq, created, levelno, msg, args in entries:
+            text = handler.formatter.format_message(msg, args)
+            if levelno >= query.min_level and (query.pattern is None or query.pattern.search(text)):
+                matches.append(seq)
+    return len(matches)
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) >= 2 else 100000
+    profiles = int(sys.argv[2]) if len(sys.argv) >= 3 else 10
+
+    autossh_log.dispatcher.remove_handler(autossh_log.stdout_hadler)
+    autossh_log.dispatcher.remove_handler(autossh_log.stderr_handler)
+
+    handler = LimLogHandler(lines // profiles, 256 * 1024 * 1024)
+    plain_us = fill(lines, profiles)
+
+    started = perf_counter()
+    index = LogIndex(handler)
+    attach_ms = (perf_counter() - started) * 1000
+
+    # the same number of lines again, every one indexed and an old one trimmed
+    indexed_us = fill(lines, profiles)
+
+    queries = {}
+    for name, fields in QUERIES.items():
+        query = LogQuery(**fields)
+        gc.collect()  # not a collection of the lines filled before
+        started = perf_counter()
+        matches, total = index.search(query)
+        indexed_ms = (perf_counter() - started) * 1000
+
+        gc.collect()
+        started = perf_counter()
+        scanned = scan(handler, query)
+        scan_ms = (perf_counter() - started) * 1000
+        queries[name] = {"matches": total,
+                         "same_as_scan": total == scanned,
+                         "index_ms": indexed_ms,
+                         "scan_ms": scan_ms}
+
+    print(json.dumps({"lines": lines,
+                      "profiles": profiles,
+                      "retained": len(index.records),
+                      "tokens": len(index.postings),
+                      "append_us_per_line": plain_us,
+                      "append_indexed_us_per_line": indexed_us,
+                      "attach_ms": attach_ms,
+                      "queries": queries}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
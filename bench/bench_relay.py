@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 18.10.26 16:20
+
+@author: pavel
+
+Throughput and latency of the accounting relay against a local echo server.
+Prints JSON results, compare "direct" and "relay" entries.
+
+usage: bench_relay.py [megabytes] [round_trips]
+"""
+import os
+import sys
+import json
+import socket
+import threading
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from autossh_relay import RelayServer, free_port, LOCALHOST
+
+CHUNK = 256 * 1024
+
+
+def echo_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((LOCALHOST, 0))
+    server.listen(16)
+
+    def serve(conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            while True:
+                data = conn.recv(CHUNK)
+                if not data:
+                    break
+                conn.sendall(data)
+
+    def accept():
+        while True:
+            conn, addr = server.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def throughput(port, megabytes):
+    total = megabytes * 1024 * 1024
+    payload = os.urandom(CHUNK)
+
+    with socket.create_connection((LOCALHOST, port)) as sock:
+        def send():
+            sent = 0
+            while sent < total:
+                sock.sendall(payload)
+                sent += len(payload)
+            sock.shutdown(socket.SHUT_WR)
+
+        started = perf_counter()
+        sender = threading.Thread(target=send)
+        sender.start()
+
+        received = 0
+        while received < total:
+            data = sock.recv(CHUNK)
+            if not data:
+                break
+            received += len(data)
+        sender.join()
+        elapsed = perf_counter() - started
+
+    return {"megabytes": megabytes, "seconds": elapsed,
+            "mb_per_s": received / elapsed / 1024 / 1024}
+
+
+def latency(port, round_trips):
+    samples = []
+    with socket.create_connection((LOCALHOST, port)) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for i in range(round_trips):
+            started = perf_counter()
+            sock.sendall(b"x")
+            sock.recv(1)
+            samples.append(perf_counter() - started)
+
+    samples.sort()
+    return {"round_trips": round_trips,
+            "p50_us": samples[len(samples) // 2] * 1e6,
+            "p99_us": samples[int(len(samples) * 0.99)] * 1e6}
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) >= 2 else 512
+    round_trips = int(sys.argv[2]) if len(sys.argv) >= 3 else 5000
+
+    echo_port = echo_server()
+
+    relay_server = RelayServer()
+    relay_server.start()
+    relay_port = free_port()
+    relay_server.add("bench", relay_port, echo_port).result()
+
+    results = {"direct": {"throughput": throughput(echo_port, megabytes),
+                          "latency": latency(echo_port, round_trips)},
+               "relay": {"throughput": throughput(relay_port, megabytes),
+                         "latency": latency(relay_port, round_trips)}}
+
+    stats = relay_server.stats("bench")
+    stats.pop("durations")
+    results["relay"]["stats"] = stats
+
+    relay_server.stop()
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
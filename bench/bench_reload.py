@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 24.10.26 15:20
+
+@author: pavel
+
+Live reload of the configuration file: one profile of a large config is
+changed by another program while tunnels are running. Measures the time
+from the file replace to the applied change, the reload itself and the
+number of tunnels touched. Prints JSON results.
+
+usage: bench_reload.py [profiles] [running]
+"""
+import os
+import sys
+import json
+import tempfile
+import threading
+
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import autossh_log
+import autossh_preferences
+
+from autossh_manager import TunnelManager
+from autossh_watcher import ConfigWatcher
+
+from bench_supervisor import make_config, wait_for, FAKE_AUTOSSH
+
+
+def write_config(path, config):
+    # the way provisioning tools do it
+    with open(path + ".new", "w") as f:
+        json.dump(config, f, indent=4)
+    os.replace(path + ".new", path)
+
+
+def main():
+    profiles = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000
+    running = int(sys.argv[2]) if len(sys.argv) >= 3 else 50
+
+    autossh_log.dispatcher.remove_handler(autossh_log.stdout_hadler)
+    autossh_log.dispatcher.remove_handler(autossh_log.stderr_handler)
+
+    directory = tempfile.mkdtemp()
+    conf_file = os.path.join(directory, "config.json")
+    config = make_config(profiles, 1, FAKE_AUTOSSH)
+    for key, profile in config["ssh_profiles"].items():
+        profile["autostart"] = int(key) <= running
+    write_config(conf_file, config)
+
+    preferences = autossh_preferences.Preferences(conf_file)
+    manager = TunnelManager(preferences)
+    manager.autostart()
+    wait_for(lambda: sum(1 for client in list(manager.active_profiles.values())
+                         if client.is_active()) >= running, timeout=30)
+    clients = dict(manager.active_profiles)
+
+    applied = threading.Event()
+    timings = {}
+
+    def on_change():
+        started = monotonic()
+        diff = preferences.reload_file()
+        timings["reload_ms"] = (monotonic() - started) * 1000
+        if diff is not None:
+            manager.apply_config(*diff)
+            timings["apply_ms"] = (monotonic() - started) * 1000 - timings["reload_ms"]
+            timings["diff"] = [len(ids) for ids in diff]
+            applied.set()
+
+    watcher = ConfigWatcher(conf_file, on_change)
+    watcher.start()
+    sleep(0.5)
+
+    # change a running profile, the tunnel has to restart with it
+    config["ssh_profiles"]["1"]["extra_options"] = ["-N", "-C"]
+    written = monotonic()
+    write_config(conf_file, config)
+    applied.wait(10)
+    detected = monotonic() - written
+
+    wait_for(lambda: manager.active_profiles.get(1) is not None and
+             manager.active_profiles[1].is_active(), timeout=10)
+    touched = sum(1 for profile_id, client in clients.items()
+                  if manager.active_profiles.get(profile_id) is not client)
+
+    watcher.stop()
+    manager.shutdown()
+    preferences.flush()
+
+    print(json.dumps({"profiles": profiles,
+                      "running": running,
+                      "applied": applied.is_set(),
+                      "write_to_applied_ms": detected * 1000,
+                      "reload_ms": timings.get("reload_ms"),
+                      "apply_ms": timings.get("apply_ms"),
+                      "added_changed_removed": timings.get("diff"),
+                      "tunnels_touched": touched}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
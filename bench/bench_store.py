@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 26.10.26 15:10
+
+@author: pavel
+
+Profile storage with a large profile set: startup of Preferences,
+port index, autostart selection, list view and menu population, and
+the memory kept afterwards, for the json file and the sqlite store.
+Prints JSON results.
+
+usage: bench_store.py [profiles]
+"""
+import os
+import sys
+import json
+import tempfile
+import tracemalloc
+
+from time import monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import autossh_log
+import autossh_preferences
+
+from autossh_ports import PortIndex
+
+TOOLTIP_TEMPLATE = "<b>{name}:</b> 127.0.0.1:{loc_port} &lt;-&gt; {serv_addr}:{serv_port}"
+
+
+def make_config(directory, profiles):
+    preferences = autossh_preferences.Preferences(os.path.join(directory, "config.json"))
+    template = preferences.get("ssh_profile_template")
+    data = {}
+    for id_ in range(1, profiles + 1):
+        profile = json.loads(json.dumps(template))
+        profile.update({"id": id_,
+                        "name": "host{0}".format(id_),
+                        "server_addr": "10.{0}.{1}.{2}".format(id_ // 65536, id_ // 256 % 256, id_ % 256),
+                        "local_port": str(10000 + id_ % 50000),
+                        "autostart": id_ % 1000 == 0,
+                        "show_in_menu": id_ % 100 == 0,
+                        "tags": ["dc{0}".format(id_ % 8)]})
+        data[str(id_)] = profile
+    with open(os.path.join(directory, "config.json"), "w") as f:
+        json.dump({"app": {}, "ssh_profiles": data}, f, indent=4)
+
+
+def run(directory, store):
+    conf_file = os.path.join(directory, "config-{0}.json".format(store))
+    with open(os.path.join(directory, "config.json")) as src:
+        config = json.load(src)
+    config["app"] = {"profile_store": store,
+                     "profile_db": os.path.join(directory, "profiles-{0}.db".format(store))}
+    with open(conf_file, "w") as dst:
+        json.dump(config, dst, indent=4)
+    del config
+
+    # first start migrates
+    started = monotonic()
+    preferences = autossh_preferences.Preferences(conf_file)
+    preferences.flush()
+    first_start = monotonic() - started
+    del preferences
+
+    result = {"store": store, "first_start_ms": first_start * 1000}
+    result.update(measure(conf_file))
+
+    # memory of the same steps, tracing slows them down
+    tracemalloc.start()
+    measure(conf_file)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["kept_mib"] = current / 1048576.0
+    result["peak_mib"] = peak / 1048576.0
+    return result
+
+
+def measure(conf_file):
+    timings = {}
+
+    started = monotonic()
+    preferences = autossh_preferences.Preferences(conf_file)
+    timings["startup_ms"] = (monotonic() - started) * 1000
+
+    started = monotonic()
+    PortIndex(preferences)
+    timings["port_index_ms"] = (monotonic() - started) * 1000
+
+    started = monotonic()
+    autostart = [profile.id for profile in preferences.iter_profiles(autostart=True)]
+    timings["autostart_ms"] = (monotonic() - started) * 1000
+
+    started = monotonic()
+    rows = [(profile.id, profile.name, TOOLTIP_TEMPLATE.format(name=profile.name,
+                                                              loc_port=profile.local_port,
+                                                              serv_addr=profile.server_addr,
+                                                              serv_port=profile.server_port))
+            for profile in preferences.iter_profiles()]
+    timings["view_ms"] = (monotonic() - started) * 1000
+
+    started = monotonic()
+    menu = [profile.name for profile in preferences.iter_profiles(show_in_menu=True)]
+    timings["menu_ms"] = (monotonic() - started) * 1000
+
+    started = monotonic()
+    tagged = len(preferences.profile_page(tag="dc3", limit=100))
+    timings["tag_page_ms"] = (monotonic() - started) * 1000
+
+    timings.update({"rows": len(rows),
+                    "autostart": len(autostart),
+                    "menu": len(menu),
+                    "tag_page": tagged})
+    # kept alive for the memory measurement
+    measure.kept = (preferences, rows)
+    return timings
+
+
+def main():
+    profiles = int(sys.argv[1]) if len(sys.argv) >= 2 else 20000
+
+    autossh_log.dispatcher.remove_handler(autossh_log.stdout_hadler)
+    autossh_log.dispatcher.remove_handler(autossh_log.stderr_handler)
+
+    directory = tempfile.mkdtemp()
+    make_config(directory, profiles)
+    print(json.dumps({"profiles": profiles,
+                      "results": [run(directory, "json"), run(directory, "sqlite")]}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
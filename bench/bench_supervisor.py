@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 20.10.26 10:05
+
+@author: pavel
+
+Tunnel supervision benchmark driven by fake_autossh.py.
+For every tunnel count measures spawn-to-running latency, CPU and threads
+of the supervising process, log lines per second delivered through
+LimLogHandler and shutdown latency. Prints JSON results.
+
+usage: bench_supervisor.py [--tunnels 1,10,100,1000] [--rate 10] [--duration 5] [--wedged 0]
+"""
+import os
+import sys
+import json
+import argparse
+import resource
+import tempfile
+import threading
+
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import autossh_log
+import autossh_preferences
+
+from autossh_log import LimLogHandler
+from autossh_manager import TunnelManager
+
+FAKE_AUTOSSH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_autossh.py")
+BASE_PORT = 40000
+NAME_PREFIX = "bench-"
+READY_LINE = "Local connections to"  # first line of fake_autossh.py
+
+
+def make_config(tunnels, rate, executable, wedged=0):
+    profiles = {}
+    for id_ in range(1, tunnels + 1):
+        env_options = ["FAKE_AUTOSSH_RATE={0}".format(rate)]
+        if id_ <= wedged:
+            env_options.append("FAKE_AUTOSSH_WEDGED=1")
+        profiles[str(id_)] = {"id": id_,
+                              "name": NAME_PREFIX + str(id_),
+                              "autostart": True,
+                              "executable": executable,
+                              "server_addr": "127.0.0.1",
+                              "server_port": "22",
+                              "server_user": "bench",
+                              "local_port": str(BASE_PORT + id_),
+                              "key_file": "/dev/null",
+                              "extra_options": ["-N"],
+                              "env_options": env_options}
+
+    return {"app": {"connect_concurrency": tunnels,
+                    "connect_rate": 1e6,
+                    "connect_burst": tunnels,
+                    "connect_jitter": 0,
+                    "probe_interval": 0,
+                    "log_keep_entries": 1000},
+            "ssh_profiles": profiles}
+
+
+class LineCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = 0
+        self.first_line = {}  # profile name -> monotonic time
+
+    def on_entry(self, msg):
+        now = monotonic()
+        name = msg.split(":", 1)[0]
+        with self.lock:
+            self.lines += 1
+            if name not in self.first_line and READY_LINE in msg:
+                self.first_line[name] = now
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def thread_count():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def wait_for(condition, timeout, step=0.001):
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(step)
+    return True
+
+
+def run(tunnels, rate, duration, executable, wedged=0):
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as conf:
+        json.dump(make_config(tunnels, rate, executable, wedged), conf)
+
+    try:
+        preferences = autossh_preferences.Preferences(conf.name)
+    finally:
+        os.remove(conf.name)
+
+    counter = LineCounter()
+    log_handler = LimLogHandler(preferences.get("app", "log_keep_entries"))
+    log_handler.add_observer("bench", counter.on_entry)
+
+    threads_idle = thread_count()
+    manager = TunnelManager(preferences)
+
+    started = monotonic()
+    manager.autostart()
+    all_running = wait_for(lambda: len(counter.first_line) >= tunnels, timeout=30 + tunnels * 0.05)
+
+    spawn = [counter.first_line[NAME_PREFIX + str(id_)] - started
+             for id_ in range(1, tunnels + 1) if NAME_PREFIX + str(id_) in counter.first_line]
+
+    # steady state
+    with counter.lock:
+        counter.lines = 0
+    cpu_before = cpu_time()
+    window_started = monotonic()
+    sleep(duration)
+    window = monotonic() - window_started
+    cpu_used = cpu_time() - cpu_before
+    lines = counter.lines
+    threads = thread_count()
+
+    stop_started = monotonic()
+    report = manager.shutdown()
+    shutdown = monotonic() - stop_started
+    autossh_log.dispatcher.remove_handler(log_handler)
+
+    stop = [entry["latency"] for entry in report.values() if entry["latency"] is not None]
+
+    return {"tunnels": tunnels,
+            "rate_per_tunnel": rate,
+            "all_running": all_running,
+            "spawn_p50": percentile(spawn, 0.5),
+            "spawn_p99": percentile(spawn, 0.99),
+            "spawn_all": max(spawn) if spawn else None,
+            "cpu_percent": 100.0 * cpu_used / window,
+            "cpu_percent_per_tunnel": 100.0 * cpu_used / window / tunnels,
+            "threads": threads,
+            "threads_added": threads - threads_idle,
+            "lines_per_s": lines / window,
+            "lines_per_s_offered": tunnels * rate,
+            "log_queue": autossh_log.dispatcher.stats(),
+            "all_stopped": len(stop) == len(report),
+            "killed": sum(1 for entry in report.values() if entry["killed"]),
+            "stop_p50": percentile(stop, 0.5),
+            "stop_p99": percentile(stop, 0.99),
+            "shutdown_s": shutdown}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Tunnel supervision benchmark")
+    parser.add_argument("--tunnels", default="1,10,100,1000",
+                        help="comma separated tunnel counts")
+    parser.add_argument("--rate", type=float, default=10, help="log lines per second per tunnel")
+    parser.add_argument("--duration", type=float, default=5, help="steady state window, seconds")
+    parser.add_argument("--executable", default=FAKE_AUTOSSH, help="autossh stand-in")
+    parser.add_argument("--wedged", type=int, default=0, help="tunnels ignoring SIGTERM")
+    parser.add_argument("--console", action="store_true", help="keep stdout/stderr log handlers")
+    parser.add_argument("--output", help="write results to file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if not args.console:
+        autossh_log.dispatcher.remove_handler(autossh_log.stdout_hadler)
+        autossh_log.dispatcher.remove_handler(autossh_log.stderr_handler)
+    autossh_log.dispatcher.start()
+
+    # every tunnel needs a few descriptors
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    results = [run(int(n), args.rate, args.duration, args.executable, args.wedged)
+               for n in args.tunnels.split(",")]
+
+    data = json.dumps({"benchmark": "supervisor", "results": results}, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 20.10.26 09:15
+
+@author: pavel
+
+Stand-in for autossh used by the benchmarks.
+Ignores its arguments and is configured through the environment
+(profile env_options):
+    FAKE_AUTOSSH_RATE      lines per second, default 10
+    FAKE_AUTOSSH_LIFETIME  exit after that many seconds, 0 runs until signalled
+    FAKE_AUTOSSH_CODE      exit code after lifetime, default 0
+    FAKE_AUTOSSH_WEDGED    1 to ignore SIGTERM like a hung ssh
+"""
+import os
+import sys
+import signal
+
+from time import monotonic, sleep
+
+LINE = "debug1: client_input_global_request: rtype keepalive@openssh.com want_reply 1\n"
+TICK = 0.05
+
+
+def main():
+    rate = float(os.environ.get("FAKE_AUTOSSH_RATE", 10))
+    lifetime = float(os.environ.get("FAKE_AUTOSSH_LIFETIME", 0))
+    code = int(os.environ.get("FAKE_AUTOSSH_CODE", 0))
+
+    if os.environ.get("FAKE_AUTOSSH_WEDGED") == "1":
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    else:
+        signal.signal(signal.SIGTERM, lambda *args: os._exit(143))
+
+    out = sys.stdout
+    out.write("debug1: Local connections to LOCALHOST:{0} forwarded to remote address socks:0\n"
+              .format(sys.argv[sys.argv.index("-D") + 1] if "-D" in sys.argv else 0))
+    out.flush()
+
+    started = monotonic()
+    written = 0
+    while True:
+        elapsed = monotonic() - started
+        if lifetime and elapsed >= lifetime:
+            break
+
+        due = int(elapsed * rate) - written
+        if due > 0:
+            out.write(LINE * due)
+            out.flush()
+            written += due
+        sleep(max(TICK, min(1.0, 1.0 / rate)) if rate > 0 else 1.0)
+
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
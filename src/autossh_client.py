@@ -13,120 +13,78 @@ import signal
 import logging
 
 from threading import Thread
-from time import sleep
+
+import autossh_master
+
+from autossh_log import profile_extra
+
+from autossh_shutdown import signal_group
 
 log = logging.getLogger(__name__)
 
 class AutosshClient:
 
-    def __init__(self, preferences, ssh_profile):
+    def __init__(self, preferences, profile, forward_port=None):
+        """
+        :param profile: compiled SshProfile
+        :param forward_port: port for ssh dynamic forward if it differs from
+                             profile local port (local port is taken by relay)
+        """
         self.process = None
+        self.stopping = False  # stop was requested, do not restart
+        self.event_parser = None  # fed with every output line by supervisor
         self.preferences = preferences
 
-        self.prof_id = ssh_profile.get("id", 0)
-        self.prof_name = ssh_profile.get("name")
-
-        executable = self.escape(ssh_profile.get("executable"))
-
-        server_addr = self.escape(ssh_profile.get("server_addr"))
-        server_port = self.escape(ssh_profile.get("server_port"))
-        server_user = self.escape(ssh_profile.get("server_user"))
-        local_port = self.escape(ssh_profile.get("local_port"))
-        key_file = self.escape(os.path.expanduser(ssh_profile.get("key_file")))
-
-        extra_options = ssh_profile.get("extra_options")
-        env_options = ssh_profile.get("env_options")
+        self.prof_id = profile.id
+        self.prof_name = profile.name
+        self.profile = profile
+        self.shared_master = profile.shared_master
 
-        self.command = [executable,]
-        self.command += ["-D", local_port]
+        self.local_port = profile.local_port
+        self.forward_port = int(forward_port) if forward_port else profile.local_port
 
-        self.command += [server_addr]
-        self.command += ["-p", server_port]
-        self.command += ["-l", server_user]
-        self.command += ["-i", key_file]
+        self.command = profile.argv(self.forward_port)
+        if self.shared_master:
+            self.command += autossh_master.master_options(preferences, profile)
 
-        for option in extra_options:
-            self.command += [self.escape(opt) for opt in option.split()]
-
-        self.env = self.get_env(env_options)
-
-
-    def escape(self, val):
-        val = str(val).strip()
-        #val = val.replace('\"', '\\"')
-        #val = '"' + val + '"'
-
-        return val
-
-    def run(self, poll_interval, on_stop_cb):
-        #Logger().log(self.env)
-        log.info("%s: %s", self.prof_name, self.command)
+    def run(self, supervisor, on_stop_cb):
+        log.info("%s: %s", self.prof_name, self.command, extra=profile_extra(self.prof_id))
 
         try :
-            thr = Thread(target=self.background,
-                             args=(poll_interval, on_stop_cb))
-            thr.start()
+            supervisor.spawn(self, on_stop_cb)
         except Exception as e:
             log.exception(e)
-            log.info("%s:unexpected error: %s", self.prof_name, str(e))
+            log.info("%s:unexpected error: %s", self.prof_name, str(e),
+                     extra=profile_extra(self.prof_id))
             on_stop_cb(self.prof_id, -1)
 
-
-    def background(self, poll_interval, on_stop_cb):
-        try:
-            # start
-            self.process = subprocess.Popen(self.command,
-                                            universal_newlines=True,  #text mode
-                                            bufsize=1,  # line buffered
-                                            stdin=subprocess.PIPE,
-                                            stdout=subprocess.PIPE,
-                                            stderr=subprocess.STDOUT,
-                                            env=self.env,  # environment
-                                            preexec_fn=os.setsid  #to modify the environment
-                                            )
-
-            # poll
-            while self.process.poll() is None:
-                log.info("%s: %s", self.prof_name, self.process.stdout.readline())
-                sleep(poll_interval)
-
-            # stop
-            stdout, stderr = self.process.communicate(timeout=poll_interval)
-            log.info("%s:stdout: %s", self.prof_name, stdout)
-            log.info("%s:stderr: %s", self.prof_name, stderr)
-
-        except subprocess.TimeoutExpired as e:
-            log.exception(e)
-            self.stop()
-
-        except Exception as e:
-            log.exception(e)
-            log.info("%s:unexpected error: %s", self.prof_name, str(e))
-
-        finally:
-            on_stop_cb(self.prof_id, self.process.returncode)
-            log.info("%s:return code %s", self.prof_name, self.process.returncode)
-
-            self.process = None
-
+    def start_process(self):
+        """
+        Called from the supervisor thread
+        :return: started process
+        """
+        self.process = subprocess.Popen(self.command,
+                                        bufsize=0,  # raw pipe, read in chunks by supervisor
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        env=self.profile.environment(),
+                                        preexec_fn=os.setsid  #to modify the environment
+                                        )
+        return self.process
 
     def stop(self):
-        if self.is_active():
-            self.process.terminate()
+        self.stopping = True
+        process = self.process  # reset by the supervisor thread on exit
+        if process is not None:
             # Send the signal to all the process groups
-            os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+            signal_group(process, signal.SIGTERM)
+
+        if self.shared_master:
+            # the forward lives in the master, not in the killed process
+            Thread(target=autossh_master.cancel_forward,
+                   args=(self.preferences, self.profile, self.forward_port),
+                   daemon=True).start()
 
     def is_active(self):
         return self.process is not None
-
-    def get_env(self, environ_options):
-        env = os.environ.copy()
-
-        for opt in environ_options:
-            eq_sign = opt.find("=")
-            if eq_sign > 0:
-                key, val = opt[0:eq_sign], opt[eq_sign+1:]
-                env[key] = val
-
-        return env
-
@@ -0,0 +1,326 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 19.10.26 15:20
+
+@author: pavel
+
+Headless tunnel supervisor controlled over a Unix domain socket.
+Protocol: one JSON object per line in both directions, e.g.
+    {"cmd": "status"}            -> {"ok": true, "result": {...}}
+    {"cmd": "connect", "id": 3}  -> {"ok": true, "result": null}
+    {"cmd": "log", "lines": 50}  -> {"ok": true, "result": ["...", ...]}
+    {"cmd": "log", "id": 3}      -> log of one profile
+    {"cmd": "history", "since": 1700000000, "id": 3} -> [[timestamp, level, id, "..."], ...]
+"""
+import os
+import sys
+import json
+import errno
+import datetime
+import signal
+import argparse
+import threading
+import socket
+import socketserver
+
+import autossh_preferences
+
+from autossh_log import LimLogHandler, LogCoalescer, dispatcher
+from autossh_disklog import DiskLogHandler, read_log
+from autossh_manager import TunnelManager
+from autossh_watcher import ConfigWatcher
+from autossh_import import SshConfigImporter, SSH_CONFIG
+
+from locale import gettext as _
+
+#logger
+import logging
+log = logging.getLogger(__name__)
+
+MAX_REQUEST = 65536
+
+
+def default_socket_path(preferences=None):
+    path = preferences.get("app", "control_socket") if preferences is not None else None
+    if path:
+        return os.path.expanduser(path)
+
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.expanduser("~/.cache/autossh-gui")
+    return os.path.join(runtime_dir, "autossh-gui.sock")
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST)
+            if not line:
+                break
+
+            try:
+                request = json.loads(line.decode("utf-8"))
+                reply = {"ok": True, "result": self.server.daemon.execute(request)}
+            except Exception as e:
+                log.debug("Bad control request %s: %s", line, e)
+                reply = {"ok": False, "error": str(e)}
+
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+def socket_in_use(socket_path):
+    """
+    A socket left by a crashed instance is removed
+    :return: True if a running daemon answers on socket_path
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except OSError as e:
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                raise
+    if os.path.lexists(socket_path):
+        os.remove(socket_path)
+    return False
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, daemon):
+        self.daemon = daemon
+        if socket_in_use(socket_path):
+            raise OSError(errno.EADDRINUSE,
+                          _("Another daemon is listening on {0}").format(socket_path))
+        os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+
+        old_umask = os.umask(0o177)
+        try:
+            super(ControlServer, self).__init__(socket_path, ControlHandler)
+        finally:
+            os.umask(old_umask)
+
+
+class Daemon:
+    def __init__(self, conf_file=None, socket_path=None):
+        self.preferences = autossh_preferences.Preferences(conf_file)
+        if self.preferences.get("app", "log_coalesce"):
+            dispatcher.coalescer = LogCoalescer.from_preferences(self.preferences)
+        self.log_handler = LimLogHandler(self.preferences.get("app", "log_keep_entries"),
+                                         self.preferences.get("app", "log_memory_kb") * 1024)
+        dispatcher.start()
+        self.disk_log = None
+        if self.preferences.get("app", "disk_log"):
+            self.disk_log = DiskLogHandler.from_preferences(self.preferences)
+            self.disk_log.start()
+
+        self.manager = TunnelManager(self.preferences)
+
+        self.config_watcher = None
+        if self.preferences.get("app", "config_watch"):
+            self.config_watcher = ConfigWatcher.from_preferences(self.preferences,
+                                                                 self.on_config_file_changed)
+
+        self.socket_path = socket_path or default_socket_path(self.preferences)
+        self.server = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()  # control connections and reloads run one at a time
+
+        self.commands = {"status": self.cmd_status,
+                         "profiles": self.cmd_profiles,
+                         "connect": self.cmd_connect,
+                         "disconnect": self.cmd_disconnect,
+                         "resources": self.cmd_resources,
+                         "pool_start": self.cmd_pool_start,
+                         "pool_stop": self.cmd_pool_stop,
+                         "log": self.cmd_log,
+                         "history": self.cmd_history,
+                         "log_stats": self.cmd_log_stats,
+                         "quit": self.cmd_quit}
+
+    def execute(self, request):
+        command = self.commands.get(request.get("cmd"))
+        if command is None:
+            raise ValueError(_("Unknown command {0}").format(request.get("cmd")))
+        with self.lock:
+            return command(request)
+
+    def _profile_id(self, request):
+        profile_id = request.get("id")
+        if self.preferences.get("ssh_profiles", profile_id) is None:
+            raise KeyError(_("No SSH profile with id {0}").format(profile_id))
+        # json keeps parameter names as string, profile ids are ints
+        return int(profile_id)
+
+    def cmd_status(self, request):
+        profile_id = request.get("id")
+        return self.manager.status(self._profile_id(request) if profile_id is not None else None)
+
+    def cmd_profiles(self, request):
+        return [{"id": p.id,
+                 "name": p.name,
+                 "local_port": p.local_port,
+                 "state": self.manager.tunnel_state(p.id)}
+                for p in self.preferences.iter_profiles()]
+
+    def cmd_connect(self, request):
+        self.manager.connect(self._profile_id(request))
+
+    def cmd_disconnect(self, request):
+        if request.get("id") == "all":
+            self.manager.disconnect_all()
+        else:
+            self.manager.disconnect(self._profile_id(request))
+
+    def cmd_pool_start(self, request):
+        if not self.manager.start_pool(request.get("name")):
+            raise KeyError(_("No tunnel pool {0}").format(request.get("name")))
+
+    def cmd_pool_stop(self, request):
+        self.manager.stop_pool(request.get("name"))
+
+    def cmd_resources(self, request):
+        return self.manager.resources.history(self._profile_id(request))
+
+    def cmd_log(self, request):
+        lines = int(request.get("lines", 100))
+        if request.get("id") is not None:
+            history = self.log_handler.history(self._profile_id(request))
+        else:
+            history = self.log_handler.history()
+        return history[-lines:] if lines > 0 else []
+
+    def cmd_history(self, request):
+        """Records of the on disk log"""
+        profile_id = self._profile_id(request) if request.get("id") is not None else None
+        until = request.get("until")
+        return read_log(self.preferences.get("app", "disk_log_dir"),
+                        since=float(request.get("since", 0)),
+                        until=float(until) if until is not None else None,
+                        profile_id=profile_id,
+                        limit=int(request.get("lines", 1000)))
+
+    def cmd_log_stats(self, request):
+        coalescer = dispatcher.coalescer
+        return {"queue": dispatcher.stats(),
+                "memory": self.log_handler.memory_usage(),
+                "coalescer": coalescer.stats() if coalescer is not None else None,
+                "disk": self.disk_log.stats() if self.disk_log is not None else None}
+
+    def cmd_quit(self, request):
+        threading.Thread(target=self.quit_, daemon=True).start()
+
+    def run(self):
+        self.server = ControlServer(self.socket_path, self)
+        threading.Thread(target=self.server.serve_forever, name="control-socket", daemon=True).start()
+        log.info(_("Listening on %s"), self.socket_path)
+
+        self.manager.autostart()
+        if self.config_watcher is not None:
+            self.config_watcher.start()
+        self.stopped.wait()
+
+    def on_config_file_changed(self):
+        """Called from the config watcher thread"""
+        with self.lock:
+            diff = self.preferences.reload_file()
+            if diff is not None:
+                self.manager.apply_config(*diff)
+
+    def quit_(self, *args):
+        log.debug(_("Quit"))
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+        self.manager.shutdown()
+        if self.disk_log is not None:
+            self.disk_log.close()
+        self.stopped.set()
+
+
+def send_command(socket_path, request, timeout=10):
+    """
+    :return: reply of the daemon as dict
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline().decode("utf-8"))
+
+
+def parse_time(value):
+    """
+    :param value: epoch seconds or ISO 8601 local time, e.g. 2026-10-22T03:00
+    :return: epoch seconds
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=_("Headless autossh tunnel supervisor"))
+    parser.add_argument("--config", help=_("configuration file"))
+    parser.add_argument("--socket", help=_("control socket path"))
+    parser.add_argument("--import", dest="import_path", nargs="?", const=SSH_CONFIG,
+                        metavar="SSH_CONFIG",
+                        help=_("import profiles from ssh client configuration and exit"))
+    parser.add_argument("command", nargs="*",
+                        help=_("send command to a running daemon: status [id], profiles, "
+                               "connect id, disconnect id|all, pool_start name, pool_stop name, "
+                               "resources id, log [lines], log_stats, history since [id], quit"))
+    args = parser.parse_args(argv)
+
+    if args.import_path:
+        # running instances reload the written file
+        preferences = autossh_preferences.Preferences(args.config)
+        report = SshConfigImporter.from_preferences(preferences).run(args.import_path)
+        preferences.flush()
+        print(json.dumps({key: len(ids) for key, ids in report.items()}, indent=2))
+        return 0
+
+    if args.command:
+        socket_path = args.socket or default_socket_path(
+            autossh_preferences.Preferences(args.config) if args.config else None)
+        request = {"cmd": args.command[0]}
+        if len(args.command) >= 2:
+            if request["cmd"] == "log":
+                request["lines"] = args.command[1]
+            elif request["cmd"].startswith("pool_"):
+                request["name"] = args.command[1]
+            elif request["cmd"] == "history":
+                request["since"] = parse_time(args.command[1])
+                if len(args.command) >= 3:
+                    request["id"] = args.command[2]
+            else:
+                request["id"] = args.command[1]
+
+        reply = send_command(socket_path, request)
+        print(json.dumps(reply.get("result") if reply.get("ok") else reply, indent=2))
+        return 0 if reply.get("ok") else 1
+
+    daemon = Daemon(args.config, args.socket)
+    signal.signal(signal.SIGTERM, lambda *a: threading.Thread(target=daemon.quit_).start())
+    signal.signal(signal.SIGINT, lambda *a: threading.Thread(target=daemon.quit_).start())
+    try:
+        daemon.run()
+    except OSError as e:
+        log.error(_("Can not start: %s"), e)
+        daemon.quit_()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 22.10.26 10:30
+
+@author: pavel
+
+Append-only tunnel log on disk.
+Records of every profile go to one segmented file, one line per record:
+    <epoch seconds>\t<level>\t<profile id or ->\t<message>
+Segments are rotated by size and age, closed segments may be gzipped.
+Every segment has a sidecar index of (timestamp, offset) pairs written
+once per batch, so reading from a given time needs no scan.
+"""
+import os
+import sys
+import gzip
+import shutil
+import struct
+import bisect
+import logging
+import collections
+
+from threading import Thread, Event
+
+from autossh_log import LogFormatter, freeze_args
+
+log = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "tunnels-"
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+COMPRESSED_SUFFIX = ".gz"
+
+INDEX_ENTRY = struct.Struct("<dQ")  # timestamp, offset in the uncompressed segment
+
+QUEUE_LIMIT = 100000  # records waiting for the writer, newer records are dropped
+FLUSH_INTERVAL = 0.5  # seconds
+BATCH_SIZE = 5000  # records written at once
+
+
+def segment_name(started):
+    # fixed width, names sort by time
+    return "{0}{1:013d}{2}".format(SEGMENT_PREFIX, int(started * 1000), SEGMENT_SUFFIX)
+
+
+def segment_start(name):
+    """
+    :return: start time of the segment or None for foreign files
+    """
+    if not name.startswith(SEGMENT_PREFIX):
+        return None
+    stem = name[len(SEGMENT_PREFIX):].split(".", 1)[0]
+    return int(stem) / 1000.0 if stem.isdigit() else None
+
+
+def list_segments(directory):
+    """
+    :return: [(start time, path)], oldest first
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    segments = []
+    for name in names:
+        started = segment_start(name)
+        if started is not None and not name.endswith(INDEX_SUFFIX):
+            segments.append((started, os.path.join(directory, name)))
+    segments.sort()
+    return segments
+
+
+def index_path(segment_path):
+    if segment_path.endswith(COMPRESSED_SUFFIX):
+        segment_path = segment_path[:-len(COMPRESSED_SUFFIX)]
+    return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def read_index(segment_path):
+    """
+    :return: ([timestamps], [offsets])
+    """
+    try:
+        with open(index_path(segment_path), "rb") as f:
+            data = f.read()
+    except OSError:
+        return [], []
+
+    timestamps, offsets = [], []
+    for pos in range(0, len(data) - len(data) % INDEX_ENTRY.size, INDEX_ENTRY.size):
+        timestamp, offset = INDEX_ENTRY.unpack_from(data, pos)
+        timestamps.append(timestamp)
+        offsets.append(offset)
+    return timestamps, offsets
+
+
+def escape(msg):
+    return msg.replace("\\", "\\\\").replace("\n", "\\n").replace("\t", " ")
+
+
+class DiskLogHandler(logging.Handler):
+    """
+    emit only queues the raw record, formatting and file writes
+    happen in batches in the writer thread.
+    """
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, segment_age=24 * 3600,
+                 segments=20, compress=True):
+        super(DiskLogHandler, self).__init__()
+        self.directory = os.path.expanduser(directory)
+        self.segment_size = int(segment_size)
+        self.segment_age = float(segment_age)
+        self.segments = int(segments)
+        self.compress = compress
+
+        self.formatter = LogFormatter()
+        self.queue = collections.deque()
+        self.dropped = 0
+        self.written = 0
+
+        self.segment = None  # file object of the current segment
+        self.segment_path = None
+        self.segment_started = 0.0
+        self.index = None  # file object of the current index
+
+        self.wake = Event()
+        self.running = False
+        self.thread = None
+
+        self.setLevel(logging.INFO)
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        return cls(preferences.get("app", "disk_log_dir"),
+                   segment_size=preferences.get("app", "disk_log_segment_kb") * 1024,
+                   segment_age=preferences.get("app", "disk_log_segment_age"),
+                   segments=preferences.get("app", "disk_log_segments"),
+                   compress=preferences.get("app", "disk_log_compress"))
+
+    def start(self):
+        if self.thread is None:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            self.running = True
+            self.thread = Thread(target=self._loop, name="disk-log", daemon=True)
+            self.thread.start()
+            logging.getLogger().addHandler(self)
+
+    def close(self):
+        """Write pending records and stop the writer"""
+        logging.getLogger().removeHandler(self)
+        if self.thread is not None:
+            self.running = False
+            self.wake.set()
+            self.thread.join()
+            self.thread = None
+        super(DiskLogHandler, self).close()
+
+    def emit(self, record):
+        # called from every logging thread, must not touch the disk
+        if len(self.queue) >= QUEUE_LIMIT:
+            self.dropped += 1
+            return
+        self.queue.append((record.created, record.levelname, getattr(record, "profile_id", None),
+                           record.msg, freeze_args(record.args)))
+        if len(self.queue) >= BATCH_SIZE:
+            self.wake.set()
+
+    def _loop(self):
+        while True:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            running = self.running
+            try:
+                while self.queue:
+                    self._write_batch()
+            except Exception as e:
+                # logging here would come back to this handler
+                sys.stderr.write("Disk log error: {0}\n".format(e))
+                self.queue.clear()
+            if not running:
+                break
+        self._close_segment()
+
+    def _write_batch(self):
+        batch = []
+        queue = self.queue
+        while queue and len(batch) < BATCH_SIZE:
+            batch.append(queue.popleft())
+
+        if self.segment is None or self._should_rotate(batch[0][0]):
+            self._rotate(batch[0][0])
+
+        lines = []
+        for created, levelname, profile_id, msg, args in batch:
+            try:
+                text = self.formatter.format_message(msg, args)
+            except Exception:
+                text = "{0} {1}".format(msg, args)
+            lines.append("{0:.3f}\t{1}\t{2}\t{3}\n".format(
+                created, levelname, "-" if profile_id is None else profile_id, escape(text)))
+
+        data = "".join(lines).encode("utf-8", "replace")
+        self.index.write(INDEX_ENTRY.pack(batch[0][0], self.segment.tell()))
+        self.segment.write(data)
+        self.segment.flush()
+        self.index.flush()
+        self.written += len(batch)
+
+    def _should_rotate(self, timestamp):
+        return self.segment.tell() >= self.segment_size or \
+            timestamp - self.segment_started >= self.segment_age
+
+    def _rotate(self, timestamp):
+        closed = self._close_segment()
+
+        self.segment_started = timestamp
+        self.segment_path = os.path.join(self.directory, segment_name(timestamp))
+        self.segment = open(self.segment_path, "ab")
+        self.index = open(index_path(self.segment_path), "ab")
+
+        if closed is not None and self.compress:
+            self._compress(closed)
+        self._expire()
+
+    def _close_segment(self):
+        """
+        :return: path of the closed segment or None
+        """
+        if self.segment is None:
+            return None
+        self.segment.close()
+        self.index.close()
+        self.segment = self.index = None
+        return self.segment_path
+
+    def _compress(self, path):
+        try:
+            with open(path, "rb") as src, gzip.open(path + COMPRESSED_SUFFIX, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError as e:
+            sys.stderr.write("Can not compress {0}: {1}\n".format(path, e))
+
+    def _expire(self):
+        segments = list_segments(self.directory)
+        for started, path in segments[:max(0, len(segments) - self.segments)]:
+            for name in (path, index_path(path)):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"queued": len(self.queue),
+                "written": self.written,
+                "dropped": self.dropped,
+                "segment": self.segment_path}
+
+
+def read_log(directory, since=0.0, until=None, profile_id=None, limit=1000):
+    """
+    Read records of the on disk log
+    :param since: epoch seconds
+    :param profile_id: only records of that profile
+    :return: [(timestamp, level, profile id or None, message)], oldest first
+    """
+    directory = os.path.expanduser(directory)
+    segments = list_segments(directory)
+
+    # the last segment started before since holds the first records
+    starts = [started for started, path in segments]
+    first = max(0, bisect.bisect_right(starts, since) - 1)
+
+    records = []
+    wanted = None if profile_id is None else str(profile_id)
+    for started, path in segments[first:]:
+        if until is not None and started > until:
+            break
+
+        timestamps, offsets = read_index(path)
+        pos = bisect.bisect_right(timestamps, since) - 1
+        offset = offsets[pos] if pos >= 0 else 0
+
+        opener = gzip.open if path.endswith(COMPRESSED_SUFFIX) else open
+        try:
+            with opener(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    fields = line.decode("utf-8", "replace").rstrip("\n").split("\t", 3)
+                    if len(fields) != 4:
+                        continue  # torn write
+                    timestamp = float(fields[0])
+                    if timestamp < since:
+                        continue
+                    if until is not None and timestamp > until:
+                        return records
+                    if wanted is not None and fields[2] != wanted:
+                        continue
+
+                    records.append((timestamp, fields[1],
+                                    None if fields[2] == "-" else fields[2], fields[3]))
+                    if len(records) >= limit:
+                        return records
+        except (OSError, EOFError) as e:
+            log.debug("Can not read %s: %s", path, e)
+    return records
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 20.10.26 16:10
+
+@author: pavel
+"""
+import logging
+
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+EVENT_STARTING = "starting"
+EVENT_RESOLVING = "resolving"
+EVENT_CONNECTED = "connected"
+EVENT_KEX_DONE = "kex_done"
+EVENT_AUTHENTICATED = "authenticated"
+EVENT_LISTENING = "listening"
+EVENT_DISCONNECTED = "disconnected"
+
+PHASES = (EVENT_STARTING, EVENT_RESOLVING, EVENT_CONNECTED, EVENT_KEX_DONE,
+          EVENT_AUTHENTICATED, EVENT_LISTENING)
+
+# (marker, event), first match wins, checked with plain substring search
+MARKERS = (
+    ("starting ssh", EVENT_STARTING),  # autossh
+    ("Connecting to ", EVENT_RESOLVING),
+    ("Connection established", EVENT_CONNECTED),
+    ("SSH2_MSG_NEWKEYS received", EVENT_KEX_DONE),
+    ("Authenticated to ", EVENT_AUTHENTICATED),
+    ("Authentication succeeded", EVENT_AUTHENTICATED),
+    ("Local connections to ", EVENT_LISTENING),
+    ("Local forwarding listening on ", EVENT_LISTENING),
+    ("Connection closed by ", EVENT_DISCONNECTED),
+    ("Connection reset by ", EVENT_DISCONNECTED),
+    ("Connection refused", EVENT_DISCONNECTED),
+    ("Connection timed out", EVENT_DISCONNECTED),
+    ("Could not resolve hostname", EVENT_DISCONNECTED),
+    ("Permission denied", EVENT_DISCONNECTED),
+    ("Host key verification failed", EVENT_DISCONNECTED),
+    ("Timeout, server ", EVENT_DISCONNECTED),
+    ("packet_write_wait", EVENT_DISCONNECTED),
+    ("Broken pipe", EVENT_DISCONNECTED),
+    ("ssh exited", EVENT_DISCONNECTED),  # autossh
+)
+
+
+class Timeline:
+    """Phases of one connection attempt, seconds since the process start"""
+    __slots__ = ("started", "phases", "reason")
+
+    def __init__(self):
+        self.started = monotonic()
+        self.phases = {}
+        self.reason = None
+
+    def ready(self):
+        return EVENT_LISTENING in self.phases
+
+    def as_dict(self):
+        return {"phases": dict(self.phases),
+                "ready": self.ready(),
+                "reason": self.reason}
+
+
+class SshEventParser:
+    """
+    Incremental parser of ssh -v and autossh debug output.
+    Turns known lines into lifecycle events; each event is reported
+    once per connection attempt.
+    """
+    def __init__(self, profile_id, on_event_cb=None):
+        """
+        :param on_event_cb: function(profile_id, event, timeline)
+        """
+        self.profile_id = profile_id
+        self.on_event_cb = on_event_cb
+        self.timeline = Timeline()
+
+    def start(self):
+        """New process has been spawned"""
+        self.timeline = Timeline()
+
+    def feed(self, line):
+        if "channel " in line:
+            # failures of single forwarded connections, tunnel is fine
+            return None
+
+        for marker, event in MARKERS:
+            if marker in line:
+                self._on_event(event, line)
+                return event
+
+    def finish(self, return_code):
+        """Process has exited"""
+        if EVENT_DISCONNECTED not in self.timeline.phases:
+            self._on_event(EVENT_DISCONNECTED, "return code {0}".format(return_code))
+
+    def _on_event(self, event, line):
+        timeline = self.timeline
+        if event == EVENT_STARTING and timeline.phases:
+            # autossh restarts ssh inside the same process
+            timeline = self.timeline = Timeline()
+
+        if event in timeline.phases:
+            return
+
+        timeline.phases[event] = monotonic() - timeline.started
+        if event == EVENT_DISCONNECTED:
+            timeline.reason = line.strip()
+
+        if self.on_event_cb is not None:
+            try:
+                self.on_event_cb(self.profile_id, event, timeline)
+            except Exception as e:
+                log.exception(e)
+
+
+def phase_latencies(timeline):
+    """
+    :return: dict phase -> seconds spent since the previous known phase
+    """
+    latencies = {}
+    previous = 0.0
+    for phase in PHASES:
+        if phase in timeline.phases:
+            latencies[phase] = timeline.phases[phase] - previous
+            previous = timeline.phases[phase]
+    return latencies
@@ -25,11 +25,14 @@ import gui_utils as utils
 import autossh_preferences
 import app_autostart
 
-from autossh_log import LimLogHandler
-from autossh_client import AutosshClient
+from autossh_log import LimLogHandler, LogCoalescer, dispatcher
+from autossh_disklog import DiskLogHandler
+from autossh_manager import TunnelManager
 from autossh_indicator import TaskbarIndicator
 from autossh_profile_view import ProfilesView
+from autossh_log_view import LogView
 from autossh_profile_editor import ProfileEditor
+from autossh_watcher import ConfigWatcher
 
 from locale import gettext as _
 
@@ -44,40 +47,49 @@ class GUI:
         self.window = None
         self.profiles_view = None
         self.profile_editor = None
-        self.active_profiles = {}
+        self.log_view = None
 
         self.preferences = autossh_preferences.Preferences(conf_file)
-        self.log_handler = LimLogHandler(self.preferences.get("app","log_keep_entries"))
-
+        if self.preferences.get("app","log_coalesce"):
+            dispatcher.coalescer = LogCoalescer.from_preferences(self.preferences)
+        self.log_handler = LimLogHandler(self.preferences.get("app","log_keep_entries"),
+                                         self.preferences.get("app","log_memory_kb") * 1024)
+        dispatcher.start()
+        self.disk_log = None
+        if self.preferences.get("app","disk_log"):
+            self.disk_log = DiskLogHandler.from_preferences(self.preferences)
+            self.disk_log.start()
+
+        self.manager = TunnelManager(self.preferences)
+        self.manager.add_observer("gui", self.update)
+        self.active_profiles = self.manager.active_profiles
 
         self.sig_handler = self
         self.indicator = TaskbarIndicator(self.preferences, self.active_profiles, sig_handler = self)
 
+        self.config_watcher = None
+        if self.preferences.get("app", "config_watch"):
+            self.config_watcher = ConfigWatcher.from_preferences(self.preferences,
+                                                                 self.on_config_file_changed)
+
         app_autostart.set_autostart(self.preferences)
 
 
     def run(self):
-        profiles = [(p.get("id"), p) for (k, p) in self.preferences.list_parameters("ssh_profiles")]
-        for profile_id, profile in profiles:
-            if profile.get("autostart", False):
-                self.connect(profile_id)
+        self.manager.autostart()
+        if self.config_watcher is not None:
+            self.config_watcher.start()
 
         Gtk.main()
 
     def connect(self, profile_id):
-        log.debug(_("Connecting %s"), profile_id)
-
-        if (profile_id not in self.active_profiles) or \
-                (not self.active_profiles[profile_id].is_active()):
-            ssh_profile = self.preferences.get("ssh_profiles", profile_id)
-            if ssh_profile is not None:
-                ssh_client = AutosshClient(self.preferences, ssh_profile)
-                self.active_profiles[profile_id] = ssh_client
-                ssh_client.run(self.preferences.get("app", "poll_interval"), self.on_ssh_stop)
-            else:
-                log.error(_("No SSH profile with id %s"), profile_id)
+        self.manager.connect(profile_id)
 
-        self.update()
+    def check_local_port(self, profile_id, local_port):
+        """
+        :return: problem description or None if profile can use the port
+        """
+        return self.manager.check_local_port(profile_id, local_port)
 
     def disconnect(self, profile_id):
         """
@@ -85,14 +97,7 @@ class GUI:
         :param profile_id: 
         :return: 
         """
-        log.debug(_("Disconnecting %s"), profile_id)
-        if profile_id in self.active_profiles:
-            ssh_client = self.active_profiles[profile_id]
-            ssh_client.stop()
-        else:
-            log.error(_("No active SSH profile with id %s"), profile_id)
-
-
+        self.manager.disconnect(profile_id)
 
     def show_window(self, notebook_page):
         if self.window is None:
@@ -111,19 +116,17 @@ class GUI:
 
             #preferences
             self.profiles_view = ProfilesView(self.builder, self.preferences, self.active_profiles,
-                                              sig_handler=self)
+                                              sig_handler=self, prober=self.manager.prober,
+                                              resources=self.manager.resources)
 
             #logging
-            self.log_textview = self.builder.get_object("log_textview")
-            self.log_buffer = self.log_textview.get_buffer()
+            self.log_view = LogView(self.builder, self.preferences, self.log_handler)
 
             #credits
             self.set_credits()
 
         self.preferences_to_window()
-
-        self.log_buffer.set_text("\n".join(self.log_handler.history()))
-        self.log_handler.add_observer("log_textview", self.add_log_message)
+        self.log_view.show()
 
         self.window.show_all()
         self.window.present()
@@ -134,6 +137,7 @@ class GUI:
     def hide_window(self, *args):
         if self.window:
             self.window.hide()
+            self.log_view.hide()
         return True
 
     def set_credits(self):
@@ -174,6 +178,7 @@ class GUI:
     def remove_profile(self, profile_id):
         self.disconnect(profile_id)
         self.preferences.remove("ssh_profiles", profile_id)
+        self.manager.profile_removed(profile_id)
 
         self.reload()
 
@@ -192,34 +197,35 @@ class GUI:
         if self.profiles_view is not None:
             self.profiles_view.reload()
 
+    @utils.idle_add_decorator
+    def update_profiles(self, profile_ids):
+        """Update only the given profiles"""
+        log.debug("GUI Update profiles %s", profile_ids)
+        self.indicator.update_profiles(profile_ids)
+        if self.profiles_view is not None:
+            self.profiles_view.update_profiles(profile_ids)
+
+    @utils.idle_add_decorator
+    def on_config_file_changed(self):
+        """Called from the config watcher thread, runs in the main loop with the rest of the GUI"""
+        diff = self.preferences.reload_file()
+        if diff is not None:
+            self.manager.apply_config(*diff)
+            added, changed, removed = diff
+            self.update_profiles(added + changed + removed)
 
     def quit_(self, *args):
         log.debug(_("Quit"))
-        active_ids = self.active_profiles.keys()
-        for id in active_ids:
-            self.disconnect(id)
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        self.manager.shutdown()
+        if self.disk_log is not None:
+            self.disk_log.close()
 
-        self.preferences.save()
+        self.preferences.flush()
         Gtk.main_quit()
 
     #signals
-    @utils.idle_add_decorator
-    def add_log_message(self, msg):
-        end_iter = self.log_buffer.get_end_iter()
-        self.log_buffer.insert(end_iter, "\n" + msg)
-
-        if self.preferences.get("app", "log_autoscroll"):
-            self.log_textview.scroll_mark_onscreen(self.log_buffer.get_insert())
-
-    def on_ssh_stop(self, profile_id, code=0):
-        name = self.preferences.get("ssh_profiles", profile_id, "name", string_mode=True)
-        log.info(_("SSH %s has stopped"), name)
-        log.info(_("return code %s"), code)
-
-        if profile_id in self.active_profiles:
-            self.active_profiles.pop(profile_id)
-        self.update()
-
     def on_button_add_clicked(self, *args):
         log.debug(_("Adding new profile"))
 
@@ -280,7 +286,11 @@ class GUI:
         state = widget.get_active()
         self.preferences.set_raw("app", "log_autoscroll", state)
 
+    def on_log_filter_changed(self, widget):
+        self.log_view.on_filter_changed(widget)
+
     def on_profile_edited(self, profile_id):
+        self.manager.profile_changed(profile_id)
         self.reload()
 
 
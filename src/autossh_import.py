@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 25.10.26 09:40
+
+@author: pavel
+
+Import of ssh profiles from OpenSSH client configuration.
+The file is read line by line, Include directives are followed in place.
+Every literal Host alias becomes a profile, options of all matching
+Host blocks are applied the way ssh does it: the first value wins.
+"""
+import os
+import re
+import glob
+import shlex
+import getpass
+import logging
+import fnmatch
+
+from locale import gettext as _
+
+from autossh_ports import listening_ports, parse_port
+
+log = logging.getLogger(__name__)
+
+SSH_CONFIG = "~/.ssh/config"
+MAX_INCLUDE_DEPTH = 16  # as in ssh
+WILDCARDS = "*?!"
+LINE = re.compile(r"([^\s=]+)\s*=?\s*(.*)")  # Keyword value, Keyword=value, Keyword = value
+
+# keywords mapped onto profile fields, meaningless for a SOCKS tunnel profile
+# or in conflict with the dynamic forward and the shared master connection
+NOT_CARRIED = {"host", "match", "include", "hostname", "port", "user", "identityfile",
+               "dynamicforward", "localforward", "remoteforward", "clearallforwardings",
+               "controlmaster", "controlpath", "controlpersist",
+               "remotecommand", "localcommand", "permitlocalcommand", "requesttty",
+               "sessiontype", "stdinnull", "forkafterauthentication", "tunnel", "tunneldevice"}
+
+
+def _split_args(value):
+    if '"' in value or "'" in value:
+        try:
+            return shlex.split(value)
+        except ValueError:
+            pass
+    return value.split()
+
+
+def read_lines(path, depth=0):
+    """
+    Stream (keyword, original keyword, args) of a config file and its includes
+    :param path: config file
+    """
+    if depth > MAX_INCLUDE_DEPTH:
+        log.warning(_("Include depth exceeded in %s"), path)
+        return
+    try:
+        f = open(os.path.expanduser(path), "r", errors="replace")
+    except OSError as e:
+        if depth == 0:
+            raise
+        log.debug("Can not read %s: %s", path, e)
+        return
+
+    with f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+
+            match = LINE.match(line)
+            if match is None:
+                log.warning(_("Skipping %s line %d: %s"), path, number, line)
+                continue
+            keyword, value = match.groups()
+            lower = keyword.lower()
+            if len(value) >= 2 and value[0] == value[-1] == '"' and '"' not in value[1:-1]:
+                value = value[1:-1]
+
+            if lower == "include":
+                for pattern in _split_args(value):
+                    pattern = os.path.expanduser(pattern)
+                    if not os.path.isabs(pattern):
+                        # relative to ~/.ssh for the user configuration
+                        pattern = os.path.join(os.path.expanduser("~/.ssh"), pattern)
+                    for included in sorted(glob.glob(pattern)):
+                        yield from read_lines(included, depth + 1)
+            else:
+                yield lower, keyword, value
+
+
+class HostBlock:
+    __slots__ = ("patterns", "options")
+
+    def __init__(self, patterns):
+        """
+        :param patterns: lower case host patterns, None for Match blocks
+        """
+        self.patterns = patterns
+        self.options = {}  # lower keyword -> (keyword, value), first one kept
+
+    def matches(self, host):
+        if self.patterns is None:
+            return False
+        matched = False
+        for pattern in self.patterns:
+            if pattern[0] == "!":
+                if _match(host, pattern[1:]):
+                    return False
+            elif _match(host, pattern):
+                matched = True
+        return matched
+
+
+def _match(host, pattern):
+    # fnmatch compiles a regular expression for every literal alias otherwise
+    if "*" in pattern or "?" in pattern:
+        return fnmatch.fnmatchcase(host, pattern)
+    return host == pattern
+
+
+def read_hosts(path=SSH_CONFIG):
+    """
+    :return: ordered dict alias -> {lower keyword: (keyword, value)} of literal Host aliases
+    """
+    blocks = [HostBlock(["*"])]  # lines before the first Host apply to every host
+    literal = {}  # alias -> indices of blocks naming it
+    wildcard = []  # indices of blocks with patterns
+
+    for lower, keyword, value in read_lines(path):
+        if lower == "host":
+            patterns = [pattern.lower() for pattern in _split_args(value)]
+            index = len(blocks)
+            blocks.append(HostBlock(patterns))
+            for pattern in patterns:
+                if any(char in pattern for char in WILDCARDS):
+                    if index not in wildcard:
+                        wildcard.append(index)
+                else:
+                    literal.setdefault(pattern, []).append(index)
+        elif lower == "match":
+            # conditions can not be evaluated here, options are skipped
+            blocks.append(HostBlock(None))
+        else:
+            blocks[-1].options.setdefault(lower, (keyword, value))
+    wildcard.insert(0, 0)
+
+    hosts = {}
+    for alias, indices in literal.items():
+        applied = indices + [index for index in wildcard if blocks[index].matches(alias)]
+        options = {}
+        for index in sorted(set(applied)):
+            block = blocks[index]
+            if block.matches(alias):
+                for lower, entry in block.options.items():
+                    options.setdefault(lower, entry)
+        hosts[alias] = options
+    return hosts
+
+
+LOCAL_TOKENS = {}  # tokens of the local side, filled on first use
+
+
+def _local_tokens():
+    if not LOCAL_TOKENS:
+        LOCAL_TOKENS.update({"%": "%", "d": os.path.expanduser("~"), "u": getpass.getuser()})
+    return LOCAL_TOKENS
+
+
+def _expand(value, alias, host, user):
+    """Tokens of ssh_config, the most common ones"""
+    if "%" not in value:
+        return value
+    tokens = dict(_local_tokens(), h=host, n=alias, r=user)
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == "%":
+            token = next(chars, "")
+            result.append(tokens.get(token, "%" + token))
+        else:
+            result.append(char)
+    return "".join(result)
+
+
+def host_fields(alias, options):
+    """
+    :return: profile fields taken from the ssh configuration of the alias
+    """
+    def option(lower, default=None):
+        entry = options.get(lower)
+        return entry[1] if entry is not None else default
+
+    user = option("user") or _local_tokens()["u"]
+    host = _expand(option("hostname", alias), alias, alias, user)
+
+    carried = []
+    for lower, (keyword, value) in options.items():
+        if lower in NOT_CARRIED:
+            continue
+        if any(char.isspace() for char in value):
+            carried.append('-o "{0}={1}"'.format(keyword, value.replace('"', '\\"')))
+        else:
+            carried.append("-o {0}={1}".format(keyword, value))
+
+    identity = _split_args(option("identityfile", ""))
+    return {"server_addr": host,
+            "server_port": option("port", "22"),
+            "server_user": user,
+            # empty lets ssh pick its default identities
+            "key_file": _expand(identity[0], alias, host, user) if identity else "",
+            "ssh_config_options": carried}
+
+
+class SshConfigImporter:
+    """
+    Turns Host aliases into profiles with one save.
+    Profiles remember their alias, importing again updates changed hosts only,
+    ids, local ports and settings edited in the application are kept.
+    """
+    def __init__(self, preferences, port_base=10800):
+        self.preferences = preferences
+        self.port_base = int(port_base)
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        return cls(preferences, preferences.get("app", "import_port_base"))
+
+    def run(self, path=SSH_CONFIG):
+        """
+        :return: dict with lists of added, updated and unchanged profile ids
+        """
+        hosts = read_hosts(path)
+
+        existing = {}  # alias -> profile id
+        used_ports = set(listening_ports())
+        max_id = 0
+        for key, profile in self.preferences.list_parameters("ssh_profiles"):
+            max_id = max(max_id, int(key))
+            used_ports.add(parse_port(profile.get("local_port")))
+            if profile.get("ssh_config_host"):
+                existing[profile["ssh_config_host"]] = int(key)
+
+        template = self.preferences.get("ssh_profile_template")
+        next_port = self.port_base
+        changes = {}
+        report = {"added": [], "updated": [], "unchanged": []}
+
+        for alias, options in hosts.items():
+            fields = host_fields(alias, options)
+            profile_id = existing.get(alias)
+
+            if profile_id is None:
+                while next_port in used_ports:
+                    next_port += 1
+                if next_port > 65535:
+                    log.error(_("No free local port for %s"), alias)
+                    break
+                used_ports.add(next_port)
+
+                max_id += 1
+                profile = {key: list(value) if isinstance(value, list) else value
+                           for key, value in template.items()}
+                profile.update(fields)
+                profile["id"] = max_id
+                profile["name"] = alias
+                profile["local_port"] = str(next_port)
+                profile["ssh_config_host"] = alias
+                # ssh keeps the first value of an option, the host configuration wins over the template
+                profile["extra_options"] = fields["ssh_config_options"] + profile["extra_options"]
+                profile["ssh_config_key_file"] = fields["key_file"]
+                changes[max_id] = profile
+                report["added"].append(max_id)
+                continue
+
+            current = self.preferences.get("ssh_profiles", profile_id)
+            fields["ssh_config_key_file"] = fields["key_file"]
+            if current.get("key_file") != current.get("ssh_config_key_file", current.get("key_file")):
+                # key file chosen in the application
+                fields.pop("key_file")
+            if all(current.get(key) == value for key, value in fields.items()):
+                report["unchanged"].append(profile_id)
+                continue
+
+            profile = dict(current)
+            old_options = set(current.get("ssh_config_options", []))
+            profile["extra_options"] = fields["ssh_config_options"] + \
+                [line for line in current.get("extra_options", []) if line not in old_options]
+            profile.update(fields)
+            changes[profile_id] = profile
+            report["updated"].append(profile_id)
+
+        if changes:
+            self.preferences.update_profiles(changes)
+        log.info(_("Imported %s: %d added, %d updated, %d unchanged"), path,
+                 len(report["added"]), len(report["updated"]), len(report["unchanged"]))
+        return report
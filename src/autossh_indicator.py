@@ -117,20 +117,27 @@ class ControlMenu():
             menu.remove(item)
             return item
 
-    def _load_profiles(self):
-        profiles = [(p.get("id"), p) for (k, p) in self.preferences.list_parameters("ssh_profiles")]
+    def __profile_menu_item(self, profile):
+        active = profile.id in self.active_profiles
+        return self.__check_menu_item(profile.name, checked=active,
+                                      on_activate=self.sig_handler.on_menu_profile_action,
+                                      args=[profile.id])
 
-        for id_, profile in sorted(profiles, reverse=True):
-            show_in_menu = profile.get("show_in_menu", False)
-            # should profile be shown in menu
-            if show_in_menu:
-                active = id_ in self.active_profiles
-                profile_name = profile.get("name")
+    def _load_profiles(self):
+        # only profiles shown in menu are read
+        for profile in reversed(list(self.preferences.iter_profiles(show_in_menu=True))):
+            self.__add_menu_item(self.menu, profile.id, self.__profile_menu_item(profile))
 
-                item = self.__check_menu_item(profile_name, checked=active,
-                                              on_activate=self.sig_handler.on_menu_profile_action,
-                                              args=[id_])
-                self.__add_menu_item(self.menu, id_, item)
+    def update_profiles(self, profile_ids):
+        """Replace items of the given profiles, other items are kept"""
+        for id_ in profile_ids:
+            self.__remove_menu_item(id_)
+            profile = self.preferences.profile(id_)
+            if profile is not None and profile.show_in_menu:
+                # profile items are on top, ordered by id
+                position = sum(1 for other_id in self.profile_items if other_id < id_)
+                self.profile_items[id_] = (self.__profile_menu_item(profile), self.menu)
+                self.menu.insert(self.profile_items[id_][0], position)
 
     def reload(self):
         #remove old profiles
@@ -209,5 +216,9 @@ class TaskbarIndicator:
         self.menu.reload()
         self.update()
 
+    def update_profiles(self, profile_ids):
+        self.menu.update_profiles(profile_ids)
+        self.update()
+
 
 
@@ -7,9 +7,17 @@ Created on 06.05.17 17:13
 @author: pavel
 """
 import sys
+import heapq
+import atexit
 import logging
 import collections
 
+from threading import Thread, Event, Lock
+from time import monotonic, perf_counter, time
+from locale import gettext as _
+
+from autossh_scheduler import TokenBucket
+
 log = logging.getLogger() #root logger
 #Have to set the root logger level, it defaults to logging.WARNING
 log.setLevel(logging.NOTSET)
@@ -29,36 +37,434 @@ stdout_hadler.addFilter(InfoFilter())
 stderr_handler = logging.StreamHandler()
 stderr_handler.setLevel(logging.WARNING)
 
-log.addHandler(stdout_hadler)
-log.addHandler(stderr_handler)
+QUEUE_LIMIT = 10000  # records waiting for the listener, newer records are dropped
+LISTENER_WAKEUP = 0.1  # seconds
+
+
+def freeze(val):
+    # keep no references to mutable objects of the caller
+    return val if type(val) in (str, bytes, int, float, bool) or val is None else str(val)
+
+
+def freeze_args(args):
+    """
+    :return: record args safe to be formatted later in another thread
+    """
+    if isinstance(args, dict):
+        # log.info("%(name)s", {"name": ...})
+        return {key: freeze(val) for key, val in args.items()}
+    elif args:
+        return tuple(freeze(arg) for arg in args)
+    return args
+
+
+class LogDispatcher(logging.Handler):
+    """
+    Root logger handler in front of the handlers which may block.
+    emit puts the record into a bounded queue and returns,
+    a listener thread formats it and calls the real handlers.
+    Until start() records are handled in the calling thread.
+    With a coalescer repeated and rate limited lines are folded
+    before they are queued, no handler sees them.
+    """
+    def __init__(self, limit=QUEUE_LIMIT):
+        super(LogDispatcher, self).__init__()
+        self.limit = limit
+        self.handlers = []
+        self.queue = collections.deque()
+        self.coalescer = None  # LogCoalescer or None
+
+        self.overflow = 0
+        self.overflow_reported = 0
+        self.emitted = 0
+        self.emit_total = 0.0
+        self.emit_max = 0.0
+        self.lag_max = 0.0  # from record creation to delivery
+
+        self.wake = Event()
+        self.running = False
+        self.thread = None
+
+    def add_handler(self, handler):
+        if handler not in self.handlers:
+            self.handlers = self.handlers + [handler]  # copy, listener iterates without lock
+
+    def remove_handler(self, handler):
+        self.handlers = [h for h in self.handlers if h is not handler]
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._loop, name="log-listener", daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Deliver queued records and handle the next ones synchronously"""
+        thread = self.thread
+        if thread is not None:
+            self.running = False
+            self.wake.set()
+            thread.join()
+            self.thread = None
+            self._drain()
+            self._flush_coalescer(force=True)
+
+    def absorbed(self, profile_id, levelno, msg, args):
+        """
+        Check of a noisy source before it makes a record
+        :return: True if the line is only counted as a repeat or a drop
+        """
+        coalescer = self.coalescer
+        return coalescer is not None and coalescer.absorbed(profile_id, levelno, msg, args)
+
+    def handle(self, record):
+        # no handler lock, deque operations are atomic
+        if self.filter(record):
+            coalescer = self.coalescer
+            if coalescer is None:
+                self.emit(record)
+            else:
+                for passed in coalescer.process(record):
+                    self.emit(passed)
+        return True
+
+    def emit(self, record):
+        if self.thread is None:
+            self._deliver(record)
+            return
+
+        started = perf_counter()
+        queue = self.queue
+        if len(queue) >= self.limit:
+            self.overflow += 1
+        else:
+            record.args = freeze_args(record.args)
+            queue.append(record)
+            if len(queue) == 1:
+                self.wake.set()
+
+        elapsed = perf_counter() - started
+        self.emitted += 1
+        self.emit_total += elapsed
+        if elapsed > self.emit_max:
+            self.emit_max = elapsed
+
+    def _loop(self):
+        while self.running:
+            self.wake.wait(LISTENER_WAKEUP)
+            self.wake.clear()
+            self._drain()
+            self._flush_coalescer()
+
+    def _flush_coalescer(self, force=False):
+        """Summaries of series which have stopped, they would wait for the next line otherwise"""
+        coalescer = self.coalescer
+        if coalescer is not None:
+            for record in coalescer.flush(force):
+                self._deliver(record)
+
+    def _drain(self):
+        queue = self.queue
+        while queue:
+            record = queue.popleft()
+            lag = time() - record.created
+            if lag > self.lag_max:
+                self.lag_max = lag
+            self._deliver(record)
+
+        if self.overflow != self.overflow_reported:
+            dropped = self.overflow - self.overflow_reported
+            self.overflow_reported = self.overflow
+            self._deliver(logging.makeLogRecord({"name": __name__,
+                                                 "levelno": logging.WARNING,
+                                                 "levelname": "WARNING",
+                                                 "msg": _("%d log records dropped, log queue is full"),
+                                                 "args": (dropped,)}))
+
+    def _deliver(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def stats(self):
+        return {"queued": len(self.queue),
+                "overflow": self.overflow,
+                "emitted": self.emitted,
+                "emit_avg_us": self.emit_total / self.emitted * 1e6 if self.emitted else None,
+                "emit_max_us": self.emit_max * 1e6,
+                "lag_max_ms": self.lag_max * 1000}
+
+
+dispatcher = LogDispatcher()
+dispatcher.add_handler(stdout_hadler)
+dispatcher.add_handler(stderr_handler)
+log.addHandler(dispatcher)
 
 
 #My logger
+RECORD_OVERHEAD = 200  # approximate bytes of one stored record besides its strings
+NO_PROFILE = None  # ring of records not tagged with a profile id
+REPEAT_FLUSH = 10.0  # seconds, a long series of repeats is reported at least that often
+REPEAT_IDLE = 1.0  # seconds without lines of a profile before its pending summary is written
+
+
+def profile_extra(profile_id):
+    """
+    :return: extra argument of logging calls, routes the record to the ring of the profile
+    """
+    return {"profile_id": profile_id}
+
+
+class _Ring:
+    __slots__ = ("entries", "alerts", "size")
+
+    def __init__(self):
+        self.entries = collections.deque()  # (seq, created, levelno, msg, args)
+        self.alerts = collections.deque()  # entries with level WARNING and above
+        self.size = 0  # approximate bytes
+
+
+class _Source:
+    __slots__ = ("last", "seen", "repeats", "repeat_started", "bucket", "dropped", "dropped_total",
+                 "repeated_total")
+
+    def __init__(self, rate, burst):
+        self.last = None  # last passed record
+        self.seen = 0.0  # last line of the profile
+        self.repeats = 0
+        self.repeat_started = 0.0
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.dropped = 0  # not reported yet
+        self.dropped_total = 0
+        self.repeated_total = 0
+
+
+class LogCoalescer:
+    """
+    Folds identical consecutive messages of a profile into one
+    "repeated N times" record and limits the rate of every profile
+    with a token bucket. Warnings and errors are never dropped.
+    Runs in the dispatcher, before records are queued.
+    """
+    def __init__(self, rate=50.0, burst=200):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.sources = {}  # profile id -> _Source
+        self.formatter = LogFormatter()
+        self.lock = Lock()  # records come from every thread, summaries from the listener
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        return cls(rate=preferences.get("app", "log_rate"),
+                   burst=preferences.get("app", "log_burst"))
+
+    def absorbed(self, profile_id, levelno, msg, args):
+        """
+        Same as process for a line which would not pass, without a record
+        :return: True if the line was counted as a repeat or a drop
+        """
+        with self.lock:
+            source = self.sources.get(profile_id)
+            if source is None:
+                return False
+            last = source.last
+            now = monotonic()
+            if last is None or msg != last.msg or args != last.args or levelno != last.levelno:
+                if source.repeats or levelno >= logging.WARNING or source.bucket is None \
+                        or not source.bucket.empty(now):
+                    # passes or ends a series, process writes it
+                    return False
+                source.seen = now
+                source.dropped += 1
+                source.dropped_total += 1
+                return True
+
+            if source.repeats and now - source.repeat_started >= REPEAT_FLUSH:
+                # due for a summary, process makes it
+                return False
+            source.seen = now
+            source.repeats += 1
+            source.repeated_total += 1
+            if source.repeats == 1:
+                source.repeat_started = now
+            return True
+
+    def process(self, record):
+        """
+        :return: list of records to be handled instead of the record
+        """
+        with self.lock:
+            return self._process(record)
+
+    def _process(self, record):
+        profile_id = getattr(record, "profile_id", NO_PROFILE)
+        source = self.sources.get(profile_id)
+        if source is None:
+            source = self.sources[profile_id] = _Source(self.rate, self.burst)
+
+        now = monotonic()
+        source.seen = now
+        last = source.last
+        if last is not None and record.msg == last.msg and record.args == last.args \
+                and record.levelno == last.levelno:
+            source.repeats += 1
+            source.repeated_total += 1
+            if source.repeats == 1:
+                source.repeat_started = now
+            elif now - source.repeat_started >= REPEAT_FLUSH:
+                return [self._repeated(source)]
+            return []
+
+        records = []
+        if source.repeats:
+            records.append(self._repeated(source))
+
+        if record.levelno < logging.WARNING and source.bucket is not None \
+                and source.bucket.take(now) > 0:
+            source.dropped += 1
+            source.dropped_total += 1
+            return records
+
+        if source.dropped:
+            records.append(self._summary(record, _("%d lines dropped by rate limit"),
+                                         (source.dropped,)))
+            source.dropped = 0
+
+        source.last = record
+        records.append(record)
+        return records
+
+    def flush(self, force=False):
+        """
+        :param force: write every pending summary, e.g. on exit
+        :return: summary records of profiles quiet for REPEAT_IDLE
+        """
+        records = []
+        now = monotonic()
+        with self.lock:
+            for source in self.sources.values():
+                if not (source.repeats or source.dropped) or \
+                        (not force and now - source.seen < REPEAT_IDLE):
+                    continue
+                if source.repeats:
+                    records.append(self._repeated(source))
+                if source.dropped and source.last is not None:
+                    records.append(self._summary(source.last, _("%d lines dropped by rate limit"),
+                                                 (source.dropped,)))
+                    source.dropped = 0
+        return records
+
+    def _repeated(self, source):
+        last = source.last
+        repeats, source.repeats = source.repeats, 0
+        return self._summary(last, _("%s (repeated %d times)"),
+                             (self.formatter.format_message(last.msg, last.args), repeats))
+
+    def _summary(self, record, msg, args):
+        return logging.makeLogRecord({"name": record.name,
+                                      "levelno": record.levelno,
+                                      "levelname": record.levelname,
+                                      "msg": msg,
+                                      "args": args,
+                                      "profile_id": getattr(record, "profile_id", NO_PROFILE)})
+
+    def stats(self):
+        return {str(profile_id): {"repeated": source.repeated_total,
+                                  "dropped": source.dropped_total}
+                for profile_id, source in list(self.sources.items())}
+
+
 class LimLogHandler(logging.Handler):
-    def __init__(self, buffer_size = 100):
+    """
+    Keeps raw records in a bounded ring per profile, records are
+    formatted only when history is read, an observer or an index is attached.
+    Every ring holds at most buffer_size entries, memory_budget bytes
+    are shared by all rings.
+    """
+    def __init__(self, buffer_size = 100, memory_budget = 4 * 1024 * 1024):
         super(LimLogHandler, self).__init__()
         self.setFormatter(LogFormatter())
-        self.circular_buffer = collections.deque(maxlen = buffer_size)
+        self.buffer_size = buffer_size
+        self.memory_budget = memory_budget
+        self.rings = {}  # profile id -> _Ring
+        self.ring_share = memory_budget
+        self.seq = 0
         self.observers = {}
+        self.index = None  # LogIndex kept up to date with the rings
 
         #set level
         self.setLevel(logging.INFO)
         #register itself as global handler
-        log.addHandler(self)
+        dispatcher.add_handler(self)
+
 
+    def set_index(self, index):
+        """Attach a LogIndex, records kept so far are indexed at once"""
+        with self.lock:
+            self.index = index
+            for ring_id, ring in self.rings.items():
+                for entry in ring.entries:
+                    index.add(entry, ring_id, self.formatter.format_message(entry[3], entry[4]))
 
     def set_buffer_size(self, buffer_size):
-        circular_buffer = collections.deque(maxlen = buffer_size)
-        for i in range(min(buffer_size, len(self.circular_buffer))):
-            #take prev entry and append to the left
-            circular_buffer.appendleft(self.circular_buffer.pop())
-        self.circular_buffer = circular_buffer
+        with self.lock:
+            self.buffer_size = buffer_size
+            for ring in self.rings.values():
+                self._trim(ring)
 
     def emit(self, record):
-        msg = self.format(record)
+        profile_id = getattr(record, "profile_id", NO_PROFILE)
+        msg, args = record.msg, freeze_args(record.args)
+        size = self._entry_size(msg, args)
+
+        ring = self.rings.get(profile_id)
+        if ring is None:
+            ring = self._add_ring(profile_id)
+
+        self.seq += 1
+        entry = (self.seq, record.created, record.levelno, msg, args)
+        ring.entries.append(entry)
+        if record.levelno >= logging.WARNING:
+            ring.alerts.append(entry)
+        ring.size += size
+        self._trim(ring)
+
+        if self.observers or self.index is not None:
+            text = self.formatter.format_message(msg, args)
+            if self.index is not None:
+                self.index.add(entry, profile_id, text)
+            if self.observers:
+                self.notify_observers(text)
+
+    def _entry_size(self, msg, args):
+        size = RECORD_OVERHEAD + self._size(msg)
+        if args:
+            size += sum(self._size(arg) for arg in (args.values() if isinstance(args, dict) else args))
+        return size
+
+    def _size(self, val):
+        return len(val) if isinstance(val, (str, bytes)) else 8
+
+    def _add_ring(self, profile_id):
+        ring = self.rings[profile_id] = _Ring()
+        self.ring_share = self.memory_budget // len(self.rings)
+        for other in self.rings.values():
+            self._trim(other)
+        return ring
 
-        self.circular_buffer.append(msg)
-        self.notify_observers(msg)
+    def _trim(self, ring):
+        entries = ring.entries
+        while len(entries) > 1 and (ring.size > self.ring_share or len(entries) > self.buffer_size):
+            seq, created, levelno, msg, args = entries.popleft()
+            ring.size -= self._entry_size(msg, args)
+            if self.index is not None:
+                self.index.discard(seq)
+            if ring.alerts and ring.alerts[0][0] <= seq:
+                ring.alerts.popleft()
 
     def add_observer(self, obs_name, on_entry_cb):
         self.observers[obs_name] = on_entry_cb
@@ -69,23 +475,78 @@ class LimLogHandler(logging.Handler):
             log.info(_("Observer %s unregistered"), obs_name)
 
     def notify_observers(self, msg):
-        for observer_cb in self.observers.values():
+        for observer_cb in list(self.observers.values()):
             observer_cb(msg)
 
-    def history(self):
-        return self.circular_buffer
+    def records(self, profile_id=False):
+        """
+        :param profile_id: single profile, NO_PROFILE or False for every ring
+        :return: raw records (seq, created, levelno, msg, args), oldest first
+        """
+        with self.lock:
+            if profile_id is not False:
+                ring = self.rings.get(profile_id)
+                return list(ring.entries) if ring is not None else []
+            rings = [list(ring.entries) for ring in self.rings.values()]
+        return list(heapq.merge(*rings))
+
+    def select(self, profile_id=False, min_level=logging.NOTSET, after_seq=0):
+        """
+        Snapshot of the rings for searching
+        :param min_level: WARNING and above are served from the alert index
+        :param after_seq: only records newer than that
+        :return: [(profile id, [records oldest first])]
+        """
+        selected = []
+        with self.lock:
+            if profile_id is not False:
+                rings = [(profile_id, self.rings.get(profile_id))]
+            else:
+                rings = list(self.rings.items())
+
+            for id_, ring in rings:
+                if ring is None:
+                    continue
+                entries = ring.alerts if min_level >= logging.WARNING else ring.entries
+                if not entries or entries[-1][0] <= after_seq:
+                    continue
+
+                if after_seq:
+                    # few new records, no copy of the whole ring
+                    new = []
+                    for entry in reversed(entries):
+                        if entry[0] <= after_seq:
+                            break
+                        new.append(entry)
+                    new.reverse()
+                    selected.append((id_, new))
+                else:
+                    selected.append((id_, list(entries)))
+        return selected
+
+    def history(self, profile_id=False):
+        """
+        :return: formatted messages, oldest first
+        """
+        return [self.formatter.format_message(msg, args)
+                for seq, created, levelno, msg, args in self.records(profile_id)]
+
+    def memory_usage(self):
+        with self.lock:
+            return {str(profile_id): {"entries": len(ring.entries), "bytes": ring.size}
+                    for profile_id, ring in self.rings.items()}
 
 class LogFormatter(logging.Formatter):
     def format(self, record):
-        msg = record.msg
+        return self.format_message(record.msg, record.args)
+
+    def format_message(self, msg, args):
         if type(msg) in (list, tuple, set):
             return " ".join(self.get_str(m) for m in msg)
-        return self.get_str(msg) % record.args
+        return self.get_str(msg) % args if args else self.get_str(msg)
 
 
     def get_str(self, val):
         if isinstance(val, bytes):
             return val.decode("utf-8").strip()
         return str(val).strip()
-
-
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 23.10.26 14:30
+
+@author: pavel
+"""
+import re
+import heapq
+import logging
+
+from time import time
+
+log = logging.getLogger(__name__)
+
+MAX_RESULTS = 10000  # newest matches returned by a search
+COMPACT_MIN = 10000  # trimmed records before postings are compacted
+TOKEN = re.compile(r"\w+")
+REGEX_CHARS = set(".^$*+?{}[]\\|()")
+
+
+class LogQuery:
+    """Filter of the log history, every field is optional"""
+    __slots__ = ("profile_id", "min_level", "pattern", "terms", "window")
+
+    def __init__(self, profile_id=False, min_level=logging.NOTSET, text="", window=0):
+        """
+        :param profile_id: single profile, NO_PROFILE or False for every profile
+        :param text: substring or regular expression, case insensitive
+        :param window: seconds before now, 0 for the whole history
+        """
+        self.profile_id = profile_id
+        self.min_level = min_level
+        self.window = window
+        self.pattern = None
+        self.terms = ()  # words of a plain text, looked up in the token index
+        if text:
+            try:
+                self.pattern = re.compile(text, re.IGNORECASE)
+                literal = not REGEX_CHARS.intersection(text)
+            except re.error:
+                self.pattern = re.compile(re.escape(text), re.IGNORECASE)
+                literal = True
+            if literal:
+                self.terms = tuple(TOKEN.findall(text.lower()))
+
+    def is_empty(self):
+        return self.profile_id is False and self.min_level <= logging.INFO \
+            and self.pattern is None and not self.window
+
+
+class LogIndex:
+    """
+    Index of the raw records of LimLogHandler, maintained as records
+    are appended and trimmed. Every record is kept with its formatted
+    message, plain text queries intersect the postings of the words
+    they contain and check only those records.
+    Profiles are served by the per-profile rings, warnings and errors
+    by the alert index of every ring, time windows by bisection.
+    """
+    def __init__(self, log_handler):
+        self.log_handler = log_handler
+        self.records = {}  # seq -> (seq, created, levelno, profile_id, text)
+        self.postings = {}  # lower case token -> seqs in ascending order
+        self.discarded = 0  # trimmed since postings were compacted
+        log_handler.set_index(self)
+
+    # called by the log handler with its lock held
+    def add(self, entry, profile_id, text):
+        """
+        :param entry: raw record (seq, created, levelno, msg, args)
+        :param text: formatted message
+        """
+        seq = entry[0]
+        self.records[seq] = (seq, entry[1], entry[2], profile_id, text)
+        postings = self.postings
+        for token in set(TOKEN.findall(text.lower())):
+            posting = postings.get(token)
+            if posting is None:
+                postings[token] = [seq]
+            else:
+                posting.append(seq)
+
+    def discard(self, seq):
+        if self.records.pop(seq, None) is not None:
+            self.discarded += 1
+            if self.discarded > len(self.records) + COMPACT_MIN:
+                self._compact()
+
+    def _compact(self):
+        records = self.records
+        postings = {}
+        for token, posting in self.postings.items():
+            posting = [seq for seq in posting if seq in records]
+            if posting:
+                postings[token] = posting
+        self.postings = postings
+        self.discarded = 0
+
+    def search(self, query, after_seq=0, limit=MAX_RESULTS):
+        """
+        :param after_seq: only records newer than that, for incremental updates
+        :return: ([(seq, created, levelno, profile_id, text)] oldest first, number of matches)
+        """
+        since = time() - query.window if query.window else None
+        if query.terms:
+            matches = self._lookup(query, after_seq, since)
+        else:
+            selected = self.log_handler.select(query.profile_id, query.min_level, after_seq)
+            streams = []
+            for profile_id, entries in selected:
+                if since is not None:
+                    entries = entries[self._first_after(entries, since):]
+                streams.append(self._matches(profile_id, entries, query))
+            matches = list(heapq.merge(*streams))
+        return matches[-limit:], len(matches)
+
+    def _lookup(self, query, after_seq, since):
+        """Records containing every word of the query, checked against the whole text"""
+        with self.log_handler.lock:
+            # postings of the rarest word, the others are checked with the whole text
+            best = None
+            for term in set(query.terms):
+                # words at the ends of the text may be parts of longer tokens
+                postings = [posting for token, posting in self.postings.items() if term in token]
+                size = sum(len(posting) for posting in postings)
+                if best is None or size < best[0]:
+                    best = (size, postings)
+            seqs = set()
+            for posting in best[1]:
+                seqs.update(posting)
+            found = [self.records.get(seq) for seq in seqs if seq > after_seq]
+
+        profile_id = query.profile_id
+        min_level = query.min_level
+        pattern = query.pattern
+        matches = [record for record in found
+                   if record is not None
+                   and (profile_id is False or record[3] == profile_id)
+                   and record[2] >= min_level
+                   and (since is None or record[1] >= since)
+                   and pattern.search(record[4])]
+        matches.sort()
+        return matches
+
+    def _matches(self, profile_id, entries, query):
+        records = self.records
+        format_message = self.log_handler.formatter.format_message
+        min_level = query.min_level
+        pattern = query.pattern
+
+        matches = []
+        for seq, created, levelno, msg, args in entries:
+            if levelno < min_level:
+                continue
+            record = records.get(seq)
+            text = record[4] if record is not None else format_message(msg, args)
+            if pattern is None or pattern.search(text):
+                matches.append((seq, created, levelno, profile_id, text))
+        return matches
+
+    def _first_after(self, entries, since):
+        """
+        Records are ordered by seq, their timestamps are close enough to be bisected
+        :return: index of the first record created at since or later
+        """
+        lo, hi = 0, len(entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entries[mid][1] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
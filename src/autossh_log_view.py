@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 23.10.26 11:05
+
+@author: pavel
+"""
+import logging
+
+from threading import Lock
+from time import localtime, strftime
+
+from gi.repository import GObject
+from gi.repository import Gtk
+
+from autossh_log import NO_PROFILE
+from autossh_log_index import LogIndex, LogQuery, MAX_RESULTS
+
+log = logging.getLogger(__name__)
+from locale import gettext as _
+
+FRAME_INTERVAL = 16  # ms, lines are flushed into the view at most once per frame
+FILTER_DELAY = 200  # ms, typing in the search entry is debounced
+ALL_PROFILES = "all"
+APP_MESSAGES = "app"
+
+
+class LogView:
+    """
+    Log tab text view fed by LimLogHandler observer.
+    Lines are collected in the listener thread and inserted at once
+    by a single main loop callback per frame; the buffer keeps
+    the last keep_lines lines. Nothing is collected while hidden,
+    the view is reloaded from history when shown again.
+    While a filter is set, matches of the history are shown
+    in a fixed height tree view instead and new matches are appended.
+    """
+    (COL_TIME, COL_PROFILE, COL_LEVEL, COL_TEXT) = range(4)
+
+    def __init__(self, builder, preferences, log_handler):
+        self.preferences = preferences
+        self.log_handler = log_handler
+
+        self.log_textview = builder.get_object("log_textview")
+        self.log_buffer = self.log_textview.get_buffer()
+        # right gravity, stays after inserted text
+        self.end_mark = self.log_buffer.create_mark("end", self.log_buffer.get_end_iter(), False)
+
+        self.pending = []
+        self.lock = Lock()
+        self.scheduled = False
+        self.visible = False
+        self.stale = True  # lines were missed while hidden
+
+        self.index = LogIndex(log_handler)
+        self.query = LogQuery()
+        self.last_seq = 0  # newest record in the filter results
+        self.filter_source = None
+        self.loading = False
+
+        self.log_scrolledwindow = builder.get_object("log_scrolledwindow")
+        self.filter_scrolledwindow = builder.get_object("log_filter_scrolledwindow")
+        self.filter_status = builder.get_object("log_filter_status")
+        self.filter_profile = builder.get_object("log_filter_profile")
+        self.filter_level = builder.get_object("log_filter_level")
+        self.filter_window = builder.get_object("log_filter_window")
+        self.filter_text = builder.get_object("log_filter_text")
+
+        self.filter_model = Gtk.ListStore(str, str, str, str)
+        self.filter_view = builder.get_object("log_filter_view")
+        for title, column_id, width in ((_("Time"), self.COL_TIME, 70),
+                                        (_("Profile"), self.COL_PROFILE, 90),
+                                        (_("Level"), self.COL_LEVEL, 70),
+                                        (_("Message"), self.COL_TEXT, 600)):
+            column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=column_id)
+            # rows are measured once, only visible rows are rendered
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_fixed_width(width)
+            column.set_resizable(True)
+            self.filter_view.append_column(column)
+        self.filter_view.set_fixed_height_mode(True)
+        self.filter_view.set_model(self.filter_model)
+
+        self.log_handler.add_observer("log_textview", self.on_entry)
+
+    def keep_lines(self):
+        return max(1, self.preferences.get("app", "log_keep_entries"))
+
+    def show(self):
+        with self.lock:
+            self.visible = True
+            stale, self.stale = self.stale, False
+            self.pending = []
+
+        self.load_profiles()
+        if not self.query.is_empty():
+            self.apply_filter()
+        elif stale:
+            history = self.log_handler.history()
+            self.log_buffer.set_text("\n".join(history[-self.keep_lines():]))
+            self.scroll()
+
+    def hide(self):
+        with self.lock:
+            self.visible = False
+            self.pending = []
+
+    def on_entry(self, msg):
+        """Called from the log listener thread"""
+        with self.lock:
+            if not self.visible:
+                self.stale = True
+                return
+
+            self.pending.append(msg)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        GObject.timeout_add(FRAME_INTERVAL, self.flush)
+
+    def flush(self):
+        with self.lock:
+            lines, self.pending = self.pending, []
+            self.scheduled = False
+
+        if not self.query.is_empty():
+            if lines and self.visible:
+                self.append_matches()
+            return False
+
+        keep = self.keep_lines()
+        if lines and self.visible:
+            lines = lines[-keep:]
+            text = "\n".join(lines)
+            if self.log_buffer.get_char_count() > 0:
+                text = "\n" + text
+            self.log_buffer.insert(self.log_buffer.get_end_iter(), text)
+            self.trim(keep)
+
+            if self.preferences.get("app", "log_autoscroll"):
+                self.scroll()
+
+        return False  # run once
+
+    def trim(self, keep):
+        extra = self.log_buffer.get_line_count() - keep
+        if extra > 0:
+            start = self.log_buffer.get_start_iter()
+            end = self.log_buffer.get_iter_at_line(extra)
+            self.log_buffer.delete(start, end)
+
+    def scroll(self):
+        self.log_textview.scroll_mark_onscreen(self.end_mark)
+
+    # filter
+    def load_profiles(self):
+        active_id = self.filter_profile.get_active_id() or ALL_PROFILES
+        self.loading = True
+        self.filter_profile.remove_all()
+        self.filter_profile.append(ALL_PROFILES, _("All profiles"))
+        self.filter_profile.append(APP_MESSAGES, _("Application"))
+        for profile in self.preferences.iter_profiles():
+            self.filter_profile.append(str(profile.id), profile.name)
+        if not self.filter_profile.set_active_id(active_id):
+            self.filter_profile.set_active_id(ALL_PROFILES)
+        self.loading = False
+
+    def on_filter_changed(self, widget):
+        """Filter bar signal, applied after the user stops typing"""
+        if self.loading:
+            return
+        if self.filter_source is not None:
+            GObject.source_remove(self.filter_source)
+        self.filter_source = GObject.timeout_add(FILTER_DELAY, self.apply_filter)
+
+    def read_query(self):
+        profile = self.filter_profile.get_active_id() or ALL_PROFILES
+        if profile == ALL_PROFILES:
+            profile_id = False
+        elif profile == APP_MESSAGES:
+            profile_id = NO_PROFILE
+        else:
+            profile_id = int(profile)
+
+        return LogQuery(profile_id=profile_id,
+                        min_level=int(self.filter_level.get_active_id() or 0),
+                        text=self.filter_text.get_text(),
+                        window=int(self.filter_window.get_active_id() or 0))
+
+    def apply_filter(self):
+        self.filter_source = None
+        self.query = self.read_query()
+
+        filtering = not self.query.is_empty()
+        self.log_scrolledwindow.set_visible(not filtering)
+        self.filter_scrolledwindow.set_visible(filtering)
+        self.filter_status.set_visible(filtering)
+
+        if not filtering:
+            self.stale = True
+            self.show()
+            return False
+
+        matches, total = self.index.search(self.query)
+        # detached model is filled without view updates
+        self.filter_view.set_model(None)
+        self.filter_model.clear()
+        self.add_rows(matches)
+        self.filter_view.set_model(self.filter_model)
+        self.set_status(total)
+        self.scroll_filter()
+        return False
+
+    def append_matches(self):
+        matches, total = self.index.search(self.query, after_seq=self.last_seq)
+        if matches:
+            self.add_rows(matches)
+            extra = len(self.filter_model) - MAX_RESULTS
+            for i in range(max(0, extra)):
+                self.filter_model.remove(self.filter_model.get_iter_first())
+            self.set_status(len(self.filter_model))
+
+            if self.preferences.get("app", "log_autoscroll"):
+                self.scroll_filter()
+
+    def add_rows(self, matches):
+        names = {}
+        for seq, created, levelno, profile_id, text in matches:
+            name = names.get(profile_id)
+            if name is None:
+                name = names[profile_id] = "-" if profile_id is NO_PROFILE else \
+                    self.preferences.get("ssh_profiles", profile_id, "name", string_mode=True)
+            self.filter_model.append((strftime("%H:%M:%S", localtime(created)), name,
+                                      logging.getLevelName(levelno), text))
+            self.last_seq = max(self.last_seq, seq)
+
+    def set_status(self, total):
+        if total > len(self.filter_model):
+            self.filter_status.set_text(_("Last {0} of {1} matches").format(len(self.filter_model), total))
+        else:
+            self.filter_status.set_text(_("{0} matches").format(total))
+
+    def scroll_filter(self):
+        count = len(self.filter_model)
+        if count:
+            self.filter_view.scroll_to_cell(Gtk.TreePath(count - 1), None, False, 0, 0)
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 19.10.26 14:00
+
+@author: pavel
+"""
+import logging
+import functools
+
+from threading import RLock
+from time import monotonic
+from locale import gettext as _
+
+import autossh_master
+
+from autossh_client import AutosshClient
+from autossh_supervisor import TunnelSupervisor
+from autossh_scheduler import ConnectionScheduler
+from autossh_prober import LatencyProber, STATE_FAILED
+from autossh_relay import RelayServer, free_port
+from autossh_reconnect import ReconnectEngine, STATE_BACKOFF, STATE_OPEN
+from autossh_ports import PortIndex
+from autossh_resources import ResourceSampler
+from autossh_events import SshEventParser, EVENT_LISTENING, EVENT_DISCONNECTED, phase_latencies
+from autossh_pool import TunnelPool, DEFAULT_LATENCY
+from autossh_shutdown import ShutdownCoordinator
+
+log = logging.getLogger(__name__)
+
+
+def synchronized(method):
+    """Manager state is changed from the GUI, control, supervisor, scheduler and watcher threads"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TunnelManager:
+    """
+    Tunnel supervision shared by the GUI and the headless daemon.
+    Must not import GI modules.
+    Methods changing tunnels hold one reentrant lock.
+    """
+    def __init__(self, preferences):
+        self.preferences = preferences
+        self.lock = RLock()
+        self.active_profiles = {}
+        self.pools = {}  # name -> TunnelPool
+        self.standbys = {}  # profile_id -> AutosshClient waiting to take over
+        self.failovers = {}  # profile_id -> failover statistics
+        self.restarts = set()  # profile ids to connect again once stopped
+        self.observers = {}
+
+        self.supervisor = TunnelSupervisor(self.preferences.get("app", "poll_interval"))
+        self.supervisor.start()
+
+        self.scheduler = ConnectionScheduler.from_preferences(self.preferences)
+        self.scheduler.start()
+
+        self.prober = LatencyProber.from_preferences(self.preferences, self.active_profiles)
+        self.prober.add_observer("manager", self.on_probe_state)
+        self.prober.start()
+
+        self.relay_server = RelayServer()
+        self.relay_server.start()
+
+        self.reconnect = ReconnectEngine.from_preferences(self.preferences)
+        self.port_index = PortIndex(self.preferences)
+
+        self.resources = ResourceSampler.from_preferences(self.preferences, self.active_profiles)
+        self.resources.start()
+
+    def add_observer(self, obs_name, on_update_cb):
+        """
+        :param on_update_cb: function without arguments, called when tunnel states change
+        """
+        self.observers[obs_name] = on_update_cb
+
+    def delete_observer(self, obs_name):
+        self.observers.pop(obs_name, None)
+
+    def notify_observers(self):
+        for observer_cb in list(self.observers.values()):
+            observer_cb()
+
+    @synchronized
+    def autostart(self):
+        for profile in list(self.preferences.iter_profiles(autostart=True)):
+            self.connect(profile.id)
+
+        for name, pool in self.preferences.list_parameters("tunnel_pools"):
+            if pool.get("autostart", False):
+                self.start_pool(name)
+
+    @synchronized
+    def connect(self, profile_id):
+        log.debug(_("Connecting %s"), profile_id)
+
+        # queued and restarting clients are in active_profiles as well
+        if profile_id not in self.active_profiles:
+            profile = self.preferences.profile(profile_id)
+            problem = None
+            if profile is not None:
+                problem = profile.problem or self.check_local_port(profile_id, profile.local_port)
+
+            forward_port = None
+            if problem is None and profile is not None and \
+                    (profile.relay or self.uses_standby(profile)):
+                # ssh listens on an internal port, standby can take it over
+                forward_port = free_port()
+                problem = self.relay_server.listen(profile_id, profile.local_port, forward_port)
+
+            if problem is not None:
+                log.error(_("Can not connect %s: %s"), profile.name, problem)
+            elif profile is not None:
+                ssh_client = AutosshClient(self.preferences, profile, forward_port)
+                ssh_client.event_parser = SshEventParser(profile_id, self.on_tunnel_event)
+                self.active_profiles[profile_id] = ssh_client
+                self.reconnect.reset(profile_id)
+                self.schedule_start(ssh_client)
+            else:
+                log.error(_("No SSH profile with id %s"), profile_id)
+
+        self.notify_observers()
+
+    def uses_standby(self, profile):
+        if not profile.warm_standby:
+            return False
+        if profile.shared_master:
+            log.warning(_("%s: warm standby is not used with a shared master connection"),
+                        profile.name)
+            return False
+        return True
+
+    @synchronized
+    def start_standby(self, profile_id):
+        """Spawn a second authenticated connection of an active profile"""
+        ssh_client = self.active_profiles.get(profile_id)
+        if ssh_client is None or profile_id in self.standbys:
+            return
+
+        # same settings as the primary even if the profile was edited meanwhile
+        standby = AutosshClient(self.preferences, ssh_client.profile, free_port())
+        standby.event_parser = SshEventParser(profile_id)
+        self.standbys[profile_id] = standby
+        log.info(_("Starting standby of %s on port %s"), standby.prof_name, standby.forward_port)
+        standby.run(self.supervisor, lambda id_, code: self.on_client_stop(standby, code))
+
+    @synchronized
+    def stop_standby(self, profile_id):
+        standby = self.standbys.pop(profile_id, None)
+        if standby is not None:
+            standby.stop()
+
+    @synchronized
+    def on_client_stop(self, ssh_client, code):
+        """Stop callback of standby clients, they may have been promoted since start"""
+        profile_id = ssh_client.prof_id
+        if self.active_profiles.get(profile_id) is ssh_client:
+            self.on_ssh_stop(profile_id, code)
+        elif self.standbys.get(profile_id) is ssh_client:
+            log.info(_("Standby of %s has stopped, return code %s"), profile_id, code)
+            self.standbys.pop(profile_id)
+
+    def failover(self, profile_id, ssh_client):
+        """
+        Move the profile port to a ready standby
+        :return: True if the standby has taken over
+        """
+        standby = self.standbys.get(profile_id)
+        if standby is None or not standby.is_active() or standby.stopping:
+            return False
+        timeline = standby.event_parser.timeline
+        if not timeline.ready() or EVENT_DISCONNECTED in timeline.phases:
+            return False
+
+        exited = monotonic()
+        self.standbys.pop(profile_id)
+        self.relay_server.set_upstream(profile_id, standby.forward_port)
+        standby.event_parser.on_event_cb = self.on_tunnel_event
+        self.active_profiles[profile_id] = standby
+        switched = monotonic()
+
+        # ssh usually reports the broken connection before it exits
+        old_timeline = ssh_client.event_parser.timeline
+        broken = old_timeline.phases.get(EVENT_DISCONNECTED)
+        broken = old_timeline.started + broken if broken is not None else exited
+
+        stats = self.failovers.setdefault(profile_id, {"count": 0, "switch_last": None,
+                                                       "downtime_last": None, "downtime_max": 0.0})
+        stats["count"] += 1
+        stats["switch_last"] = switched - exited
+        stats["downtime_last"] = switched - broken
+        stats["downtime_max"] = max(stats["downtime_max"], stats["downtime_last"])
+        log.info(_("Tunnel %s failed over to standby in %.3f ms, %.2f s after disconnect"),
+                 profile_id, stats["switch_last"] * 1000, stats["downtime_last"])
+
+        # the new primary is ready, its replacement can start right away
+        self.start_standby(profile_id)
+        return True
+
+    def schedule_start(self, ssh_client, delay=0.0):
+        def start():
+            # scheduler thread
+            with self.lock:
+                self.reconnect.on_started(ssh_client.prof_id)
+                ssh_client.event_parser.start()
+                ssh_client.run(self.supervisor, self.on_ssh_stop)
+
+        self.scheduler.submit(ssh_client.prof_id, start, delay)
+
+    def check_local_port(self, profile_id, local_port):
+        """
+        :return: problem description or None if profile can use the port
+        """
+        return self.port_index.check(profile_id, local_port, self.active_profiles)
+
+    @synchronized
+    def disconnect(self, profile_id):
+        """
+        Safely disconnect
+        :param profile_id:
+        :return: False if profile was not active
+        """
+        log.debug(_("Disconnecting %s"), profile_id)
+        if profile_id in self.active_profiles:
+            ssh_client = self.active_profiles[profile_id]
+            ssh_client.stop()
+            self.stop_standby(profile_id)
+
+            if self.scheduler.cancel(profile_id):
+                # waiting for start or restart
+                self.on_ssh_stop(profile_id, None)
+            return True
+
+        log.error(_("No active SSH profile with id %s"), profile_id)
+        return False
+
+    @synchronized
+    def start_pool(self, name):
+        """
+        Connect pool members and start listening on the pool port
+        :return: False if there is no such pool
+        """
+        pool_conf = self.preferences.get("tunnel_pools", name)
+        if pool_conf is None:
+            log.error(_("No tunnel pool %s"), name)
+            return False
+
+        if name not in self.pools:
+            members = [int(id_) for id_ in pool_conf.get("members", [])]
+            for profile_id in members:
+                self.connect(profile_id)
+
+            pool = TunnelPool(name, pool_conf.get("local_port"), members, self.member_health)
+            self.pools[name] = pool
+            self.relay_server.add_relay(pool)
+        return True
+
+    @synchronized
+    def stop_pool(self, name):
+        """Stop listening, members keep running"""
+        pool = self.pools.pop(name, None)
+        if pool is not None:
+            self.relay_server.remove(pool.profile_id)
+        return pool is not None
+
+    def member_health(self, profile_id):
+        """
+        Called from the relay thread for every pooled connection
+        :return: (local port, latency in seconds) or None if tunnel is not usable
+        """
+        ssh_client = self.active_profiles.get(profile_id)
+        if ssh_client is None or not ssh_client.is_active():
+            return None
+        if self.prober.state(profile_id) == STATE_FAILED:
+            return None
+
+        timeline = ssh_client.event_parser.timeline
+        if EVENT_DISCONNECTED in timeline.phases:
+            return None
+
+        latency = self.prober.last_rtt(profile_id)
+        if latency is None:
+            latency = timeline.phases.get(EVENT_LISTENING, DEFAULT_LATENCY)
+        return ssh_client.local_port, latency
+
+    @synchronized
+    def disconnect_all(self):
+        for profile_id in list(self.active_profiles.keys()):
+            self.disconnect(profile_id)
+
+    @synchronized
+    def profile_changed(self, profile_id):
+        self.port_index.update(profile_id,
+                               self.preferences.get("ssh_profiles", profile_id, "local_port"))
+
+    @synchronized
+    def profile_removed(self, profile_id):
+        self.port_index.remove(profile_id)
+
+    @synchronized
+    def restart(self, profile_id):
+        """Reconnect with the current profile settings"""
+        if profile_id in self.active_profiles:
+            self.restarts.add(profile_id)
+            self.disconnect(profile_id)
+
+    @synchronized
+    def apply_config(self, added, changed, removed):
+        """
+        Apply profiles reloaded from the file, other tunnels are not touched
+        :param added, changed, removed: lists of profile ids
+        """
+        for profile_id in removed:
+            self.restarts.discard(profile_id)
+            if profile_id in self.active_profiles:
+                self.disconnect(profile_id)
+            self.profile_removed(profile_id)
+
+        for profile_id in changed:
+            self.profile_changed(profile_id)
+            ssh_client = self.active_profiles.get(profile_id)
+            if ssh_client is not None and \
+                    not self.preferences.profile(profile_id).same_connection(ssh_client.profile):
+                log.info(_("Restarting %s with the new settings"), ssh_client.prof_name)
+                self.restart(profile_id)
+
+        for profile_id in added:
+            self.profile_changed(profile_id)
+            if self.preferences.profile(profile_id).autostart:
+                self.connect(profile_id)
+
+        self.notify_observers()
+
+    @synchronized
+    def shutdown(self):
+        """
+        Stop every tunnel within shutdown_timeout, stragglers are killed
+        :return: dict profile_id -> {"latency": seconds or None, "killed": bool}
+        """
+        # nothing is started or restarted from now on
+        self.scheduler.stop()
+        self.restarts.clear()
+
+        clients = list(self.active_profiles.values()) + list(self.standbys.values())
+        self.standbys.clear()
+        report = ShutdownCoordinator.from_preferences(self.preferences).run(clients)
+
+        for profile_id, ssh_client in list(self.active_profiles.items()):
+            if ssh_client.process is None and self.scheduler.cancel(profile_id):
+                # was waiting for start or restart
+                self.on_ssh_stop(profile_id, None)
+
+        autossh_master.close_masters(self.preferences.get("app", "shutdown_timeout"))
+        self.prober.stop()
+        self.resources.stop()
+        self.relay_server.stop()
+        self.supervisor.stop()
+        return report
+
+    @synchronized
+    def on_ssh_stop(self, profile_id, code=0):
+        name = self.preferences.get("ssh_profiles", profile_id, "name", string_mode=True)
+        log.info(_("SSH %s has stopped"), name)
+        log.info(_("return code %s"), code)
+
+        self.scheduler.release(profile_id)
+
+        ssh_client = self.active_profiles.get(profile_id)
+        if ssh_client is not None:
+            ssh_client.event_parser.finish(code)
+
+        if ssh_client is not None and not ssh_client.stopping:
+            if self.failover(profile_id, ssh_client):
+                self.notify_observers()
+                return
+
+            delay = self.reconnect.on_stopped(profile_id)
+            if delay is not None:
+                log.info(_("Restarting %s in %.1f s"), name, delay)
+                self.schedule_start(ssh_client, delay)
+                self.notify_observers()
+                return
+
+        self.relay_server.remove(profile_id)
+        self.stop_standby(profile_id)
+
+        if profile_id in self.active_profiles:
+            self.active_profiles.pop(profile_id)
+
+        if profile_id in self.restarts:
+            self.restarts.discard(profile_id)
+            self.connect(profile_id)
+            return
+        self.notify_observers()
+
+    @synchronized
+    def on_tunnel_event(self, profile_id, event, timeline):
+        """Called from supervisor thread"""
+        if event == EVENT_LISTENING:
+            # handshake is over, let the next tunnel start
+            self.scheduler.release(profile_id)
+            self.reconnect.on_ready(profile_id)
+            log.info(_("Tunnel %s is ready in %.2f s"), profile_id, timeline.phases[event])
+
+            ssh_client = self.active_profiles.get(profile_id)
+            if ssh_client is not None and not ssh_client.stopping and \
+                    ssh_client.forward_port != ssh_client.local_port and \
+                    self.uses_standby(ssh_client.profile):
+                self.start_standby(profile_id)
+            self.notify_observers()
+        elif event == EVENT_DISCONNECTED:
+            log.info(_("Tunnel %s disconnected: %s"), profile_id, timeline.reason)
+
+    def timeline(self, profile_id):
+        """
+        :return: dict with phases of the last connection attempt or None
+        """
+        ssh_client = self.active_profiles.get(profile_id)
+        if ssh_client is None or ssh_client.event_parser is None:
+            return None
+
+        timeline = ssh_client.event_parser.timeline
+        data = timeline.as_dict()
+        data["latencies"] = phase_latencies(timeline)
+        return data
+
+    def on_probe_state(self, profile_id, state):
+        if state != STATE_FAILED:
+            self.reconnect.on_ready(profile_id)
+        self.notify_observers()
+
+    def tunnel_state(self, profile_id):
+        """
+        :return: "running", "queued", "backoff", "stopped" or "open" if restarts were given up
+        """
+        ssh_client = self.active_profiles.get(profile_id)
+        if ssh_client is None:
+            if self.reconnect.state(profile_id) == STATE_OPEN:
+                return "open"
+            return "stopped"
+        if ssh_client.is_active():
+            return "running"
+        if self.reconnect.state(profile_id) == STATE_BACKOFF:
+            return "backoff"
+        return "queued"
+
+    def standby_status(self, profile_id):
+        standby = self.standbys.get(profile_id)
+        stats = self.failovers.get(profile_id)
+        if standby is None and stats is None:
+            return None
+
+        data = dict(stats) if stats is not None else {"count": 0}
+        data["ready"] = standby is not None and standby.event_parser.timeline.ready()
+        data["port"] = standby.forward_port if standby is not None else None
+        return data
+
+    @synchronized
+    def status(self, profile_id=None):
+        """
+        :param profile_id: single profile or None for every known tunnel
+        :return: json serializable dict
+        """
+        if profile_id is not None:
+            ids = [profile_id]
+        else:
+            ids = list(self.active_profiles.keys())
+
+        tunnels = {}
+        for id_ in ids:
+            ssh_client = self.active_profiles.get(id_)
+            process = ssh_client.process if ssh_client is not None else None
+            tunnels[str(id_)] = {"state": self.tunnel_state(id_),
+                                 "pid": process.pid if process is not None else None,
+                                 "probe": self.prober.status(id_),
+                                 "reconnect": self.reconnect.stats(id_),
+                                 "timeline": self.timeline(id_),
+                                 "relay": self.relay_server.stats(id_),
+                                 "standby": self.standby_status(id_),
+                                 "resources": self.resources.status(id_)}
+
+        return {"tunnels": tunnels,
+                "pools": {name: pool.status() for name, pool in list(self.pools.items())},
+                "scheduler": self.scheduler.stats()}
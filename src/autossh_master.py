@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 18.10.26 17:05
+
+@author: pavel
+
+Shared ssh master connections.
+Profiles with the same server, port, user and key are multiplexed over
+one ControlMaster connection, so only the first one pays for key exchange
+and authentication.
+"""
+import os
+import hashlib
+import logging
+import subprocess
+
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+SSH_EXECUTABLE = "ssh"
+CONTROL_TIMEOUT = 2
+
+# sockets of masters started by this instance, the GUI and the daemon may share control_dir
+own_masters = set()
+
+
+def control_dir(preferences):
+    directory = os.path.expanduser(preferences.get("app", "control_dir"))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+
+def control_path(preferences, profile):
+    """
+    Socket path has to fit into sun_path, so the key is hashed
+    :param profile: compiled SshProfile
+    """
+    digest = hashlib.sha1("\0".join(profile.master_key()).encode("utf-8")).hexdigest()
+    return os.path.join(control_dir(preferences), digest[:16])
+
+
+def master_options(preferences, profile):
+    """
+    :return: ssh options attaching the profile to its shared master
+    """
+    path = control_path(preferences, profile)
+    if not os.path.exists(path):
+        # the tunnel becomes the master
+        own_masters.add(path)
+    return ["-o", "ControlMaster=auto",
+            "-o", "ControlPath={0}".format(path),
+            "-o", "ControlPersist={0}".format(preferences.get("app", "control_persist"))]
+
+
+def _control_command(path, profile, *args):
+    command = [SSH_EXECUTABLE, "-S", path] + list(args)
+    command += ["-p", str(profile.server_port), "-l", profile.server_user, profile.server_addr]
+    try:
+        return subprocess.call(command, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               timeout=CONTROL_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        log.info("ssh control command failed: %s", e)
+
+
+def cancel_forward(preferences, profile, forward_port):
+    """
+    Forwards requested through the master belong to the master,
+    they have to be cancelled explicitly when the tunnel stops
+    """
+    path = control_path(preferences, profile)
+    if os.path.exists(path):
+        _control_command(path, profile, "-O", "cancel", "-D", str(forward_port))
+
+
+def close_masters(timeout=CONTROL_TIMEOUT):
+    """
+    Ask every master started by this instance to exit,
+    all at once, commands still running after timeout are killed
+    """
+    commands = []
+    for path in list(own_masters):
+        own_masters.discard(path)
+        if not os.path.exists(path):
+            continue
+        log.debug("Closing master %s", path)
+        try:
+            commands.append(subprocess.Popen([SSH_EXECUTABLE, "-S", path, "-O", "exit", "localhost"],
+                                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                             stderr=subprocess.DEVNULL))
+        except OSError as e:
+            log.info("ssh control command failed: %s", e)
+
+    deadline = monotonic() + timeout
+    for command in commands:
+        try:
+            command.wait(max(0.0, deadline - monotonic()))
+        except subprocess.TimeoutExpired as e:
+            log.info("ssh control command failed: %s", e)
+            command.kill()
+            command.wait()
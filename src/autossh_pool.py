@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 21.10.26 09:40
+
+@author: pavel
+"""
+import random
+import logging
+
+from time import monotonic
+
+from autossh_relay import Relay
+
+log = logging.getLogger(__name__)
+
+POOL_PREFIX = "pool:"
+DEFAULT_LATENCY = 0.1  # seconds, member has not been measured yet
+MIN_LATENCY = 0.001
+FAIL_COOLDOWN = 5.0  # seconds a member is skipped after a failed connect
+
+
+class TunnelPool(Relay):
+    """
+    One local listener spreading new connections over the SOCKS ports
+    of several equivalent tunnels. Members are weighted by latency and
+    by the number of connections they already carry; unhealthy members
+    and members which have just refused a connection are skipped.
+    """
+    def __init__(self, name, listen_port, members, health_cb):
+        """
+        :param members: profile ids
+        :param health_cb: function(profile_id) -> (port, latency in seconds) or None if unhealthy
+        """
+        super(TunnelPool, self).__init__(POOL_PREFIX + name, listen_port, None)
+        self.name = name
+        self.members = list(members)
+        self.health_cb = health_cb
+
+        self.connections = {}  # upstream port -> active connections
+        self.cooldown = {}  # upstream port -> monotonic time until it is skipped
+
+    def acquire(self):
+        now = monotonic()
+        candidates = []
+        total = 0.0
+        for profile_id in self.members:
+            health = self.health_cb(profile_id)
+            if health is None:
+                continue
+            port, latency = health
+            if self.cooldown.get(port, 0) > now:
+                continue
+
+            weight = 1.0 / (max(latency, MIN_LATENCY) * (1 + self.connections.get(port, 0)))
+            candidates.append((weight, port))
+            total += weight
+
+        if not candidates:
+            return None
+
+        point = random.uniform(0, total)
+        for weight, port in candidates:
+            point -= weight
+            if point <= 0:
+                break
+
+        self.connections[port] = self.connections.get(port, 0) + 1
+        return port
+
+    def release(self, upstream_port):
+        count = self.connections.get(upstream_port, 0) - 1
+        if count > 0:
+            self.connections[upstream_port] = count
+        else:
+            self.connections.pop(upstream_port, None)
+
+    def failed(self, upstream_port):
+        self.cooldown[upstream_port] = monotonic() + FAIL_COOLDOWN
+
+    def status(self):
+        members = []
+        for profile_id in self.members:
+            health = self.health_cb(profile_id)
+            port = health[0] if health is not None else None
+            members.append({"id": profile_id,
+                            "healthy": health is not None,
+                            "latency": health[1] if health is not None else None,
+                            "connections": self.connections.get(port, 0)})
+
+        data = self.stats.as_dict()
+        data.pop("durations")
+        data["listen_port"] = self.listen_port
+        data["members"] = members
+        return data
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 19.10.26 11:10
+
+@author: pavel
+"""
+import logging
+
+from threading import Lock
+from time import monotonic
+from locale import gettext as _
+
+log = logging.getLogger(__name__)
+
+PROC_NET_FILES = ("/proc/net/tcp", "/proc/net/tcp6")
+TCP_LISTEN = "0A"
+SCAN_CACHE_TIME = 1.0  # seconds, mass connects share one scan
+
+
+def listening_ports(proc_files=PROC_NET_FILES):
+    """
+    Ports of listening TCP sockets of every process
+    :return: set of ints
+    """
+    ports = set()
+    for proc_file in proc_files:
+        try:
+            with open(proc_file, "r") as f:
+                next(f, None)  # header
+                for line in f:
+                    # sl local_address rem_address st ...
+                    fields = line.split(None, 4)
+                    if len(fields) >= 4 and fields[3] == TCP_LISTEN:
+                        ports.add(int(fields[1].rpartition(":")[2], 16))
+        except OSError as e:
+            log.debug("Can not read %s: %s", proc_file, e)
+    return ports
+
+
+def parse_port(value):
+    """
+    :return: port as int or None if it is not a valid port
+    """
+    try:
+        port = int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+    if 0 < port < 65536:
+        return port
+
+
+class PortIndex:
+    """
+    Local ports of all profiles, used to refuse a connection
+    before anything is spawned
+    """
+    def __init__(self, preferences):
+        self.preferences = preferences
+        self.ports = {}  # port -> set of profile ids
+        self.profile_ports = {}  # profile id -> port
+        self.lock = Lock()
+
+        self.scan_time = None
+        self.scan_ports = set()
+
+        self.build()
+
+    def build(self):
+        with self.lock:
+            self.ports.clear()
+            self.profile_ports.clear()
+            for profile_id, local_port in self.preferences.local_ports():
+                self._add(profile_id, local_port)
+
+    def _add(self, profile_id, local_port):
+        port = parse_port(local_port)
+        if port is not None:
+            self.ports.setdefault(port, set()).add(profile_id)
+            self.profile_ports[profile_id] = port
+
+    def _remove(self, profile_id):
+        port = self.profile_ports.pop(profile_id, None)
+        if port is not None:
+            owners = self.ports.get(port)
+            owners.discard(profile_id)
+            if not owners:
+                self.ports.pop(port)
+
+    def update(self, profile_id, local_port):
+        with self.lock:
+            self._remove(profile_id)
+            self._add(profile_id, local_port)
+
+    def remove(self, profile_id):
+        with self.lock:
+            self._remove(profile_id)
+
+    def listening(self):
+        now = monotonic()
+        if self.scan_time is None or now - self.scan_time > SCAN_CACHE_TIME:
+            self.scan_ports = listening_ports()
+            self.scan_time = now
+        return self.scan_ports
+
+    def owners(self, port):
+        with self.lock:
+            return set(self.ports.get(port, ()))
+
+    def check(self, profile_id, local_port, active_profiles=(), scan=True):
+        """
+        :param profile_id: profile to be checked
+        :param local_port: its local port
+        :param active_profiles: ids of running profiles
+        :param scan: check listening sockets of the system as well
+        :return: problem description or None
+        """
+        port = parse_port(local_port)
+        if port is None:
+            return _("Invalid local port '{0}'").format(local_port)
+
+        others = self.owners(port) - {profile_id}
+        running = [id_ for id_ in others if id_ in active_profiles]
+        if running:
+            return _("Local port {0} is used by running profile {1}").format(port, running[0])
+
+        if scan and profile_id not in active_profiles and port in self.listening():
+            return _("Local port {0} is already in use").format(port)
+
+        if others:
+            # not fatal while the other profile is stopped
+            log.info(_("Local port %s is shared with profiles %s"), port, sorted(others))
@@ -8,7 +8,16 @@ Created on 03.05.17 12:24
 """
 import os
 import json
+import atexit
+import shutil
+import hashlib
 from copy import deepcopy
+from threading import Thread, Condition, RLock, Lock
+from time import monotonic
+
+import autossh_store
+
+from autossh_profile import SshProfile
 
 #logging
 import logging
@@ -25,6 +34,9 @@ from locale import gettext as _
 
 
 CONFIG_FILE = "~/.config/autossh-gui/config.json"
+SAVE_DELAY = 1.0  # seconds without changes before the file is written
+SAVE_MAX_DELAY = 5.0  # seconds, continuous changes are written at least that often
+COMPILED_LIMIT = 4096  # compiled profiles kept with the sqlite store
 DEFAULT = { "files" : {
                             "main_glade_file" : "autossh-gui.glade"
                             ,"editor_glade_file" : "autossh-editor.glade"
@@ -42,12 +54,51 @@ DEFAULT = { "files" : {
                             ,"autostart" : False
                             ,"poll_interval" : 0.1
                             ,"log_keep_entries" : 100
+                            ,"log_memory_kb" : 4096
+                            ,"log_coalesce" : True
+                            ,"log_rate" : 50.0
+                            ,"log_burst" : 200
+                            ,"disk_log" : True
+                            ,"disk_log_dir" : "~/.cache/autossh-gui/log"
+                            ,"disk_log_segment_kb" : 4096
+                            ,"disk_log_segment_age" : 86400
+                            ,"disk_log_segments" : 20
+                            ,"disk_log_compress" : True
                             ,"log_autoscroll" : False
+                            ,"connect_concurrency" : 8
+                            ,"connect_rate" : 4.0
+                            ,"connect_burst" : 8
+                            ,"connect_jitter" : 0.5
+                            ,"connect_hold" : 5.0
+                            ,"probe_interval" : 30.0
+                            ,"probe_timeout" : 3.0
+                            ,"probe_history" : 60
+                            ,"probe_degraded_ms" : 1000
+                            ,"probe_target" : ""
+                            ,"control_dir" : "~/.cache/autossh-gui/cm"
+                            ,"control_persist" : "60"
+                            ,"control_socket" : ""
+                            ,"resource_interval" : 10.0
+                            ,"resource_history" : 60
+                            ,"shutdown_timeout" : 1.0
+                            ,"config_watch" : True
+                            ,"config_watch_interval" : 1.0
+                            ,"import_port_base" : 10800
+                            ,"profile_store" : "json"
+                            ,"profile_db" : "~/.config/autossh-gui/profiles.db"
+                            ,"reconnect_base" : 1.0
+                            ,"reconnect_max" : 60.0
+                            ,"reconnect_jitter" : 0.2
+                            ,"reconnect_failures" : 8
+                            ,"reconnect_stable" : 30.0
             }, "ssh_profile_template" :{
                             "id" : 0
                             ,"name" : "SSH Profile {0}"
                             ,"autostart" : False
                             ,"show_in_menu" : True
+                            ,"relay" : False
+                            ,"shared_master" : False
+                            ,"warm_standby" : False
                             ,"executable" : "autossh"
                             ,"server_addr":"1.2.3.4"
                             ,"server_port":"22"
@@ -55,9 +106,14 @@ DEFAULT = { "files" : {
                             ,"local_port":"9999"
                             ,"key_file" :"~/.ssh/id_pub"
                             ,"extra_options" : ["-v -C -N -T", "-o TCPKeepAlive=yes","-o ServerAliveInterval=300"]
-                            ,"env_options" : ["AUTOSSH_POLL=30","AUTOSSH_GATETIME=0","AUTOSSH_DEBUG=1","AUTOSSH_PORT=0"]
+                            ,"env_options" : ["AUTOSSH_POLL=30","AUTOSSH_GATETIME=0","AUTOSSH_DEBUG=1","AUTOSSH_PORT=0","AUTOSSH_MAXSTART=1"]
+                            ,"tags" : []
+                            ,"ssh_config_host" : ""
+                            ,"ssh_config_options" : []
+                            ,"ssh_config_key_file" : ""
 
             },  "ssh_profiles" : {}
+            ,   "tunnel_pools" : {}
 
             }
 
@@ -70,10 +126,28 @@ class Preferences:
 
         self.options = deepcopy(DEFAULT)
 
+        # write-behind state, guarded by lock
+        self.lock = RLock()
+        self.write_lock = Lock()  # one writer at a time, file is written without lock
+        self.changed = Condition(self.lock)
+        self.dirty = False
+        self.dirty_since = 0.0  # first change not written yet
+        self.last_change = 0.0
+        self.saved_hash = None  # of the file content
+        self.unsaved = set()  # ids as string of profiles changed since the last write
+        self.writer = None
+
+        # compiled profiles, dropped when their dict is changed
+        self.compiled = {}  # id as string -> SshProfile
+        self.compiled_list = None
+        self.store = None  # SqliteProfileStore in place of the ssh_profiles dict
+
         try:
             log.debug("Open %s", self.conf_file)
             with open(self.conf_file, "r") as f:
-                data = json.loads(f.read())
+                content = f.read()
+            self.saved_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+            data = json.loads(content)
             for cat, params in data.items():
                 if cat in self.options:
                     self.options[cat].update(params)
@@ -84,6 +158,43 @@ class Preferences:
             log.info("Problem reading preference file %s", str(e))
             log.exception(e)
 
+        if self.options["app"].get("profile_store") == "sqlite":
+            self.open_store()
+
+    def open_store(self):
+        """
+        Keep profiles in sqlite, profiles of the json file are moved there once
+        """
+        if not autossh_store.available():
+            log.error(_("sqlite3 is not available, profiles are kept in %s"), self.conf_file)
+            return
+
+        path = self.get("app", "profile_db")
+        try:
+            store = autossh_store.SqliteProfileStore(path)
+        except Exception as e:
+            log.error(_("Can not open profile store %s: %s"), path, e)
+            return
+
+        json_profiles = self.options.get("ssh_profiles") or {}
+        if json_profiles:
+            if len(store) == 0:
+                backup = self.conf_file + ".bak"
+                shutil.copy2(self.conf_file, backup)
+                store.update(json_profiles)
+                log.info(_("%d profiles moved to %s, old configuration kept as %s"),
+                         len(json_profiles), store.path, backup)
+            else:
+                log.warning(_("Profiles of %s are ignored, %s is used"), self.conf_file, store.path)
+
+        with self.lock:
+            self.store = store
+            self.options["ssh_profiles"] = store
+            self.invalidate(("ssh_profiles",))
+            if json_profiles:
+                # written without profiles
+                self.mark_dirty()
+
     def list_parameters(self, *path):
         """    
         :param path: path       
@@ -112,17 +223,26 @@ class Preferences:
         # json keeps parameter names as string
         name = str(path[-1])
         node = self.options
+        profile = None
 
-        for branch in path[:-1]:
+        for depth, branch in enumerate(path[:-1]):
             # json keeps parameter names as string
             branch = str(branch)
             if branch not in node:
                 log.debug("No such path %s", path)
                 return
             node = node[branch]
+            if depth == 1:
+                profile = node
 
         if name in node:
-            return node.pop(name)
+            with self.lock:
+                value = node.pop(name)
+                self.store_back(path, profile)
+                self.note_unsaved(path)
+                self.invalidate(path)
+                self.mark_dirty()
+            return value
 
     def get(self, *path, string_mode=False):
         """        
@@ -173,25 +293,252 @@ class Preferences:
             # json keeps parameter names as string
             name = str(path[-1])
             node = self.options
+            profile = None
 
-            for branch in path[:-1]:
+            for depth, branch in enumerate(path[:-1]):
                 # json keeps parameter names as string
                 branch = str(branch)
                 if branch not in node:
                     node[branch] = {}
                 node = node[branch]
-
-            if name not in node:
-                node[name] = value
-            else: # type conversion
-                src_type = type(value)
-                target_type = type(node[name])
-
-                node[name] = self.__convert_type(value, src_type, target_type)
+                if depth == 1:
+                    profile = node
+
+            with self.lock:
+                if name not in node:
+                    node[name] = value
+                else: # type conversion
+                    src_type = type(value)
+                    target_type = type(node[name])
+
+                    node[name] = self.__convert_type(value, src_type, target_type)
+                self.store_back(path, profile)
+                self.note_unsaved(path)
+                self.invalidate(path)
+                self.mark_dirty()
 
         except Exception as e:
             log.info("Error setting property %s: %s", name, e)
             log.exception(e)
+
+    def store_back(self, path, profile):
+        """Profiles read from the store are copies, changed ones are written back"""
+        if self.store is not None and len(path) > 2 and str(path[0]) == "ssh_profiles":
+            self.store[str(path[1])] = profile
+
+    def note_unsaved(self, path):
+        """Edits of a profile not written yet win over a reload of the file"""
+        if len(path) >= 2 and str(path[0]) == "ssh_profiles":
+            self.unsaved.add(str(path[1]))
+
+    def _compile(self, key, data):
+        if self.store is not None and len(self.compiled) >= COMPILED_LIMIT:
+            # memory stays bounded, profiles in use are compiled again on demand
+            self.compiled.clear()
+        compiled = self.compiled[key] = SshProfile(key, data)
+        return compiled
+
+    def profile(self, profile_id):
+        """
+        :return: compiled SshProfile, cached until the profile is changed, or None
+        """
+        key = str(profile_id)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            with self.lock:
+                data = self.get("ssh_profiles", key)
+                if data is None:
+                    return None
+                compiled = self._compile(key, data)
+        return compiled
+
+    def profiles(self):
+        """
+        :return: list of compiled profiles ordered by id, shared by callers
+        """
+        if self.store is not None:
+            return list(self.iter_profiles())
+
+        compiled_list = self.compiled_list
+        if compiled_list is None:
+            with self.lock:
+                compiled_list = [self.profile(key) for key in self.options["ssh_profiles"]]
+                compiled_list.sort(key=lambda profile: profile.id)
+                self.compiled_list = compiled_list
+        return compiled_list
+
+    def profile_page(self, after_id=-1, limit=autossh_store.PAGE_SIZE, **filters):
+        """
+        :param after_id: return profiles with larger ids
+        :param filters: name (substring), server_addr, tag, autostart, show_in_menu
+        :return: list of compiled profiles ordered by id
+        """
+        if self.store is not None:
+            rows = self.store.page(after_id, limit, **filters)
+            with self.lock:
+                return [self.compiled.get(str(profile_id)) or self._compile(str(profile_id), data)
+                        for profile_id, data in rows]
+
+        profiles = self.profiles()
+        # ordered by id
+        lo, hi = 0, len(profiles)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if profiles[mid].id <= after_id:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        page = []
+        for profile in profiles[lo:]:
+            if self.__filter(profile, **filters):
+                page.append(profile)
+                if len(page) >= limit:
+                    break
+        return page
+
+    def __filter(self, profile, name=None, server_addr=None, tag=None,
+                 autostart=None, show_in_menu=None):
+        return (not name or name.lower() in profile.name.lower()) and \
+            (server_addr is None or profile.server_addr == server_addr) and \
+            (tag is None or tag in profile.tags) and \
+            (autostart is None or profile.autostart == autostart) and \
+            (show_in_menu is None or profile.show_in_menu == show_in_menu)
+
+    def iter_profiles(self, **filters):
+        """
+        Compiled profiles ordered by id, read page by page from the store
+        :param filters: see profile_page
+        """
+        if self.store is None:
+            for profile in self.profiles():
+                if self.__filter(profile, **filters):
+                    yield profile
+            return
+
+        after_id = -1
+        while True:
+            page = self.profile_page(after_id, **filters)
+            if not page:
+                return
+            yield from page
+            after_id = page[-1].id
+
+    def max_profile_id(self):
+        if self.store is not None:
+            return self.store.max_id()
+        return max([int(key) for key in self.options["ssh_profiles"]] + [0])
+
+    def local_ports(self):
+        """
+        :return: [(profile id, local port as stored or parsed, see parse_port)]
+        """
+        if self.store is not None:
+            return self.store.local_ports()
+        return [(profile.get("id"), profile.get("local_port"))
+                for profile in list(self.options["ssh_profiles"].values())]
+
+    def update_profiles(self, profiles):
+        """
+        Add or replace many profiles at once, saved with one write
+        :param profiles: dict profile id -> profile dict
+        """
+        with self.lock:
+            if self.store is not None:
+                # one transaction
+                self.store.update(profiles)
+            else:
+                node = self.options["ssh_profiles"]
+                for profile_id, profile in profiles.items():
+                    # json keeps parameter names as string
+                    node[str(profile_id)] = profile
+            for profile_id in profiles:
+                self.compiled.pop(str(profile_id), None)
+                self.unsaved.add(str(profile_id))
+            self.compiled_list = None
+            self.mark_dirty()
+
+    def reload_file(self):
+        """
+        Apply changes made to the file by other programs.
+        Profiles are compared one by one, only changed ones are replaced.
+        Profiles edited here and not written yet are kept, the next write
+        saves them together with the changes of the file.
+        With the sqlite store profiles of the file are ignored.
+        :return: (added, changed, removed) lists of profile ids
+                 or None if the file has not changed
+        """
+        try:
+            with open(self.conf_file, "r") as f:
+                content = f.read()
+        except OSError as e:
+            log.info("Problem reading preference file %s", str(e))
+            return None
+
+        content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        if content_hash == self.saved_hash:
+            # written by us
+            return None
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            # may be half written by an editor, the final write comes later
+            log.warning(_("Configuration %s is not valid: %s"), self.conf_file, e)
+            return None
+
+        added, changed, removed = [], [], []
+        with self.lock:
+            profiles = self.options["ssh_profiles"]
+            new_profiles = data.pop("ssh_profiles", {})
+            if self.store is not None:
+                new_profiles = profiles = {}
+            for key, profile in new_profiles.items():
+                if key in self.unsaved:
+                    continue
+                old = profiles.get(key)
+                if old is None:
+                    added.append(int(key))
+                elif old != profile:
+                    changed.append(int(key))
+                else:
+                    continue
+                profiles[key] = profile
+                self.compiled.pop(key, None)
+
+            for key in [key for key in profiles
+                        if key not in new_profiles and key not in self.unsaved]:
+                profiles.pop(key)
+                self.compiled.pop(key, None)
+                removed.append(int(key))
+
+            if added or removed:
+                self.compiled_list = None
+            elif changed and self.compiled_list is not None:
+                # same ids, only the changed profiles are compiled again
+                self.compiled_list = [self.profile(profile.id) for profile in self.compiled_list]
+
+            for cat, params in data.items():
+                if cat in self.options and isinstance(params, dict):
+                    self.options[cat].update(params)
+                else:
+                    self.options[cat] = params
+            self.saved_hash = content_hash
+
+        log.info(_("Configuration reloaded: %d added, %d changed, %d removed"),
+                 len(added), len(changed), len(removed))
+        return added, changed, removed
+
+    def invalidate(self, path):
+        """Drop compiled profiles under the changed path"""
+        with self.lock:
+            if not path or str(path[0]) != "ssh_profiles":
+                return
+            if len(path) >= 2:
+                self.compiled.pop(str(path[1]), None)
+            else:
+                self.compiled.clear()
+            self.compiled_list = None
+
     """
     def list_properties(self):
         for cat, params in self.options.items():
@@ -199,17 +546,100 @@ class Preferences:
                 yield cat, name
     """
 
+    def mark_dirty(self):
+        """Schedule write-behind save, bursts of changes are written once"""
+        with self.lock:
+            now = monotonic()
+            if not self.dirty:
+                self.dirty = True
+                self.dirty_since = now
+            self.last_change = now
+
+            if self.writer is None:
+                self.writer = Thread(target=self._write_behind, name="preferences", daemon=True)
+                self.writer.start()
+                atexit.register(self.flush)
+            self.changed.notify()
+
     def save(self):
+        """Save soon in the background"""
+        self.mark_dirty()
+
+    def flush(self):
+        """Write pending changes now, e.g. on quit"""
+        self._write()
+
+    def _write_behind(self):
+        while True:
+            with self.lock:
+                while not self.dirty:
+                    self.changed.wait()
+
+                now = monotonic()
+                due = min(self.last_change + SAVE_DELAY, self.dirty_since + SAVE_MAX_DELAY)
+                if now < due:
+                    self.changed.wait(due - now)
+                    continue
+            self._write()
+
+    def _write(self):
+        with self.write_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                try:
+                    options = self.options
+                    if self.store is not None:
+                        # profiles are written by the store
+                        options = {cat: params for cat, params in options.items()
+                                   if cat != "ssh_profiles"}
+                    data = json.dumps(options, indent=4)
+                except RuntimeError as e:
+                    # options were changed by another thread meanwhile, next round
+                    log.debug("Can not serialize preferences: %s", e)
+                    self.last_change = monotonic()
+                    return
+                self.dirty = False
+                unsaved, self.unsaved = self.unsaved, set()
+
+            if not self._write_file(data):
+                with self.lock:
+                    self.unsaved |= unsaved
+
+    def _write_file(self, data):
+        content_hash = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        if content_hash == self.saved_hash:
+            log.debug("Configuration is not changed")
+            return True
+
+        # set before the file appears, so the watcher does not reload our own write
+        previous_hash, self.saved_hash = self.saved_hash, content_hash
         log.debug("Writing file %s", self.conf_file)
         try:
-            os.makedirs(os.path.dirname(self.conf_file), exist_ok=True)
+            directory = os.path.dirname(self.conf_file)
+            os.makedirs(directory, exist_ok=True)
 
-            with open(self.conf_file, "w") as f:
-                data = json.dumps(self.options, indent=4)
+            # a crash leaves either the old or the new file
+            tmp_file = self.conf_file + ".tmp"
+            with open(tmp_file, "w") as f:
                 f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.conf_file)
+
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
             log.info("Configuration saved as %s", self.conf_file)
+            return True
 
         except Exception as e:
             log.exception(e)
             log.info("Error witing file %s: %s", self.conf_file, e)
+            self.saved_hash = previous_hash
+            self.mark_dirty()  # try again later
+            return False
 
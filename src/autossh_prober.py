@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 18.10.26 13:15
+
+@author: pavel
+"""
+import socket
+import struct
+import logging
+import selectors
+import collections
+
+from threading import Thread, Event, Lock
+from time import monotonic, time
+from locale import gettext as _
+
+log = logging.getLogger(__name__)
+
+STATE_OK = "ok"
+STATE_DEGRADED = "degraded"
+STATE_FAILED = "failed"
+
+SOCKS_GREETING = b"\x05\x01\x00"  # version 5, one method, no authentication
+SOCKS_CONNECT_REPLY_MIN = 10  # header with IPv4 bound address
+
+
+class _Probe:
+    """SOCKS5 handshake state machine for one tunnel"""
+    __slots__ = ("profile_id", "sock", "request", "expect", "received", "stage", "started")
+
+    def __init__(self, profile_id, port, connect_request):
+        self.profile_id = profile_id
+        self.request = connect_request
+        self.received = b""
+        self.stage = "connect"
+        self.started = monotonic()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        self.sock.connect_ex(("127.0.0.1", port))
+
+
+class ProbeStatus:
+    __slots__ = ("state", "last_rtt", "failures", "history")
+
+    def __init__(self, history_size):
+        self.state = None  # not probed yet
+        self.last_rtt = None
+        self.failures = 0
+        self.history = collections.deque(maxlen=history_size)  # (timestamp, rtt or None)
+
+    def avg_rtt(self):
+        rtts = [rtt for (ts, rtt) in self.history if rtt is not None]
+        if rtts:
+            return sum(rtts) / len(rtts)
+
+    def as_dict(self):
+        return {"state": self.state,
+                "last_rtt": self.last_rtt,
+                "avg_rtt": self.avg_rtt(),
+                "failures": self.failures,
+                "history": list(self.history)}
+
+
+class LatencyProber:
+    """
+    Periodically does SOCKS5 handshake (and optionally CONNECT to target)
+    through local port of every running tunnel.
+    All tunnels are probed concurrently from one thread.
+    """
+    def __init__(self, active_profiles, interval=30.0, timeout=3.0, history_size=60,
+                 degraded_ms=1000, target=None):
+        self.active_profiles = active_profiles
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self.history_size = int(history_size)
+        self.degraded = degraded_ms / 1000.0
+        self.connect_request = self.make_connect_request(target)
+
+        self.statuses = {}  # profile_id -> ProbeStatus
+        self.observers = {}
+        self.lock = Lock()
+
+        self.wake = Event()
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_preferences(cls, preferences, active_profiles):
+        return cls(active_profiles,
+                   interval=preferences.get("app", "probe_interval"),
+                   timeout=preferences.get("app", "probe_timeout"),
+                   history_size=preferences.get("app", "probe_history"),
+                   degraded_ms=preferences.get("app", "probe_degraded_ms"),
+                   target=preferences.get("app", "probe_target"))
+
+    @staticmethod
+    def make_connect_request(target):
+        """
+        :param target: "host:port" or None
+        :return: SOCKS5 CONNECT request or None
+        """
+        if not target:
+            return None
+
+        host, _sep, port = target.rpartition(":")
+        try:
+            host = host.strip("[]").encode("idna")
+            port = int(port)
+        except (UnicodeError, ValueError):
+            host, port = b"", 0
+        if not host or len(host) > 255 or not 0 < port <= 65535:
+            log.warning(_("Ignoring probe target %s, expected host:port"), target)
+            return None
+        return b"\x05\x01\x00\x03" + bytes([len(host)]) + host + struct.pack("!H", port)
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.running = True
+            self.thread = Thread(target=self._loop, name="latency-prober", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def probe_now(self):
+        self.wake.set()
+
+    def add_observer(self, obs_name, on_change_cb):
+        """
+        :param on_change_cb: function(profile_id, state), called on state changes
+        """
+        self.observers[obs_name] = on_change_cb
+
+    def delete_observer(self, obs_name):
+        self.observers.pop(obs_name, None)
+
+    def status(self, profile_id):
+        """
+        :return: dict with state, last_rtt, avg_rtt, failures and history or None
+        """
+        with self.lock:
+            status = self.statuses.get(profile_id)
+            if status is not None:
+                return status.as_dict()
+
+    def state(self, profile_id):
+        status = self.statuses.get(profile_id)
+        if status is not None:
+            return status.state
+
+    def last_rtt(self, profile_id):
+        status = self.statuses.get(profile_id)
+        if status is not None:
+            return status.last_rtt
+
+    def forget(self, profile_id):
+        with self.lock:
+            self.statuses.pop(profile_id, None)
+
+    def _loop(self):
+        while self.running:
+            try:
+                self.probe_all()
+            except Exception as e:
+                log.exception(e)
+
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def _running_ports(self):
+        ports = {}
+        for profile_id, client in list(self.active_profiles.items()):
+            if client.process is not None:
+                ports[profile_id] = int(client.local_port)
+        return ports
+
+    def probe_all(self):
+        ports = self._running_ports()
+
+        # drop tunnels which are gone
+        with self.lock:
+            for profile_id in list(self.statuses.keys()):
+                if profile_id not in ports:
+                    self.statuses.pop(profile_id)
+
+        if not ports:
+            return
+
+        results = self.run_probes(ports)
+
+        now = time()
+        for profile_id, rtt in results.items():
+            self._record(profile_id, now, rtt)
+
+    def run_probes(self, ports):
+        """
+        :param ports: dict profile_id -> local port
+        :return: dict profile_id -> rtt in seconds or None on failure
+        """
+        results = {}
+        selector = selectors.DefaultSelector()
+
+        for profile_id, port in ports.items():
+            probe = _Probe(profile_id, port, self.connect_request)
+            selector.register(probe.sock, selectors.EVENT_WRITE, probe)
+
+        deadline = monotonic() + self.timeout
+        while selector.get_map():
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+
+            for key, mask in selector.select(remaining):
+                probe = key.data
+                rtt = self._advance(selector, probe)
+                if rtt is not False:
+                    results[probe.profile_id] = rtt
+                    selector.unregister(probe.sock)
+                    probe.sock.close()
+
+        # timed out
+        for key in list(selector.get_map().values()):
+            results[key.data.profile_id] = None
+            key.fileobj.close()
+        selector.close()
+
+        return results
+
+    def _advance(self, selector, probe):
+        """
+        :return: False while in progress, rtt on success, None on failure
+        """
+        try:
+            if probe.stage == "connect":
+                if probe.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                    return None
+                probe.sock.send(SOCKS_GREETING)
+                probe.stage = "greeting"
+                selector.modify(probe.sock, selectors.EVENT_READ, probe)
+                return False
+
+            data = probe.sock.recv(512)
+            if not data:
+                return None
+            probe.received += data
+
+            if probe.stage == "greeting":
+                if len(probe.received) < 2:
+                    return False
+                if probe.received[:2] != b"\x05\x00":
+                    return None
+                if probe.request is None:
+                    return monotonic() - probe.started
+
+                probe.received = b""
+                probe.stage = "request"
+                probe.sock.send(probe.request)
+                return False
+
+            # CONNECT reply
+            if len(probe.received) < SOCKS_CONNECT_REPLY_MIN:
+                return False
+            if probe.received[1] != 0:
+                return None
+            return monotonic() - probe.started
+
+        except OSError as e:
+            log.debug("Probe %s failed: %s", probe.profile_id, e)
+            return None
+
+    def _record(self, profile_id, timestamp, rtt):
+        with self.lock:
+            status = self.statuses.get(profile_id)
+            if status is None:
+                status = self.statuses[profile_id] = ProbeStatus(self.history_size)
+
+            status.history.append((timestamp, rtt))
+            status.last_rtt = rtt
+
+            prev_state = status.state
+            if rtt is None:
+                status.failures += 1
+                status.state = STATE_FAILED
+            else:
+                status.failures = 0
+                status.state = STATE_DEGRADED if rtt > self.degraded else STATE_OK
+
+            state = status.state
+
+        if state != prev_state:
+            log.info("Tunnel %s latency state %s", profile_id, state)
+            for observer_cb in list(self.observers.values()):
+                observer_cb(profile_id, state)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 23.10.26 18:10
+
+@author: pavel
+
+Compiled ssh profiles.
+The json dict of a profile is validated and converted once, connects,
+view reloads and menu rebuilds read the typed fields of the result.
+"""
+import os
+import shlex
+import logging
+
+from locale import gettext as _
+
+from autossh_ports import parse_port
+
+log = logging.getLogger(__name__)
+
+
+def _text(data, key, default=""):
+    value = data.get(key)
+    return default if value is None else str(value).strip()
+
+
+def _lines(data, key):
+    value = data.get(key) or []
+    if isinstance(value, str):
+        value = value.splitlines()
+    return value
+
+
+def split_options(extra_options):
+    """
+    :param extra_options: lines of ssh options, e.g. ["-o TCPKeepAlive=yes"],
+                          quotes keep values with spaces together
+    :return: tuple of argv tokens
+    """
+    tokens = []
+    for option in extra_options:
+        option = str(option)
+        if '"' in option or "'" in option:
+            try:
+                tokens += shlex.split(option)
+                continue
+            except ValueError:
+                log.warning("Unbalanced quotes in %s", option)
+        tokens += option.split()
+    return tuple(tokens)
+
+
+def split_env(env_options):
+    """
+    :param env_options: lines of KEY=value
+    :return: tuple of (key, value), lines without a key are ignored
+    """
+    overlay = []
+    for opt in env_options:
+        key, eq_sign, val = str(opt).partition("=")
+        if eq_sign and key:
+            overlay.append((key, val))
+    return tuple(overlay)
+
+
+class SshProfile:
+    """
+    Read only view of one profile, replaced as a whole when the profile changes.
+    Invalid profiles are compiled as well, so they can be listed and edited,
+    problem tells why they can not be connected.
+    """
+    __slots__ = ("id", "name", "autostart", "show_in_menu",
+                 "relay", "shared_master", "warm_standby",
+                 "executable", "server_addr", "server_port", "server_user",
+                 "local_port", "key_file", "options", "env_overlay", "argv_tail", "tags", "problem")
+
+    def __init__(self, profile_id, data):
+        """
+        :param profile_id: key of the profile in the preferences
+        :param data: profile dict of the preferences
+        """
+        # json keeps parameter names as string, profile ids are ints
+        self.id = int(profile_id)
+        self.name = _text(data, "name")
+        self.problem = None
+
+        self.autostart = bool(data.get("autostart", False))
+        self.show_in_menu = bool(data.get("show_in_menu", False))
+        self.relay = bool(data.get("relay", False))
+        self.shared_master = bool(data.get("shared_master", False))
+        self.warm_standby = bool(data.get("warm_standby", False))
+        self.tags = tuple(str(tag) for tag in data.get("tags") or [])
+
+        self.executable = _text(data, "executable")
+        self.server_addr = _text(data, "server_addr")
+        self.server_user = _text(data, "server_user")
+        self.key_file = os.path.expanduser(_text(data, "key_file"))
+
+        self.server_port = parse_port(data.get("server_port"))
+        if self.server_port is None:
+            self.problem = _("invalid server port {0}").format(data.get("server_port"))
+        self.local_port = parse_port(data.get("local_port"))
+        if self.local_port is None:
+            self.problem = _("invalid local port {0}").format(data.get("local_port"))
+
+        self.options = split_options(_lines(data, "extra_options"))
+        self.env_overlay = split_env(_lines(data, "env_options"))
+
+        # everything after the dynamic forward, shared by every start
+        self.argv_tail = (self.server_addr,
+                          "-p", str(self.server_port),
+                          "-l", self.server_user)
+        if self.key_file:
+            # without one ssh picks its default identities
+            self.argv_tail += ("-i", self.key_file)
+        self.argv_tail += self.options
+
+    def argv(self, forward_port=None):
+        """
+        :param forward_port: port of the dynamic forward, local port by default
+        :return: command line of the tunnel without shared master options
+        """
+        return [self.executable, "-D", str(forward_port or self.local_port)] + list(self.argv_tail)
+
+    def environment(self):
+        """
+        :return: environment of the tunnel process
+        """
+        env = os.environ.copy()
+        env.update(self.env_overlay)
+        return env
+
+    def same_connection(self, other):
+        """
+        :return: True if a tunnel of other does not have to be restarted
+                 to get the settings of this profile
+        """
+        return self.executable == other.executable and self.argv_tail == other.argv_tail and \
+            self.local_port == other.local_port and self.env_overlay == other.env_overlay and \
+            self.relay == other.relay and self.shared_master == other.shared_master and \
+            self.warm_standby == other.warm_standby
+
+    def master_key(self):
+        """
+        :return: tuple identifying the ssh session of the profile
+        """
+        return self.server_addr, str(self.server_port), self.server_user, self.key_file
+
+    def __repr__(self):
+        return "SshProfile({0}, {1!r})".format(self.id, self.name)
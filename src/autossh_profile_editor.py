@@ -8,6 +8,8 @@ Created on 05.05.17 11:02
 """
 import gui_utils as utils
 
+from locale import gettext as _
+
 class ProfileEditor:
     #keep max ssh profile id between different editors
     max_profile_id = -1
@@ -90,6 +92,11 @@ class ProfileEditor:
         self.window.show()
 
     def _on_apply(self, *args):
+        problem = self.sig_handler.check_local_port(self.ssh_profile_id, self.local_port.get_text())
+        if problem is not None:
+            if not utils.get_confirmation(self.window, _("{0}. Save anyway?").format(problem)):
+                return
+
         self.preferences_from_window(self.ssh_profile)
         self.preferences.set_raw(self.ssh_profile, "ssh_profiles", self.ssh_profile_id)
 
@@ -102,10 +109,9 @@ class ProfileEditor:
         return True #!!!
 
     def new_profile(self):
-        if ProfileEditor.max_profile_id < 0:
-            profile_ids = [p.get("id") for (k, p) in self.preferences.list_parameters("ssh_profiles")]
-            # may be empty, so append 0
-            ProfileEditor.max_profile_id = max(profile_ids + [0])
+        # profiles may have been added by import or reload meanwhile
+        ProfileEditor.max_profile_id = max(self.preferences.max_profile_id(),
+                                           ProfileEditor.max_profile_id)
 
         ProfileEditor.max_profile_id += 1
         profile_templ = self.preferences.get_copy("ssh_profile_template")
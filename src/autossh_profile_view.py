@@ -76,10 +76,16 @@ class ProfilesViewModel():
     LIST_STORE_COLUMN_TYPES = [int, str, bool, str]
 
     TOOLTIP_TEMPLATE = _("<b>{name}:</b> 127.0.0.1:{loc_port} &lt;-&gt; {serv_addr}:{serv_port}")
+    LATENCY_TEMPLATE = _("\nLatency: {rtt:.0f} ms ({state})")
+    FAILED_TEMPLATE = _("\nProbe failed")
+    RESOURCES_TEMPLATE = _("\nCPU: {cpu:.1f}% RSS: {rss:.1f} MiB FDs: {fds}")
 
-    def __init__(self, preferences, active_profiles):
+    def __init__(self, preferences, active_profiles, prober=None, resources=None):
         self.preferences = preferences
         self.active_profiles = active_profiles
+        self.prober = prober
+        self.resources = resources
+        self.tooltips = {}
         self.list_store = Gtk.ListStore(*self.LIST_STORE_COLUMN_TYPES)
 
         self.load()
@@ -89,21 +95,67 @@ class ProfilesViewModel():
         return self.list_store
 
     def load(self):
-        profiles = [(p.get("id"), p) for (k, p) in self.preferences.list_parameters("ssh_profiles")]
-        for id_, profile in sorted(profiles):
-            active = id_ in self.active_profiles
-            name = profile.get("name")
-
-            tooltip = self.TOOLTIP_TEMPLATE.format(name = name,
-                                                    loc_port = profile.get("local_port"),
-                                                    serv_addr = profile.get("server_addr"),
-                                                    serv_port = profile.get("server_port")
-                                                  )
-
-            data = [id_, name, active, tooltip]
-            self.list_store.append(data)
+        for profile in self.preferences.iter_profiles():
+            self.list_store.append(self.row(profile))
+
+    def row(self, profile):
+        id_ = profile.id
+        active = id_ in self.active_profiles
+        name = profile.name
+
+        tooltip = self.TOOLTIP_TEMPLATE.format(name = name,
+                                                loc_port = profile.local_port,
+                                                serv_addr = profile.server_addr,
+                                                serv_port = profile.server_port
+                                              )
+
+        self.tooltips[id_] = tooltip
+
+        return [id_, name, active, self.latency_tooltip(id_)]
+
+    def update_profiles(self, profile_ids):
+        """Replace rows of the given profiles, other rows are kept"""
+        for id_ in profile_ids:
+            self.tooltips.pop(id_, None)
+            position = 0
+            iter_ = self.list_store.get_iter_first()
+            while iter_ is not None:
+                row_id = self.list_store.get_value(iter_, self.PROF_ID_COL)
+                if row_id == id_:
+                    self.list_store.remove(iter_)
+                    break
+                if row_id > id_:
+                    break
+                position += 1
+                iter_ = self.list_store.iter_next(iter_)
+
+            profile = self.preferences.profile(id_)
+            if profile is not None:
+                # rows are ordered by id
+                self.list_store.insert(position, self.row(profile))
+
+    def latency_tooltip(self, profile_id):
+        tooltip = self.tooltips.get(profile_id, "")
+        if profile_id not in self.active_profiles:
+            return tooltip
+
+        if self.prober is not None:
+            rtt = self.prober.last_rtt(profile_id)
+            state = self.prober.state(profile_id)
+            if state is not None and rtt is None:
+                tooltip += self.FAILED_TEMPLATE
+            elif state is not None:
+                tooltip += self.LATENCY_TEMPLATE.format(rtt=rtt * 1000, state=state)
+
+        sample = self.resources.last(profile_id) if self.resources is not None else None
+        if sample is not None:
+            tooltip += self.RESOURCES_TEMPLATE.format(cpu=sample.cpu_percent or 0.0,
+                                                      rss=sample.rss / 1048576.0,
+                                                      fds=sample.fds)
+        return tooltip
 
     def reload(self):
+        self.tooltips.clear()
         self.list_store.clear()
         self.load()
 
@@ -121,6 +173,7 @@ class ProfilesViewModel():
             profile_id = self.list_store.get_value(iter_, self.PROF_ID_COL)
             active = profile_id in self.active_profiles
             self.list_store.set_value(iter_, self.PROF_ACTIVE_COL, active)
+            self.list_store.set_value(iter_, self.TOOLTIP_COL, self.latency_tooltip(profile_id))
 
             #go to next profile
             iter_ = self.list_store.iter_next(iter_)
@@ -135,12 +188,12 @@ class ProfilesViewModel():
         return self.get_value(path, self.PROF_ID_COL)
 
 class ProfilesView:
-    def __init__(self, builder, preferences, active_profiles, sig_handler):
+    def __init__(self, builder, preferences, active_profiles, sig_handler, prober=None, resources=None):
         self.sig_handler = sig_handler
         self.view = builder.get_object("ssh_profiles_view")
         self.selection = self.view.get_selection()
 
-        self.model = ProfilesViewModel(preferences, active_profiles)
+        self.model = ProfilesViewModel(preferences, active_profiles, prober, resources)
 
         self.view.set_model(self.model.get_model())
         self.view.set_tooltip_column(self.model.TOOLTIP_COL)
@@ -159,6 +212,9 @@ class ProfilesView:
     def reload(self):
         self.model.reload()
 
+    def update_profiles(self, profile_ids):
+        self.model.update_profiles(profile_ids)
+
     def on_profile_activation(self, widget, path, *args):
         print(widget, path, args)
         profile_id = self.model.get_profile_id(path)
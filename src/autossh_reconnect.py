@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 19.10.26 09:30
+
+@author: pavel
+"""
+import random
+import logging
+import collections
+
+from threading import Lock
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+STATE_RUNNING = "running"
+STATE_BACKOFF = "backoff"
+STATE_OPEN = "open"  # circuit breaker, no more automatic restarts
+
+
+class RestartState:
+    __slots__ = ("state", "failures", "started", "ready", "down_since", "restarts", "recoveries")
+
+    def __init__(self, history_size):
+        self.state = STATE_RUNNING
+        self.failures = 0  # consecutive
+        self.started = None
+        self.ready = None  # when the current run became usable
+        self.down_since = None
+        self.restarts = 0
+        self.recoveries = collections.deque(maxlen=history_size)  # time to recover, seconds
+
+    def as_dict(self):
+        recoveries = list(self.recoveries)
+        return {"state": self.state,
+                "failures": self.failures,
+                "restarts": self.restarts,
+                "down_for": monotonic() - self.down_since if self.down_since else None,
+                "last_recovery": recoveries[-1] if recoveries else None,
+                "avg_recovery": sum(recoveries) / len(recoveries) if recoveries else None,
+                "recoveries": recoveries}
+
+
+class ReconnectEngine:
+    """
+    Restart policy for tunnels which stopped without being asked to.
+    First restart is immediate, following ones back off exponentially
+    with jitter up to max_delay. After max_failures consecutive failures
+    the circuit opens and the tunnel stays down until connected manually.
+    A run that stays up for stable_time after it was reported ready
+    (or after its start if it never was) resets the failure counter,
+    a tunnel dropping right after authentication keeps backing off.
+    """
+    def __init__(self, base_delay=1.0, max_delay=60.0, jitter=0.2, max_failures=8,
+                 stable_time=30.0, history_size=20):
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.jitter = float(jitter)
+        self.max_failures = int(max_failures)
+        self.stable_time = float(stable_time)
+        self.history_size = history_size
+
+        self.states = {}  # profile_id -> RestartState
+        self.lock = Lock()
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        return cls(base_delay=preferences.get("app", "reconnect_base"),
+                   max_delay=preferences.get("app", "reconnect_max"),
+                   jitter=preferences.get("app", "reconnect_jitter"),
+                   max_failures=preferences.get("app", "reconnect_failures"),
+                   stable_time=preferences.get("app", "reconnect_stable"))
+
+    def _get(self, profile_id):
+        state = self.states.get(profile_id)
+        if state is None:
+            state = self.states[profile_id] = RestartState(self.history_size)
+        return state
+
+    def reset(self, profile_id):
+        """Manual connect, close the circuit"""
+        with self.lock:
+            state = self._get(profile_id)
+            state.state = STATE_RUNNING
+            state.failures = 0
+            state.down_since = None
+
+    def on_started(self, profile_id):
+        with self.lock:
+            state = self._get(profile_id)
+            state.started = monotonic()
+            state.ready = None
+            state.state = STATE_RUNNING
+
+    def on_ready(self, profile_id):
+        """Tunnel is known to be usable, failures are forgotten once it stays up"""
+        with self.lock:
+            state = self.states.get(profile_id)
+            if state is not None and state.started is not None and state.ready is None:
+                state.ready = monotonic()
+                self._recovered(profile_id, state, state.ready)
+
+    def _recovered(self, profile_id, state, now):
+        if state.down_since is not None:
+            recovery = now - state.down_since
+            state.recoveries.append(recovery)
+            state.down_since = None
+            log.info("Tunnel %s recovered in %.2f s", profile_id, recovery)
+
+    def on_stopped(self, profile_id):
+        """
+        Tunnel has stopped unexpectedly
+        :return: restart delay in seconds or None if tunnel should stay down
+        """
+        now = monotonic()
+        with self.lock:
+            state = self._get(profile_id)
+
+            up_since = state.ready if state.ready is not None else state.started
+            if up_since is not None and now - up_since >= self.stable_time:
+                # the previous run was healthy, recover it before counting the new failure
+                state.failures = 0
+                self._recovered(profile_id, state, up_since + self.stable_time)
+
+            if state.down_since is None:
+                state.down_since = now
+            state.failures += 1
+            state.started = None
+            state.ready = None
+
+            if state.failures > self.max_failures:
+                state.state = STATE_OPEN
+                log.info("Tunnel %s failed %s times in a row, giving up", profile_id, state.failures - 1)
+                return None
+
+            state.state = STATE_BACKOFF
+            state.restarts += 1
+            return self.delay(state.failures)
+
+    def delay(self, failures):
+        if failures <= 1:
+            return 0.0  # fast path, most drops are single network blips
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 2))
+        # capped after the jitter too, reconnect_max is the longest wait
+        return min(self.max_delay, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def state(self, profile_id):
+        state = self.states.get(profile_id)
+        if state is not None:
+            return state.state
+
+    def stats(self, profile_id):
+        with self.lock:
+            state = self.states.get(profile_id)
+            if state is not None:
+                return state.as_dict()
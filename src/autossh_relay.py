@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 18.10.26 15:02
+
+@author: pavel
+"""
+import socket
+import asyncio
+import logging
+import collections
+
+from threading import Thread, Lock
+from time import monotonic
+from locale import gettext as _
+
+log = logging.getLogger(__name__)
+
+LOCALHOST = "127.0.0.1"
+RELAY_TIMEOUT = 2  # seconds to wait for a relay to listen
+
+
+def free_port(host=LOCALHOST):
+    """
+    Ask the kernel for an unused port
+    :return: port number
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class RelayStats:
+    __slots__ = ("bytes_in", "bytes_out", "connections", "active", "failed", "durations")
+
+    def __init__(self, history_size=100):
+        self.bytes_in = 0  # from ssh to local clients
+        self.bytes_out = 0  # from local clients to ssh
+        self.connections = 0
+        self.active = 0
+        self.failed = 0
+        self.durations = collections.deque(maxlen=history_size)
+
+    def as_dict(self):
+        return {"bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "connections": self.connections,
+                "active": self.active,
+                "failed": self.failed,
+                "durations": list(self.durations)}
+
+
+class _Pipe(asyncio.Protocol):
+    """
+    One direction of a relayed connection.
+    Incoming data is written to the peer transport as is,
+    reading is paused while the peer cannot keep up.
+    """
+    def __init__(self, stats, outgoing):
+        self.stats = stats
+        self.outgoing = outgoing
+        self.transport = None
+        self.peer = None  # _Pipe of the other side
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def data_received(self, data):
+        if self.outgoing:
+            self.stats.bytes_out += len(data)
+        else:
+            self.stats.bytes_in += len(data)
+        self.peer.transport.write(data)
+
+    def eof_received(self):
+        if self.peer is not None and self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+            return True  # keep the other direction open
+
+    def connection_lost(self, exc):
+        if self.peer is not None:
+            self.peer.transport.close()
+
+    # flow control of the peer transport is mirrored here
+    def pause_writing(self):
+        self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        self.peer.transport.resume_reading()
+
+
+class _ClientSide(_Pipe):
+    def __init__(self, relay):
+        super(_ClientSide, self).__init__(relay.stats, outgoing=True)
+        self.relay = relay
+        self.started = None
+        self.upstream_port = None
+
+    def connection_made(self, transport):
+        super(_ClientSide, self).connection_made(transport)
+        self.started = monotonic()
+        self.stats.connections += 1
+        self.stats.active += 1
+
+        # nothing is read until upstream is connected
+        transport.pause_reading()
+        asyncio.ensure_future(self._connect_upstream())
+
+    async def _connect_upstream(self):
+        loop = asyncio.get_event_loop()
+        self.upstream_port = self.relay.acquire()
+        if self.upstream_port is None:
+            log.debug("Relay %s: no upstream available", self.relay.profile_id)
+            self.stats.failed += 1
+            self.transport.close()
+            return
+
+        try:
+            upstream_transport, upstream = await loop.create_connection(
+                lambda: _Pipe(self.stats, outgoing=False), LOCALHOST, self.upstream_port)
+        except OSError as e:
+            log.debug("Relay %s: upstream unavailable: %s", self.relay.profile_id, e)
+            self.stats.failed += 1
+            self.relay.failed(self.upstream_port)
+            self.transport.close()
+            return
+
+        if self.transport.is_closing():
+            upstream_transport.close()
+            return
+
+        self.peer, upstream.peer = upstream, self
+        self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        super(_ClientSide, self).connection_lost(exc)
+        self.stats.active -= 1
+        self.stats.durations.append(monotonic() - self.started)
+        if self.upstream_port is not None:
+            self.relay.release(self.upstream_port)
+
+
+class Relay:
+    def __init__(self, profile_id, listen_port, upstream_port):
+        self.profile_id = profile_id
+        self.listen_port = int(listen_port)
+        self.upstream_port = int(upstream_port) if upstream_port is not None else None
+        self.stats = RelayStats()
+        self.server = None
+        self.error = None  # why listening failed
+
+    # called from the loop thread for every relayed connection
+    def acquire(self):
+        """
+        :return: upstream port for a new connection or None
+        """
+        return self.upstream_port
+
+    def release(self, upstream_port):
+        """Connection to upstream_port has been closed"""
+        pass
+
+    def failed(self, upstream_port):
+        """Connection to upstream_port could not be established"""
+        pass
+
+
+class RelayServer:
+    """
+    Accounting TCP relays in front of ssh dynamic forwards.
+    Every relay listens on the profile's local port and forwards
+    to ssh listening on an internal port.
+    All relays share one asyncio loop running in its own thread.
+    """
+    def __init__(self):
+        self.relays = {}  # profile_id -> Relay
+        self.lock = Lock()
+
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = Thread(target=self._run_loop, name="relay", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.loop is not None:
+            for profile_id in list(self.relays.keys()):
+                self.remove(profile_id)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def add(self, profile_id, listen_port, upstream_port):
+        """
+        Start listening on listen_port
+        :return: concurrent.futures.Future with the Relay
+        """
+        return self.add_relay(Relay(profile_id, listen_port, upstream_port))
+
+    def add_relay(self, relay):
+        """
+        Start listening on relay.listen_port
+        :return: concurrent.futures.Future with the Relay
+        """
+        with self.lock:
+            self.relays[relay.profile_id] = relay
+        return asyncio.run_coroutine_threadsafe(self._listen(relay), self.loop)
+
+    async def _listen(self, relay):
+        try:
+            relay.server = await self.loop.create_server(lambda: _ClientSide(relay),
+                                                         LOCALHOST, relay.listen_port,
+                                                         reuse_address=True)
+            log.info("Relay %s: 127.0.0.1:%s -> 127.0.0.1:%s", relay.profile_id,
+                     relay.listen_port, relay.upstream_port)
+        except OSError as e:
+            log.error("Relay %s: can not listen on %s: %s", relay.profile_id, relay.listen_port, e)
+            relay.error = e
+            with self.lock:
+                if self.relays.get(relay.profile_id) is relay:
+                    self.relays.pop(relay.profile_id)
+        return relay
+
+    def listen(self, profile_id, listen_port, upstream_port, timeout=RELAY_TIMEOUT):
+        """
+        Start listening on listen_port and wait for it
+        :return: problem description or None if the relay is listening
+        """
+        future = self.add(profile_id, listen_port, upstream_port)
+        try:
+            relay = future.result(timeout)
+        except Exception as e:
+            self.remove(profile_id)
+            return _("relay did not start: {0}").format(str(e) or type(e).__name__)
+        if relay.server is None:
+            return _("can not listen on port {0}: {1}").format(listen_port, relay.error)
+        return None
+
+    def remove(self, profile_id):
+        with self.lock:
+            relay = self.relays.pop(profile_id, None)
+        if relay is not None:
+            self.loop.call_soon_threadsafe(self._close, relay)
+
+    def _close(self, relay):
+        if relay.server is not None:
+            relay.server.close()
+            relay.server = None
+
+    def set_upstream(self, profile_id, upstream_port):
+        """New connections of the relay will go to upstream_port"""
+        relay = self.relays.get(profile_id)
+        if relay is not None:
+            relay.upstream_port = int(upstream_port)
+
+    def stats(self, profile_id):
+        relay = self.relays.get(profile_id)
+        if relay is not None:
+            return relay.stats.as_dict()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 20.10.26 13:30
+
+@author: pavel
+"""
+import os
+import logging
+import collections
+
+from threading import Thread, Event, Lock
+from time import monotonic, time
+
+log = logging.getLogger(__name__)
+
+PROC = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_stat(pid):
+    """
+    :return: (process group, cpu ticks with reaped children, rss in pages) or None if process is gone
+    """
+    try:
+        fd = os.open("{0}/{1}/stat".format(PROC, pid), os.O_RDONLY)
+        try:
+            data = os.read(fd, 1024)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+
+    # comm may contain spaces and brackets, fields start after the last ')'
+    fields = data[data.rfind(b")") + 2:].split()
+    # state ppid pgrp session tty tpgid flags minflt cminflt majflt cmajflt utime stime cutime cstime ... rss
+    pgrp = int(fields[2])
+    # time of reaped children too, restarted ssh processes stay counted
+    ticks = int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+    rss = int(fields[21])
+    return pgrp, ticks, rss
+
+
+def count_fds(pid):
+    try:
+        return len(os.listdir("{0}/{1}/fd".format(PROC, pid)))
+    except OSError:
+        return 0
+
+
+def scan_groups(groups):
+    """
+    One pass over /proc
+    :param groups: set of process group ids of interest
+    :return: dict pgrp -> [cpu ticks, rss pages, fds, processes]
+    """
+    totals = {}
+    for entry in os.listdir(PROC):
+        if not entry.isdigit():
+            continue
+        stat = read_stat(entry)
+        if stat is None or stat[0] not in groups:
+            continue
+
+        pgrp, ticks, rss = stat
+        total = totals.get(pgrp)
+        if total is None:
+            total = totals[pgrp] = [0, 0, 0, 0]
+        total[0] += ticks
+        total[1] += rss
+        total[2] += count_fds(entry)
+        total[3] += 1
+    return totals
+
+
+class ResourceSample:
+    __slots__ = ("timestamp", "cpu_percent", "cpu_seconds", "rss", "fds", "processes")
+
+    def __init__(self, timestamp, cpu_percent, cpu_seconds, rss, fds, processes):
+        self.timestamp = timestamp
+        self.cpu_percent = cpu_percent
+        self.cpu_seconds = cpu_seconds
+        self.rss = rss
+        self.fds = fds
+        self.processes = processes
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ResourceSampler:
+    """
+    Periodic CPU, RSS and open descriptors accounting of every tunnel.
+    Every autossh is started in its own session, so its process group
+    holds ssh children as well.
+    """
+    def __init__(self, active_profiles, interval=10.0, history_size=60):
+        self.active_profiles = active_profiles
+        self.interval = float(interval)
+        self.history_size = int(history_size)
+
+        self.histories = {}  # profile_id -> deque of ResourceSample
+        self.last_ticks = {}  # profile_id -> (pgid, ticks, monotonic time)
+        self.lock = Lock()
+
+        self.wake = Event()
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_preferences(cls, preferences, active_profiles):
+        return cls(active_profiles,
+                   interval=preferences.get("app", "resource_interval"),
+                   history_size=preferences.get("app", "resource_history"))
+
+    def start(self):
+        if self.thread is None and self.interval > 0:
+            self.running = True
+            self.thread = Thread(target=self._loop, name="resource-sampler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def _loop(self):
+        while self.running:
+            try:
+                self.sample_all()
+            except Exception as e:
+                log.exception(e)
+
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def _groups(self):
+        groups = {}
+        for profile_id, client in list(self.active_profiles.items()):
+            process = client.process
+            if process is not None:
+                groups[process.pid] = profile_id  # session leader, pgid == pid
+        return groups
+
+    def sample_all(self):
+        groups = self._groups()
+        totals = scan_groups(set(groups.keys())) if groups else {}
+
+        now = monotonic()
+        timestamp = time()
+        alive = set(groups.values())
+        with self.lock:
+            for profile_id in list(self.histories.keys()):
+                if profile_id not in alive:
+                    self.histories.pop(profile_id)
+                    self.last_ticks.pop(profile_id, None)
+
+            for pgid, profile_id in groups.items():
+                total = totals.get(pgid)
+                if total is None:
+                    continue
+                ticks, rss, fds, processes = total
+
+                cpu_percent = None
+                last = self.last_ticks.get(profile_id)
+                # a process exiting unreaped by the group takes its ticks along, start over then
+                if last is not None and last[0] == pgid and now > last[2] and ticks >= last[1]:
+                    cpu_percent = 100.0 * (ticks - last[1]) / CLOCK_TICKS / (now - last[2])
+                self.last_ticks[profile_id] = (pgid, ticks, now)
+
+                history = self.histories.get(profile_id)
+                if history is None:
+                    history = self.histories[profile_id] = collections.deque(maxlen=self.history_size)
+                history.append(ResourceSample(timestamp, cpu_percent, ticks / CLOCK_TICKS,
+                                              rss * PAGE_SIZE, fds, processes))
+
+    def last(self, profile_id):
+        """
+        :return: latest ResourceSample or None
+        """
+        history = self.histories.get(profile_id)
+        if history:
+            return history[-1]
+
+    def history(self, profile_id):
+        """
+        :return: list of dicts, oldest first
+        """
+        with self.lock:
+            return [sample.as_dict() for sample in self.histories.get(profile_id, ())]
+
+    def status(self, profile_id):
+        sample = self.last(profile_id)
+        if sample is not None:
+            return sample.as_dict()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 18.10.26 11:40
+
+@author: pavel
+"""
+import heapq
+import random
+import logging
+
+from threading import Thread, Condition
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.stamp = monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, now):
+        """
+        :return: 0 if token was taken or seconds to wait for the next one
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def empty(self, now):
+        """
+        :return: True if take would fail, no token is taken
+        """
+        self._refill(now)
+        return self.tokens < 1
+
+
+class ConnectionScheduler:
+    """
+    Admission control for tunnel starts.
+    Every start waits for a jittered delay, a token from the global bucket
+    and a free concurrency slot. A slot is held until release() is called
+    or hold_time has passed, whichever comes first.
+    """
+    def __init__(self, max_concurrent=8, rate=4.0, burst=8, jitter=0.5, hold_time=5.0):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.jitter = float(jitter)
+        self.hold_time = float(hold_time)
+        self.bucket = TokenBucket(rate, burst)
+
+        self.queue = []  # heap of (ready_time, seq, profile_id)
+        self.pending = {}  # profile_id -> (start_cb, submit_time)
+        self.in_flight = {}  # profile_id -> slot expiration time
+        self.seq = 0
+
+        self.started = 0
+        self.wait_last = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        self.cond = Condition()
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        return cls(max_concurrent=preferences.get("app", "connect_concurrency"),
+                   rate=preferences.get("app", "connect_rate"),
+                   burst=preferences.get("app", "connect_burst"),
+                   jitter=preferences.get("app", "connect_jitter"),
+                   hold_time=preferences.get("app", "connect_hold"))
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._loop, name="connection-scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def submit(self, profile_id, start_cb, delay=0.0):
+        """
+        Queue tunnel start
+        :param profile_id: id of the profile, one pending start per profile
+        :param start_cb: function without arguments, called from scheduler thread
+        :param delay: minimal delay in seconds before the start
+        """
+        now = monotonic()
+        ready = now + delay + random.uniform(0, self.jitter)
+        with self.cond:
+            if profile_id in self.pending:
+                # keep the place in the queue
+                self.pending[profile_id] = (start_cb, self.pending[profile_id][1])
+                return
+
+            self.seq += 1
+            self.pending[profile_id] = (start_cb, now)
+            heapq.heappush(self.queue, (ready, self.seq, profile_id))
+            self.cond.notify()
+
+    def cancel(self, profile_id):
+        """
+        Drop pending start
+        :return: True if start was pending
+        """
+        with self.cond:
+            # heap entry is skipped lazily
+            return self.pending.pop(profile_id, None) is not None
+
+    def is_pending(self, profile_id):
+        return profile_id in self.pending
+
+    def release(self, profile_id):
+        """Tunnel has finished its handshake or has stopped"""
+        with self.cond:
+            if self.in_flight.pop(profile_id, None) is not None:
+                self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return {"queue_depth": len(self.pending),
+                    "in_flight": len(self.in_flight),
+                    "started": self.started,
+                    "wait_last": self.wait_last,
+                    "wait_avg": self.wait_total / self.started if self.started else 0.0,
+                    "wait_max": self.wait_max}
+
+    def _expire_slots(self, now):
+        expired = [id_ for id_, until in self.in_flight.items() if until <= now]
+        for id_ in expired:
+            self.in_flight.pop(id_)
+
+        if self.in_flight:
+            return min(self.in_flight.values()) - now
+
+    def _next_start(self):
+        """
+        Called with lock held
+        :return: (profile_id, start_cb, None) or (None, None, seconds to wait)
+        """
+        while self.queue and self.queue[0][2] not in self.pending:
+            heapq.heappop(self.queue)  # cancelled
+        if not self.queue:
+            return None, None, None
+
+        now = monotonic()
+        ready, seq, profile_id = self.queue[0]
+        if ready > now:
+            return None, None, ready - now
+
+        slot_wait = self._expire_slots(now)
+        if len(self.in_flight) >= self.max_concurrent:
+            return None, None, slot_wait
+
+        token_wait = self.bucket.take(now)
+        if token_wait > 0:
+            return None, None, token_wait
+
+        heapq.heappop(self.queue)
+        start_cb, submitted = self.pending.pop(profile_id)
+        self.in_flight[profile_id] = now + self.hold_time
+
+        wait = now - submitted
+        self.started += 1
+        self.wait_last = wait
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+        return profile_id, start_cb, None
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+                profile_id, start_cb, timeout = self._next_start()
+                if profile_id is None:
+                    self.cond.wait(timeout)
+                    continue
+
+            log.debug("Starting %s", profile_id)
+            try:
+                start_cb()
+            except Exception as e:
+                log.exception(e)
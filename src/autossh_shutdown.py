@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 21.10.26 14:20
+
+@author: pavel
+"""
+import os
+import signal
+import logging
+import selectors
+
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+KILL_GRACE = 0.5  # seconds to wait for killed process groups
+POLL_INTERVAL = 0.01  # without pidfd support
+
+
+def signal_group(process, sig):
+    """
+    Signal the whole session of the process, autossh is started as a session leader
+    :return: False if the process is gone
+    """
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # pid has been reused by a process of somebody else
+        return False
+    return True
+
+
+class ShutdownCoordinator:
+    """
+    Stops many tunnels at once: every process group gets SIGTERM
+    in one pass, exits are awaited against a single deadline and
+    groups still alive after it get SIGKILL.
+    """
+    def __init__(self, timeout=1.0, kill_grace=KILL_GRACE):
+        self.timeout = float(timeout)
+        self.kill_grace = float(kill_grace)
+
+    @classmethod
+    def from_preferences(cls, preferences):
+        return cls(timeout=preferences.get("app", "shutdown_timeout"))
+
+    def run(self, clients):
+        """
+        Stop clients and wait for their processes
+        :param clients: AutosshClient list
+        :return: dict profile_id -> {"latency": seconds or None, "killed": bool}
+        """
+        started = monotonic()
+        pending = {}  # pid -> (client, process, pidfd)
+        report = {}
+
+        for client in clients:
+            process = client.process
+            if process is not None and process.returncode is None:
+                # opened before signalling so the pid can not be reused meanwhile
+                pending[process.pid] = (client, process, self._pidfd(process))
+            report[client.prof_id] = {"latency": 0.0, "killed": False}
+
+        for client in clients:
+            client.stop()
+
+        pending = self._wait(pending, report, started, started + self.timeout)
+
+        if pending:
+            log.warning("%d tunnels did not stop in %.1f s, killing", len(pending), self.timeout)
+            for client, process, pidfd in pending.values():
+                report[client.prof_id]["killed"] = True
+                signal_group(process, signal.SIGKILL)
+            pending = self._wait(pending, report, started, monotonic() + self.kill_grace)
+
+        for client, process, pidfd in pending.values():
+            log.error("%s: process %s is still alive", client.prof_name, process.pid)
+            report[client.prof_id]["latency"] = None
+            self._close(pidfd)
+
+        log.info("Stopped %d tunnels in %.3f s", len(report), monotonic() - started)
+        return report
+
+    def _pidfd(self, process):
+        pidfd_open = getattr(os, "pidfd_open", None)
+        if pidfd_open is not None:
+            try:
+                return pidfd_open(process.pid)
+            except OSError as e:
+                log.debug("pidfd_open failed: %s", e)
+        return None
+
+    def _close(self, pidfd):
+        if pidfd is not None:
+            os.close(pidfd)
+
+    def _exited(self, entry, report, started):
+        client, process, pidfd = entry
+        # a standby shares the entry of its profile
+        stats = report[client.prof_id]
+        stats["latency"] = max(stats["latency"], monotonic() - started)
+        self._close(pidfd)
+
+    def _wait(self, pending, report, started, deadline):
+        """
+        :return: entries of processes still alive at the deadline
+        """
+        pending = dict(pending)
+        with selectors.DefaultSelector() as selector:
+            for pid, (client, process, pidfd) in pending.items():
+                if pidfd is not None:
+                    selector.register(pidfd, selectors.EVENT_READ, pid)
+
+            while pending:
+                # exits are reaped by the supervisor, returncode is cached by Popen
+                polled = False
+                for pid, (client, process, pidfd) in list(pending.items()):
+                    if pidfd is None:
+                        polled = True
+                        if process.poll() is not None:
+                            self._exited(pending.pop(pid), report, started)
+
+                remaining = deadline - monotonic()
+                if not pending or remaining <= 0:
+                    break
+
+                for key, mask in selector.select(min(remaining, POLL_INTERVAL) if polled else remaining):
+                    selector.unregister(key.fd)
+                    self._exited(pending.pop(key.data), report, started)
+
+        return pending
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 26.10.26 10:20
+
+@author: pavel
+
+SQLite storage of ssh profiles for very large profile sets.
+A profile is kept as its json dict, fields used for lookups are
+duplicated into indexed columns. The store behaves like the
+ssh_profiles dict of the preferences, so Preferences keeps its API.
+"""
+import os
+import json
+import logging
+
+from threading import Lock
+
+from autossh_ports import parse_port
+
+log = logging.getLogger(__name__)
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+PAGE_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    server_addr TEXT NOT NULL DEFAULT '',
+    local_port INTEGER,
+    autostart INTEGER NOT NULL DEFAULT 0,
+    show_in_menu INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profiles_name ON profiles (name);
+CREATE INDEX IF NOT EXISTS profiles_server ON profiles (server_addr);
+CREATE INDEX IF NOT EXISTS profiles_autostart ON profiles (autostart) WHERE autostart;
+CREATE INDEX IF NOT EXISTS profiles_menu ON profiles (show_in_menu) WHERE show_in_menu;
+CREATE TABLE IF NOT EXISTS profile_tags (
+    tag TEXT NOT NULL,
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    PRIMARY KEY (tag, profile_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS profile_tags_profile ON profile_tags (profile_id);
+"""
+
+
+def available():
+    return sqlite3 is not None
+
+
+class SqliteProfileStore:
+    """
+    Dict-like: keys are profile ids as strings, values are decoded profile dicts.
+    Values are copies, changed profiles have to be stored again.
+    Every write is a transaction of its own, update() writes many at once.
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self.lock = Lock()  # one connection shared by every thread
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _row(self, key, profile):
+        return (int(key), str(profile.get("name", "")), str(profile.get("server_addr", "")).strip(),
+                parse_port(profile.get("local_port")),
+                int(bool(profile.get("autostart", False))),
+                int(bool(profile.get("show_in_menu", False))),
+                json.dumps(profile))
+
+    def _put(self, key, profile):
+        row = self._row(key, profile)
+        self.db.execute("INSERT OR REPLACE INTO profiles "
+                        "(id, name, server_addr, local_port, autostart, show_in_menu, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+        self.db.execute("DELETE FROM profile_tags WHERE profile_id = ?", (row[0],))
+        tags = profile.get("tags") or []
+        self.db.executemany("INSERT OR IGNORE INTO profile_tags (tag, profile_id) VALUES (?, ?)",
+                            [(str(tag), row[0]) for tag in tags])
+
+    # dict interface
+    def __getitem__(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT data FROM profiles WHERE id = ?", (int(key),)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, ValueError):
+            return default
+
+    def __setitem__(self, key, profile):
+        with self.lock, self.db:
+            self._put(key, profile)
+
+    def __delitem__(self, key):
+        with self.lock, self.db:
+            cursor = self.db.execute("DELETE FROM profiles WHERE id = ?", (int(key),))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            key = int(key)
+        except ValueError:
+            return False
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM profiles WHERE id = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT count(*) FROM profiles").fetchone()[0]
+
+    def __iter__(self):
+        return (key for key, profile in self.items())
+
+    def keys(self):
+        with self.lock:
+            return [str(row[0]) for row in self.db.execute("SELECT id FROM profiles ORDER BY id")]
+
+    def items(self):
+        """Read page by page, only one page is decoded at a time"""
+        after_id = -1
+        while True:
+            rows = self.page(after_id)
+            if not rows:
+                return
+            for profile_id, profile in rows:
+                yield str(profile_id), profile
+            after_id = rows[-1][0]
+
+    def pop(self, key, *default):
+        with self.lock, self.db:
+            row = self.db.execute("SELECT data FROM profiles WHERE id = ?", (int(key),)).fetchone()
+            if row is not None:
+                self.db.execute("DELETE FROM profiles WHERE id = ?", (int(key),))
+        if row is not None:
+            return json.loads(row[0])
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, profiles):
+        """
+        Write many profiles in one transaction
+        :param profiles: dict profile id -> profile dict
+        """
+        with self.lock, self.db:
+            for key, profile in profiles.items():
+                self._put(key, profile)
+
+    # queries
+    def page(self, after_id=-1, limit=PAGE_SIZE, name=None, server_addr=None, tag=None,
+             autostart=None, show_in_menu=None):
+        """
+        :param after_id: return profiles with larger ids
+        :param name: substring of the name, case insensitive
+        :return: [(profile id, profile dict)] ordered by id
+        """
+        conditions, args = ["p.id > ?"], [int(after_id)]
+        if name:
+            conditions.append("p.name LIKE ? ESCAPE '\\'")
+            args.append("%" + name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if server_addr is not None:
+            conditions.append("p.server_addr = ?")
+            args.append(server_addr)
+        if autostart is not None:
+            conditions.append("p.autostart = ?")
+            args.append(int(autostart))
+        if show_in_menu is not None:
+            conditions.append("p.show_in_menu = ?")
+            args.append(int(show_in_menu))
+        if tag is not None:
+            conditions.append("p.id IN (SELECT profile_id FROM profile_tags WHERE tag = ?)")
+            args.append(tag)
+        args.append(int(limit))
+
+        query = "SELECT p.id, p.data FROM profiles p WHERE {0} ORDER BY p.id LIMIT ?".format(
+            " AND ".join(conditions))
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [(profile_id, json.loads(data)) for profile_id, data in rows]
+
+    def max_id(self):
+        with self.lock:
+            return self.db.execute("SELECT max(id) FROM profiles").fetchone()[0] or 0
+
+    def local_ports(self):
+        """
+        :return: [(profile id, local port or None)]
+        """
+        with self.lock:
+            return self.db.execute("SELECT id, local_port FROM profiles").fetchall()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 18.10.26 10:05
+
+@author: pavel
+"""
+import os
+import errno
+import signal
+import logging
+import selectors
+
+from collections import deque
+from threading import Thread, Lock
+
+from autossh_log import profile_extra, dispatcher
+from autossh_shutdown import signal_group
+
+log = logging.getLogger(__name__)
+
+
+class _Tunnel:
+    """Per-process bookkeeping kept by the supervisor loop"""
+    __slots__ = ("client", "process", "on_stop_cb", "stdout_fd", "pid_fd", "partial", "finished",
+                 "extra")
+
+    def __init__(self, client, process, on_stop_cb):
+        self.client = client
+        self.process = process
+        self.on_stop_cb = on_stop_cb
+
+        self.stdout_fd = process.stdout.fileno()
+        self.pid_fd = None
+        self.partial = bytearray()
+        self.finished = False
+        self.extra = profile_extra(client.prof_id)  # routes output to the log ring of the profile
+
+
+class TunnelSupervisor:
+    """
+    Single thread multiplexing the output pipes and exit notifications
+    of every autossh child.
+    Pipes are read in bulk chunks, exits are detected with pidfd
+    when the platform supports it and by polling otherwise.
+    """
+    READ_CHUNK = 65536
+    MAX_LINE = 65536
+
+    def __init__(self, poll_interval=0.1):
+        self.poll_interval = poll_interval
+
+        self.selector = selectors.DefaultSelector()
+        self.tunnels = {}  # stdout fd -> _Tunnel
+        self.orphans = {}  # stdout fd -> _Tunnel, pipe closed but process alive
+
+        self.calls = deque()  # functions to be run in the loop thread
+        self.lock = Lock()
+
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, None)
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = Thread(target=self._loop, name="tunnel-supervisor", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wakeup()
+
+    def spawn(self, client, on_stop_cb):
+        """
+        Start client process from the supervisor thread
+        :param client: AutosshClient
+        :param on_stop_cb: function(profile_id, return_code)
+        """
+        self.call_soon(self._spawn, client, on_stop_cb)
+
+    def call_soon(self, func, *args):
+        """Run function in the supervisor thread"""
+        with self.lock:
+            self.calls.append((func, args))
+        self._wakeup()
+
+    def tunnel_count(self):
+        return len(self.tunnels) + len(self.orphans)
+
+    def _wakeup(self):
+        try:
+            os.write(self.wakeup_w, b"\0")
+        except BlockingIOError:
+            pass  # loop is already going to wake up
+
+    def _loop(self):
+        while self.running:
+            timeout = self.poll_interval if self.orphans else None
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    self._drain_wakeup()
+                else:
+                    kind, tunnel = key.data
+                    if tunnel.finished:
+                        continue  # stale event from the same batch
+                    if kind == "out":
+                        self._read(tunnel)
+                    else:
+                        self._check_exit(tunnel)
+
+            self._run_calls()
+
+            if self.orphans:
+                for tunnel in list(self.orphans.values()):
+                    self._check_exit(tunnel)
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _run_calls(self):
+        while True:
+            with self.lock:
+                if not self.calls:
+                    return
+                func, args = self.calls.popleft()
+            try:
+                func(*args)
+            except Exception as e:
+                log.exception(e)
+
+    def _spawn(self, client, on_stop_cb):
+        if client.stopping:
+            # disconnected after the start was handed over, nobody would own the process
+            log.debug("%s: stopped before start", client.prof_name)
+            on_stop_cb(client.prof_id, None)
+            return
+
+        try:
+            process = client.start_process()
+        except Exception as e:
+            log.exception(e)
+            log.info("%s:unexpected error: %s", client.prof_name, str(e),
+                     extra=profile_extra(client.prof_id))
+            client.process = None
+            on_stop_cb(client.prof_id, -1)
+            return
+
+        if client.stopping:
+            # stop() came while the process was being started, it missed the process
+            signal_group(process, signal.SIGTERM)
+
+        tunnel = _Tunnel(client, process, on_stop_cb)
+        os.set_blocking(tunnel.stdout_fd, False)
+
+        self.tunnels[tunnel.stdout_fd] = tunnel
+        self.selector.register(tunnel.stdout_fd, selectors.EVENT_READ, ("out", tunnel))
+
+        pidfd_open = getattr(os, "pidfd_open", None)
+        if pidfd_open is not None:
+            try:
+                tunnel.pid_fd = pidfd_open(process.pid)
+                self.selector.register(tunnel.pid_fd, selectors.EVENT_READ, ("exit", tunnel))
+            except OSError as e:
+                # old kernel, fall back to polling after the pipe is closed
+                log.debug("pidfd_open failed: %s", e)
+                tunnel.pid_fd = None
+
+    def _read(self, tunnel):
+        """Read everything available from the pipe, return False on EOF"""
+        while True:
+            try:
+                chunk = os.read(tunnel.stdout_fd, self.READ_CHUNK)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                chunk = b""
+
+            if not chunk:
+                self._on_eof(tunnel)
+                return False
+
+            self._split_lines(tunnel, chunk)
+
+            if len(chunk) < self.READ_CHUNK:
+                return True
+
+    def _split_lines(self, tunnel, chunk):
+        partial = tunnel.partial
+        partial += chunk
+
+        end = partial.rfind(b"\n")
+        if end < 0:
+            if len(partial) >= self.MAX_LINE:
+                self._log_line(tunnel, bytes(partial))
+                partial.clear()
+            return
+
+        for line in partial[:end].split(b"\n"):
+            self._log_line(tunnel, line)
+        del partial[:end + 1]
+
+    def _log_line(self, tunnel, line):
+        line = line.rstrip(b"\r")
+        if line:
+            text = line.decode("utf-8", "replace")
+            args = (tunnel.client.prof_name, text)
+            # most of the chatter is repeated, no record is made for a repeat
+            if not dispatcher.absorbed(tunnel.client.prof_id, logging.INFO, "%s: %s", args):
+                log.info("%s: %s", *args, extra=tunnel.extra)
+
+            if tunnel.client.event_parser is not None:
+                tunnel.client.event_parser.feed(text)
+
+    def _on_eof(self, tunnel):
+        if tunnel.partial:
+            self._log_line(tunnel, bytes(tunnel.partial))
+            tunnel.partial.clear()
+
+        self.selector.unregister(tunnel.stdout_fd)
+        self.tunnels.pop(tunnel.stdout_fd, None)
+
+        if tunnel.process.poll() is not None:
+            self._finish(tunnel)
+        elif tunnel.pid_fd is None:
+            self.orphans[tunnel.stdout_fd] = tunnel
+        # otherwise wait for pidfd notification
+
+    def _check_exit(self, tunnel):
+        if tunnel.process.poll() is None:
+            return
+
+        if tunnel.stdout_fd in self.tunnels:
+            # collect the last words of the process
+            if not self._read(tunnel):
+                return  # _on_eof has finished the tunnel
+            self.selector.unregister(tunnel.stdout_fd)
+            self.tunnels.pop(tunnel.stdout_fd, None)
+
+        self._finish(tunnel)
+
+    def _finish(self, tunnel):
+        tunnel.finished = True
+        self.orphans.pop(tunnel.stdout_fd, None)
+
+        if tunnel.pid_fd is not None:
+            self.selector.unregister(tunnel.pid_fd)
+            os.close(tunnel.pid_fd)
+            tunnel.pid_fd = None
+
+        for pipe in (tunnel.process.stdin, tunnel.process.stdout):
+            try:
+                if pipe is not None:
+                    pipe.close()
+            except OSError:
+                pass
+
+        client = tunnel.client
+        return_code = tunnel.process.returncode
+        log.info("%s:return code %s", client.prof_name, return_code, extra=tunnel.extra)
+
+        client.process = None
+        try:
+            tunnel.on_stop_cb(client.prof_id, return_code)
+        except Exception as e:
+            log.exception(e)
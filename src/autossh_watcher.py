@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Created on 24.10.26 10:15
+
+@author: pavel
+
+Watches the configuration file for changes made by other programs.
+inotify is used through ctypes, the directory is watched because
+editors and provisioning tools replace the file rather than write it.
+Without inotify the file is polled by mtime, size and inode.
+"""
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+from threading import Thread, Event
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+SETTLE_TIME = 0.2  # seconds without events before the file is read
+STOP_CHECK = 0.5  # seconds
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1  # missing on old or foreign libcs
+        return libc
+    except (OSError, AttributeError) as e:
+        log.debug("inotify is not available: %s", e)
+        return None
+
+
+class ConfigWatcher:
+    """
+    Calls on_change_cb from the watcher thread after the file has changed,
+    bursts of events are reported once
+    """
+    def __init__(self, path, on_change_cb, poll_interval=1.0):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.directory, self.name = os.path.split(self.path)
+        self.on_change_cb = on_change_cb
+        self.poll_interval = float(poll_interval)
+
+        self.stopped = Event()
+        self.thread = None
+
+    @classmethod
+    def from_preferences(cls, preferences, on_change_cb):
+        return cls(preferences.conf_file, on_change_cb,
+                   poll_interval=preferences.get("app", "config_watch_interval"))
+
+    def start(self):
+        if self.thread is None:
+            fd = self._inotify()
+            target = self._watch if fd is not None else self._poll
+            self.thread = Thread(target=target, args=(fd,), name="config-watcher", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _inotify(self):
+        """
+        :return: inotify descriptor watching the directory or None
+        """
+        libc = _libc()
+        if libc is None:
+            return None
+
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if fd < 0:
+            log.info("inotify_init1 failed: %s", os.strerror(ctypes.get_errno()))
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        wd = libc.inotify_add_watch(fd, self.directory.encode(), WATCH_MASK)
+        if wd < 0:
+            log.info("Can not watch %s: %s", self.directory, os.strerror(ctypes.get_errno()))
+            os.close(fd)
+            return None
+        return fd
+
+    def _changed(self):
+        try:
+            self.on_change_cb()
+        except Exception as e:
+            log.exception(e)
+
+    def _watch(self, fd):
+        log.debug("Watching %s with inotify", self.path)
+        pending = None  # time of the last event not reported yet
+        try:
+            while not self.stopped.is_set():
+                timeout = STOP_CHECK if pending is None else \
+                    max(0.0, pending + SETTLE_TIME - monotonic())
+                readable = select.select([fd], [], [], timeout)[0]
+
+                if readable and self._read_events(fd):
+                    pending = monotonic()
+                elif pending is not None and monotonic() - pending >= SETTLE_TIME:
+                    pending = None
+                    self._changed()
+        finally:
+            os.close(fd)
+
+    def _read_events(self, fd):
+        """
+        :return: True if the watched file is among the events
+        """
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+
+        found = False
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b"\0").decode("utf-8", "replace")
+            pos += length
+            if name == self.name or mask & IN_Q_OVERFLOW:
+                found = True
+        return found
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _poll(self, fd=None):
+        log.debug("Polling %s every %.1f s", self.path, self.poll_interval)
+        last = self._stat()
+        while not self.stopped.wait(self.poll_interval):
+            current = self._stat()
+            if current != last:
+                last = current
+                self._changed()